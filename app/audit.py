@@ -0,0 +1,167 @@
+from datetime import datetime
+import logging
+import queue
+import threading
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+DURABLE_ACTIONS = {a.strip() for a in settings.audit_durable_actions.split(",") if a.strip()}
+_PENDING_KEY = "audit_pending"
+
+
+def _row(user_id: int, action: str, target_type: str, target_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "action": action,
+        "target_type": target_type,
+        "target_id": target_id,
+        "timestamp": datetime.utcnow(),
+    }
+
+
+def _write_batch(rows: list[dict]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(insert(AuditLog), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+class AuditWriter:
+    # طابور محدود في الذاكرة + thread خلفي يكتب السجلات دفعات بجملة INSERT واحدة
+    def __init__(self, max_buffer: int, batch_size: int, flush_interval_sec: float, enqueue_timeout_sec: float):
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.enqueue_timeout_sec = enqueue_timeout_sec
+        self._queue: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if not self.running:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, row: dict) -> bool:
+        # backpressure: ننتظر قليلًا إن كان الطابور ممتلئًا، ثم نترك المستدعي يكتب بنفسه
+        if not self.running:
+            return False
+        try:
+            self._queue.put(row, timeout=self.enqueue_timeout_sec)
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self) -> None:
+        if self.running:
+            self._queue.join()
+
+    def _drain(self, first: dict) -> list[dict]:
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval_sec)
+            except queue.Empty:
+                continue
+            batch = self._drain(first)
+            try:
+                _write_batch(batch)
+            except Exception:
+                logger.exception("Failed to write %d audit rows, retrying once", len(batch))
+                try:
+                    _write_batch(batch)
+                except Exception:
+                    logger.exception("Dropping %d audit rows", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+audit_writer = AuditWriter(
+    max_buffer=settings.audit_buffer_size,
+    batch_size=settings.audit_batch_size,
+    flush_interval_sec=settings.audit_flush_interval_sec,
+    enqueue_timeout_sec=settings.audit_enqueue_timeout_sec,
+)
+
+
+def _submit_or_write(rows: list[dict]) -> None:
+    # أول رفض يعني أن الطابور ممتلئ: لا ننتظر المهلة مرة لكل صف (عملية جماعية بآلاف الصفوف)،
+    # بل نكتب الباقي مباشرة بجملة واحدة
+    for index, row in enumerate(rows):
+        if not audit_writer.submit(row):
+            _write_batch(rows[index:])
+            return
+
+
+def record_audit(
+    db: Session,
+    user_id: int,
+    action: str,
+    target_type: str,
+    target_id: str,
+    durable: bool | None = None,
+) -> None:
+    row = _row(user_id, action, target_type, target_id)
+    if durable is None:
+        durable = settings.audit_mode == "sync" or action in DURABLE_ACTIONS
+    if durable:
+        # الإجراءات الحساسة تُكتب داخل نفس transaction العملية: إما الاثنان أو لا شيء
+        db.add(AuditLog(**row))
+        return
+    # غير ذلك تُؤجل حتى ينجح الـ commit ثم تذهب للطابور؛ وتُهمل إن حصل rollback
+    db.info.setdefault(_PENDING_KEY, []).append(row)
+
+
+def record_audit_now(user_id: int, action: str, target_type: str, target_id: str) -> None:
+    # لعمليات القراءة (مثل التنزيل) التي لا تملك transaction كتابة تنتظر الـ commit
+    row = _row(user_id, action, target_type, target_id)
+    if settings.audit_mode == "sync" or action in DURABLE_ACTIONS:
+        _write_batch([row])
+        return
+    _submit_or_write([row])
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _enqueue_after_commit(session: Session) -> None:
+    if session.in_nested_transaction():
+        return
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        _submit_or_write(rows)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+import threading
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .models import CacheEpoch
+
+
+class TTLCache:
+    # LRU محدود الحجم مع انتهاء صلاحية لكل مدخل، آمن للاستخدام من عدة threads
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_sec: float | None = None) -> None:
+        ttl = self.ttl_sec if ttl_sec is None else min(ttl_sec, self.ttl_sec)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class EpochWatcher:
+    # رقم إصدار مشترك في قاعدة البيانات: أي worker يغيّر البيانات يزيده، والبقية يفرغون الكاش عند ملاحظة التغيير
+    def __init__(self, name: str, poll_sec: float, on_change):
+        self.name = name
+        self.poll_sec = poll_sec
+        self._on_change = on_change
+        self._seen: int | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _due(self) -> bool:
+        # يحجز دورة الفحص قبل الاستعلام، فلا يُمسك القفل أثناء انتظار قاعدة البيانات (المسار غير المتزامن)
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_sec:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.poll_sec:
+                return False
+            self._checked_at = now
+            return True
+
+    def _observe(self, version: int | None) -> None:
+        version = version or 0
+        if self._seen is not None and version != self._seen:
+            self._on_change()
+        self._seen = version
+
+    def _version_query(self):
+        return select(CacheEpoch.version).where(CacheEpoch.name == self.name)
+
+    def check(self, db: Session) -> None:
+        if self._due():
+            self._observe(db.scalar(self._version_query()))
+
+    async def check_async(self, db: AsyncSession) -> None:
+        if self._due():
+            self._observe(await db.scalar(self._version_query()))
+
+    def bump(self, db: Session) -> None:
+        # يُستدعى داخل نفس transaction التغيير، فيصبح الإبطال مرئيًا للبقية مع الـ commit
+        bumped = db.execute(
+            update(CacheEpoch).where(CacheEpoch.name == self.name).values(version=CacheEpoch.version + 1)
+        ).rowcount
+        if not bumped:
+            db.add(CacheEpoch(name=self.name, version=1))
+        self._on_change()
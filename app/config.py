@@ -7,12 +7,68 @@ class Settings:
     app_name: str = os.getenv("APP_NAME", "Daghbas Share API")
     app_version: str = os.getenv("APP_VERSION", "0.2.0")
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./daghbas_share.db")
+    startup_maintenance: bool = os.getenv("STARTUP_MAINTENANCE", "true").lower() in ("1", "true", "yes")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    db_async_pool_size: int = int(os.getenv("DB_ASYNC_POOL_SIZE", "2"))
+    db_async_max_overflow: int = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "2"))
+    db_pool_timeout_sec: float = float(os.getenv("DB_POOL_TIMEOUT_SEC", "10"))
+    db_pool_recycle_sec: int = int(os.getenv("DB_POOL_RECYCLE_SEC", "1800"))
+    db_pool_pre_ping: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    db_pgbouncer: bool = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+    db_query_cache_size: int = int(os.getenv("DB_QUERY_CACHE_SIZE", "500"))
+    db_statement_cache_size: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+    read_replica_urls: str = os.getenv("READ_REPLICA_URLS", "")
+    replica_max_lag_sec: float = float(os.getenv("REPLICA_MAX_LAG_SEC", "5"))
+    replica_lag_check_sec: float = float(os.getenv("REPLICA_LAG_CHECK_SEC", "5"))
+    read_your_writes_sec: float = float(os.getenv("READ_YOUR_WRITES_SEC", "10"))
     secret_key: str = os.getenv("SECRET_KEY", "dev-secret-key-change-me")
     algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
     access_expire_min: int = int(os.getenv("ACCESS_EXPIRE_MIN", "15"))
     refresh_expire_days: int = int(os.getenv("REFRESH_EXPIRE_DAYS", "7"))
     installation_master_key: str = os.getenv("INSTALLATION_MASTER_KEY", "change-me-master-key")
     license_secret: str = os.getenv("LICENSE_SECRET", "change-me-license-secret")
+    bcrypt_rounds: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    password_workers: int = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+    password_max_pending: int = int(os.getenv("PASSWORD_MAX_PENDING", "64"))
+    password_retry_after_sec: int = int(os.getenv("PASSWORD_RETRY_AFTER_SEC", "2"))
+    principal_cache_size: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+    principal_cache_ttl_sec: float = float(os.getenv("PRINCIPAL_CACHE_TTL_SEC", "60"))
+    cache_epoch_poll_sec: float = float(os.getenv("CACHE_EPOCH_POLL_SEC", "2"))
+    audit_mode: str = os.getenv("AUDIT_MODE", "async")
+    audit_durable_actions: str = os.getenv("AUDIT_DURABLE_ACTIONS", "delete")
+    audit_buffer_size: int = int(os.getenv("AUDIT_BUFFER_SIZE", "10000"))
+    audit_batch_size: int = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+    audit_flush_interval_sec: float = float(os.getenv("AUDIT_FLUSH_INTERVAL_SEC", "1"))
+    audit_enqueue_timeout_sec: float = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_SEC", "0.5"))
+    log_retention_months: int = int(os.getenv("LOG_RETENTION_MONTHS", "12"))
+    log_hot_months: int = int(os.getenv("LOG_HOT_MONTHS", "1"))
+    log_partition_months_ahead: int = int(os.getenv("LOG_PARTITION_MONTHS_AHEAD", "2"))
+    log_archive_root: str = os.getenv("LOG_ARCHIVE_ROOT", "data/archive/logs")
+    storage_root: str = os.getenv("STORAGE_ROOT", "data/storage")
+    upload_chunk_size: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    upload_session_chunk_size: int = int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", str(8 * 1024 * 1024)))
+    delta_block_size: int = int(os.getenv("DELTA_BLOCK_SIZE", str(64 * 1024)))
+    upload_session_min_chunk_size: int = int(os.getenv("UPLOAD_SESSION_MIN_CHUNK_SIZE", str(256 * 1024)))
+    upload_session_max_chunk_size: int = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_SIZE", str(64 * 1024 * 1024)))
+    upload_session_max_total_size: int = int(os.getenv("UPLOAD_SESSION_MAX_TOTAL_SIZE", str(100 * 1024**3)))
+    upload_session_max_chunks: int = int(os.getenv("UPLOAD_SESSION_MAX_CHUNKS", "100000"))
+    upload_session_ttl_hours: int = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+    version_keep_last: int = int(os.getenv("VERSION_KEEP_LAST", "10"))
+    version_keep_daily_days: int = int(os.getenv("VERSION_KEEP_DAILY_DAYS", "7"))
+    version_keep_weekly_weeks: int = int(os.getenv("VERSION_KEEP_WEEKLY_WEEKS", "8"))
+    version_compress_after_days: int = int(os.getenv("VERSION_COMPRESS_AFTER_DAYS", "30"))
+    bulk_max_items: int = int(os.getenv("BULK_MAX_ITEMS", "5000"))
+    lock_ttl_sec: int = int(os.getenv("LOCK_TTL_SEC", "300"))
+    lock_max_ttl_sec: int = int(os.getenv("LOCK_MAX_TTL_SEC", "3600"))
+    lock_reap_interval_sec: float = float(os.getenv("LOCK_REAP_INTERVAL_SEC", "30"))
+    events_poll_sec: float = float(os.getenv("EVENTS_POLL_SEC", "1"))
+    events_settle_ms: int = int(os.getenv("EVENTS_SETTLE_MS", "500"))
+    events_heartbeat_sec: float = float(os.getenv("EVENTS_HEARTBEAT_SEC", "15"))
+    events_stream_max_sec: float = float(os.getenv("EVENTS_STREAM_MAX_SEC", "300"))
+    events_retry_ms: int = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+    events_queue_size: int = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+    events_retention_days: int = int(os.getenv("EVENTS_RETENTION_DAYS", "30"))
 
 
 settings = Settings()
@@ -1,18 +1,255 @@
-from collections.abc import Generator
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from collections.abc import AsyncGenerator, Generator, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+import hashlib
+import hmac
+import itertools
+import time
+import uuid
+
+from sqlalchemy import Engine, create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import NullPool
 
 from .config import settings
 
-connect_args = {"check_same_thread": False} if settings.database_url.startswith("sqlite") else {}
-engine = create_engine(settings.database_url, connect_args=connect_args)
+
+def engine_options(url: str, async_driver: bool = False) -> dict:
+    options: dict = {"query_cache_size": settings.db_query_cache_size}
+    if url.startswith("sqlite"):
+        if not async_driver:
+            options["connect_args"] = {"check_same_thread": False}
+        return options
+
+    if settings.db_pgbouncer:
+        # PgBouncer (transaction pooling) يجمع الاتصالات بنفسه؛ pool ثانٍ هنا يحجز اتصالات الخادم بلا فائدة
+        options["poolclass"] = NullPool
+    else:
+        # جلسات الـ async قصيرة (التنزيل والأحداث تُغلقها قبل بث الرد) فلها pool أصغر خاص بها
+        options.update(
+            pool_size=settings.db_async_pool_size if async_driver else settings.db_pool_size,
+            max_overflow=settings.db_async_max_overflow if async_driver else settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout_sec,
+            pool_recycle=settings.db_pool_recycle_sec,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+    if async_driver:
+        # asyncpg يحضّر الجمل على الاتصال؛ خلف PgBouncer قد يتغير الاتصال بين التحضير والتنفيذ فيُعطل الكاش
+        options["connect_args"] = (
+            {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+            if settings.db_pgbouncer
+            else {"prepared_statement_cache_size": settings.db_statement_cache_size}
+        )
+    return options
+
+
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# مفتاح ثابت لقفل Postgres الاستشاري الخاص بتهيئة بدء التشغيل
+STARTUP_LOCK_KEY = 0x64616768
+
+
+@contextmanager
+def startup_lock() -> Iterator[None]:
+    # عدة workers تبدأ معًا: واحد فقط ينفذ create_all والتهيئة في كل لحظة، والبقية تنتظر ثم تجد كل شيء جاهزًا.
+    # قفل transaction وليس session حتى يعمل خلف PgBouncer أيضًا
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as conn, conn.begin():
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": STARTUP_LOCK_KEY})
+        yield
+
+
 def get_db() -> Generator:
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def async_database_url(url: str) -> str:
+    # نفس قاعدة البيانات بمشغل async: asyncpg لـ Postgres و aiosqlite لـ SQLite
+    scheme, sep, rest = url.partition("://")
+    backend = scheme.split("+", 1)[0]
+    if backend == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if backend in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+@lru_cache(maxsize=1)
+def async_session_factory() -> async_sessionmaker[AsyncSession]:
+    # يُنشأ عند أول استخدام حتى لا تحتاج السكربتات وأدوات الصيانة المتزامنة مشغل async
+    async_engine = create_async_engine(
+        async_database_url(settings.database_url), **engine_options(settings.database_url, async_driver=True)
+    )
+    return async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session_factory()() as db:
+        yield db
+
+
+async def dispose_async_engine() -> None:
+    # اتصالات aiosqlite/asyncpg مرتبطة بحلقة الأحداث؛ تُغلق قبل أن تنتهي الحلقة
+    if async_session_factory.cache_info().currsize:
+        await async_session_factory().kw["bind"].dispose()
+        async_session_factory.cache_clear()
+    for replica in replicas:
+        if replica._async_factory is not None:
+            await replica._async_factory.kw["bind"].dispose()
+            replica._async_factory = None
+
+
+# تأخر النسخة بالثواني؛ صفر إذا طبقت كل ما استلمته (نسخة خاملة لا تُعد متأخرة لمجرد عدم وجود كتابات)
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(url, **engine_options(url))
+        self.lag_sec = 0.0
+        self._checked_at = float("-inf")
+        self._async_factory: async_sessionmaker[AsyncSession] | None = None
+
+    def async_factory(self) -> async_sessionmaker[AsyncSession]:
+        if self._async_factory is None:
+            async_engine = create_async_engine(async_database_url(self.url), **engine_options(self.url, async_driver=True))
+            self._async_factory = async_sessionmaker(async_engine, expire_on_commit=False)
+        return self._async_factory
+
+    def _lag_due(self) -> bool:
+        # SQLite (الاختبارات) لا يملك replication؛ قياس التأخر لـ Postgres فقط وبحد أقصى مرة كل REPLICA_LAG_CHECK_SEC
+        return not self.url.startswith("sqlite") and time.monotonic() - self._checked_at >= settings.replica_lag_check_sec
+
+    def _record_lag(self, lag: float | None) -> bool:
+        self.lag_sec = float(lag or 0)
+        self._checked_at = time.monotonic()
+        return self.usable()
+
+    def usable(self) -> bool:
+        return self.lag_sec <= settings.replica_max_lag_sec
+
+    def check(self) -> bool:
+        if not self._lag_due():
+            return self.usable()
+        try:
+            with self.engine.connect() as conn:
+                return self._record_lag(conn.scalar(REPLICA_LAG_SQL))
+        except SQLAlchemyError:
+            return self._record_lag(float("inf"))
+
+    async def check_async(self) -> bool:
+        if not self._lag_due():
+            return self.usable()
+        try:
+            async with self.async_factory()() as db:
+                return self._record_lag(await db.scalar(REPLICA_LAG_SQL))
+        except (SQLAlchemyError, OSError):
+            return self._record_lag(float("inf"))
+
+
+replicas = [Replica(url.strip()) for url in settings.read_replica_urls.split(",") if url.strip()]
+_replica_turn = itertools.count()
+# طابع آخر كتابة يحمله العميل (ترويسة أو كوكي) فيصل لأي worker، بدل قاموس في ذاكرة كل عملية
+WRITE_TOKEN_HEADER = "X-Write-Token"
+WRITE_TOKEN_COOKIE = "write_token"
+_request_writes: ContextVar[dict | None] = ContextVar("request_writes", default=None)
+
+
+def _replica_order() -> list[Replica]:
+    start = next(_replica_turn) % len(replicas)
+    return replicas[start:] + replicas[:start]
+
+
+def _sign(stamp: str) -> str:
+    return hmac.new(settings.secret_key.encode(), stamp.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def write_token(user_id: int, at: float | None = None) -> str:
+    stamp = f"{user_id}:{time.time() if at is None else at:.3f}"
+    return f"{stamp}:{_sign(stamp)}"
+
+
+def wrote_recently(user_id: int | None, token: str | None) -> bool:
+    if user_id is None or not token:
+        return False
+    stamp, _, signature = token.rpartition(":")
+    owner, _, at = stamp.partition(":")
+    if owner != str(user_id) or not hmac.compare_digest(signature, _sign(stamp)):
+        return False
+    try:
+        return float(at) + settings.read_your_writes_sec > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def track_writes() -> Iterator[dict]:
+    marks: dict = {}
+    reset = _request_writes.set(marks)
+    try:
+        yield marks
+    finally:
+        _request_writes.reset(reset)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _remember_writer(session) -> None:
+    # get_current_user يضع user_id في جلسة الطلب؛ بعد أي commit يُعاد للعميل طابع موقّع يوجّه قراءاته التالية للـ primary
+    user_id = session.info.get("user_id")
+    marks = _request_writes.get()
+    if replicas and user_id is not None and marks is not None:
+        marks["token"] = write_token(user_id)
+
+
+def read_session(user_id: int | None = None, token: str | None = None) -> Session:
+    if replicas and not wrote_recently(user_id, token):
+        for replica in _replica_order():
+            if replica.check():
+                return SessionLocal(bind=replica.engine)
+    return SessionLocal()
+
+
+async def async_read_session(user_id: int | None = None, token: str | None = None) -> AsyncSession:
+    if replicas and not wrote_recently(user_id, token):
+        for replica in _replica_order():
+            if await replica.check_async():
+                return replica.async_factory()()
+    return async_session_factory()()
+
+
+def _pool_status(bind: Engine) -> dict:
+    pool = bind.pool
+    stats: dict = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
+
+
+def pool_stats() -> dict:
+    stats = {"sync": _pool_status(engine)}
+    if async_session_factory.cache_info().currsize:
+        stats["async"] = _pool_status(async_session_factory().kw["bind"].sync_engine)
+    for index, replica in enumerate(replicas):
+        stats[f"replica_{index}"] = _pool_status(replica.engine) | {"lag_sec": replica.lag_sec}
+    return stats
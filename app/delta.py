@@ -0,0 +1,159 @@
+from collections.abc import Generator, Iterable
+from hashlib import blake2b
+from pathlib import Path
+from typing import BinaryIO
+import os
+import zlib
+
+ADLER_MOD = 65521
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def weak_checksum(block: bytes) -> int:
+    return zlib.adler32(block)
+
+
+def strong_checksum(block: bytes) -> str:
+    return blake2b(block, digest_size=16).hexdigest()
+
+
+class RollingChecksum:
+    # Adler-32 متدحرج: نفس قيمة zlib.adler32 للنافذة الحالية لكن التحديث بتكلفة O(1) لكل بايت
+    def __init__(self, window: bytes):
+        self.size = len(window)
+        value = zlib.adler32(window)
+        self.a = value & 0xFFFF
+        self.b = value >> 16
+
+    def roll(self, out_byte: int, in_byte: int) -> int:
+        self.a = (self.a - out_byte + in_byte) % ADLER_MOD
+        self.b = (self.b - self.size * out_byte + self.a - 1) % ADLER_MOD
+        return self.value
+
+    @property
+    def value(self) -> int:
+        return (self.b << 16) | self.a
+
+
+def compute_signatures(path: Path, block_size: int) -> list[dict]:
+    blocks = []
+    with open(path, "rb") as handle:
+        while block := handle.read(block_size):
+            blocks.append({"weak": weak_checksum(block), "strong": strong_checksum(block)})
+    return blocks
+
+
+def compute_delta(signatures: list[dict], block_size: int, data: bytes) -> tuple[list[dict], bytes]:
+    # الجانب المقابل (العميل): يبحث عن كتل الإصدار الحالي داخل المحتوى الجديد ويرسل الباقي كبيانات حرفية
+    by_weak: dict[int, list[tuple[int, str]]] = {}
+    for index, sig in enumerate(signatures):
+        by_weak.setdefault(sig["weak"], []).append((index, sig["strong"]))
+
+    ops: list[dict] = []
+    literals = bytearray()
+    pending_start = 0
+    pos = 0
+    rolling = RollingChecksum(data[:block_size]) if len(data) >= block_size else None
+
+    def emit_copy(offset: int) -> None:
+        last = ops[-1] if ops else None
+        if last and last["op"] == "copy" and last["offset"] + last["length"] == offset:
+            last["length"] += block_size
+        else:
+            ops.append({"op": "copy", "offset": offset, "length": block_size})
+
+    while rolling is not None:
+        matched = None
+        for index, strong in by_weak.get(rolling.value, ()):
+            if strong_checksum(data[pos : pos + block_size]) == strong:
+                matched = index
+                break
+        if matched is not None:
+            if pending_start < pos:
+                ops.append({"op": "data", "length": pos - pending_start})
+                literals += data[pending_start:pos]
+            emit_copy(matched * block_size)
+            pos += block_size
+            pending_start = pos
+            rolling = RollingChecksum(data[pos : pos + block_size]) if len(data) - pos >= block_size else None
+            continue
+        if pos + block_size >= len(data):
+            break
+        rolling.roll(data[pos], data[pos + block_size])
+        pos += 1
+
+    if pending_start < len(data):
+        ops.append({"op": "data", "length": len(data) - pending_start})
+        literals += data[pending_start:]
+    return ops, bytes(literals)
+
+
+class DeltaReader:
+    # يعيد بناء الإصدار الجديد كتيار: نسخ نطاقات من الإصدار الحالي + بيانات حرفية من العميل
+    def __init__(self, base_path: Path, instructions: Iterable[dict], literals: BinaryIO, chunk_size: int):
+        self._base_path = base_path
+        self._base_size = base_path.stat().st_size
+        self._instructions = list(instructions)
+        self._literals = literals
+        self._chunk_size = chunk_size
+        self._validate()
+        self._chunks: Generator[bytes, None, None] | None = None
+        self._buffer = b""
+        self.seek(0)
+
+    def _validate(self) -> None:
+        for op in self._instructions:
+            if not isinstance(op, dict):
+                raise ValueError("delta instructions must be objects")
+            kind, length = op.get("op"), op.get("length")
+            if not isinstance(length, int) or length < 0:
+                raise ValueError("invalid delta instruction length")
+            if kind == "copy":
+                offset = op.get("offset")
+                if not isinstance(offset, int) or offset < 0 or offset + length > self._base_size:
+                    raise ValueError("delta copy range is outside the base version")
+            elif kind != "data":
+                raise ValueError(f"unknown delta instruction: {kind}")
+
+    def _generate(self) -> Generator[bytes, None, None]:
+        with open(self._base_path, "rb") as base:
+            for op in self._instructions:
+                remaining = op["length"]
+                if op["op"] == "copy":
+                    base.seek(op["offset"])
+                    source = base
+                else:
+                    source = self._literals
+                while remaining > 0:
+                    chunk = source.read(min(self._chunk_size, remaining))
+                    if not chunk:
+                        raise ValueError("delta literal data is shorter than declared")
+                    remaining -= len(chunk)
+                    yield chunk
+        if self._literals.read(1):
+            raise ValueError("delta literal data is longer than declared")
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("DeltaReader only supports rewinding to the start")
+        if self._chunks is not None:
+            self._chunks.close()
+        self._literals.seek(0)
+        self._chunks = self._generate()
+        self._buffer = b""
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self._buffer + b"".join(self._chunks)
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -1,40 +1,136 @@
-from fastapi import Depends, HTTPException, status
+from collections.abc import AsyncGenerator, Generator
+from dataclasses import dataclass
+from hashlib import sha256
+import time
+
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from .cache import EpochWatcher, TTLCache
 from .config import settings
-from .database import get_db
-from .models import User
+from .database import (
+    WRITE_TOKEN_COOKIE,
+    WRITE_TOKEN_HEADER,
+    async_read_session,
+    get_async_db,
+    get_db,
+    read_session,
+)
+from .models import Role, User
 
 bearer_scheme = HTTPBearer()
 
 
-def get_current_user(
-    creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-    db: Session = Depends(get_db),
-) -> User:
-    token = creds.credentials
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    role_name: str
+    is_active: bool = True
+
+
+_principal_cache = TTLCache(settings.principal_cache_size, settings.principal_cache_ttl_sec)
+principal_epoch = EpochWatcher("principals", settings.cache_epoch_poll_sec, _principal_cache.clear)
+
+
+def invalidate_principals(db: Session) -> None:
+    # عند تعطيل مستخدم أو تغيير دوره: يفرغ كاش هذا الـ worker ويبلغ البقية عبر رقم الإصدار
+    principal_epoch.bump(db)
+
+
+def _principal_key(token: str) -> str:
+    return sha256(token.encode()).hexdigest()
+
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username = payload.get("sub")
-        if not username:
+        if not payload.get("sub"):
             raise ValueError("invalid sub")
     except (JWTError, ValueError) as exc:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication token",
         ) from exc
+    return payload
+
+
+def _principal_query(username: str):
+    return (
+        select(User.id, User.username, Role.name)
+        .join(Role, Role.id == User.role_id)
+        .where(User.username == username, User.is_active.is_(True))
+    )
+
 
-    user = db.query(User).filter(User.username == username, User.is_active.is_(True)).first()
-    if not user:
+def _cache_principal(cache_key: str, payload: dict, row) -> Principal:
+    if not row:
         raise HTTPException(status_code=401, detail="Inactive or missing user")
-    return user
+    principal = Principal(id=row[0], username=row[1], role_name=row[2])
+    # لا يبقى المدخل في الكاش بعد انتهاء صلاحية التوكن نفسه
+    expires_in = float(payload.get("exp", 0)) - time.time()
+    _principal_cache.set(cache_key, principal, ttl_sec=expires_in)
+    return principal
+
+
+def get_current_user(
+    creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    db: Session = Depends(get_db),
+) -> Principal:
+    cache_key = _principal_key(creds.credentials)
+    principal_epoch.check(db)
+    principal = _principal_cache.get(cache_key)
+    if principal is None:
+        payload = _decode_token(creds.credentials)
+        row = db.execute(_principal_query(payload["sub"])).first()
+        principal = _cache_principal(cache_key, payload, row)
+    db.info["user_id"] = principal.id
+    return principal
+
+
+async def get_current_user_async(
+    creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
+    # للمسارات غير المتزامنة: نفس الكاش ورقم الإصدار دون حجز thread أو اتصال متزامن
+    cache_key = _principal_key(creds.credentials)
+    await principal_epoch.check_async(db)
+    principal = _principal_cache.get(cache_key)
+    if principal is None:
+        payload = _decode_token(creds.credentials)
+        row = (await db.execute(_principal_query(payload["sub"]))).first()
+        principal = _cache_principal(cache_key, payload, row)
+    db.info["user_id"] = principal.id
+    return principal
+
+
+def _write_token(request: Request) -> str | None:
+    return request.headers.get(WRITE_TOKEN_HEADER) or request.cookies.get(WRITE_TOKEN_COOKIE)
+
+
+def get_read_db(request: Request, current: Principal = Depends(get_current_user)) -> Generator:
+    # هنا وليس في database.py لأن اختيار النسخة يحتاج معرفة المستخدم وطابع آخر كتابة له (read-your-writes)
+    db = read_session(current.id, _write_token(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(
+    request: Request, current: Principal = Depends(get_current_user_async)
+) -> AsyncGenerator[AsyncSession, None]:
+    async with await async_read_session(current.id, _write_token(request)) as db:
+        yield db
 
 
 def require_roles(*allowed: str):
-    def checker(user: User = Depends(get_current_user)) -> User:
-        if user.role.name not in allowed:
+    def checker(user: Principal = Depends(get_current_user)) -> Principal:
+        if user.role_name not in allowed:
             raise HTTPException(status_code=403, detail="Insufficient role")
         return user
 
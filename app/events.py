@@ -0,0 +1,298 @@
+from collections.abc import AsyncIterator, Awaitable, Callable
+from datetime import datetime, timedelta
+import asyncio
+import contextlib
+import json
+
+from sqlalchemy import Select, delete, func, or_, select, text, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import async_session_factory
+from .models import ChangeEvent, FileRecord, Folder, Task
+
+FETCH_LIMIT = 500
+
+# أقدم transaction كاتبة ما زالت مفتوحة على Postgres (بتوقيت الخادم). أحداثها لم تُرَ بعد وقد تحمل id أصغر
+# من أحداث مرئية، فلا يُقرأ بعد بدايتها؛ وبدون كاتب مفتوح يكون الحد هو اللحظة الحالية
+PG_HORIZON_SQL = text(
+    "SELECT timezone('utc', coalesce(min(xact_start), clock_timestamp())) FROM pg_stat_activity "
+    "WHERE backend_xid IS NOT NULL AND datname = current_database() AND pid <> pg_backend_pid()"
+)
+
+
+def file_payload(record: FileRecord) -> dict:
+    return {
+        "id": record.id,
+        "folder_id": record.folder_id,
+        "name": record.original_name,
+        "version": record.version,
+        "size": record.size,
+        "sha256": record.sha256,
+        "is_locked": record.is_locked,
+        "locked_by": record.locked_by,
+        "lock_expires_at": record.lock_expires_at,
+    }
+
+
+def folder_payload(row: Folder) -> dict:
+    return {"id": row.id, "name": row.name, "parent_id": row.parent_id, "path": row.path}
+
+
+def task_payload(task: Task) -> dict:
+    return {"id": task.id, "title": task.title, "status": task.status, "assigned_to": task.assigned_to}
+
+
+def record_change(
+    db: Session,
+    user_id: int,
+    kind: str,
+    entity_type: str,
+    entity_id: int,
+    payload: dict,
+    folder_id: int | None = None,
+    recipient_id: int | None = None,
+) -> None:
+    # يُضاف داخل transaction العملية نفسها: الحدث يظهر للعملاء فقط إذا نجح الـ commit.
+    # على Postgres يُختم بساعة الخادم لحظة الإدراج حتى يُقارن بحد settled_horizon
+    stamp = {"created_at": func.timezone("utc", func.clock_timestamp())} if _is_postgres(db) else {}
+    db.add(
+        ChangeEvent(
+            **stamp,
+            kind=kind,
+            entity_type=entity_type,
+            entity_id=entity_id,
+            folder_id=folder_id,
+            user_id=user_id,
+            recipient_id=recipient_id,
+            payload=json.dumps(payload, ensure_ascii=False, default=str),
+        )
+    )
+
+
+def _is_postgres(db: Session | AsyncSession) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def record_file_change(db: Session, user_id: int, kind: str, record: FileRecord, **extra) -> None:
+    record_change(
+        db, user_id, f"file.{kind}", "file", record.id, file_payload(record) | extra, folder_id=record.folder_id
+    )
+
+
+def record_folder_change(db: Session, user_id: int, kind: str, row: Folder, **extra) -> None:
+    record_change(
+        db, user_id, f"folder.{kind}", "folder", row.id, folder_payload(row) | extra, folder_id=row.parent_id
+    )
+
+
+def record_task_change(db: Session, user_id: int, kind: str, task: Task) -> None:
+    record_change(
+        db, user_id, f"task.{kind}", "task", task.id, task_payload(task), recipient_id=task.assigned_to
+    )
+
+
+def event_out(row: ChangeEvent) -> dict:
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "entity_type": row.entity_type,
+        "entity_id": row.entity_id,
+        "folder_id": row.folder_id,
+        "user_id": row.user_id,
+        "created_at": row.created_at.isoformat(),
+        "data": json.loads(row.payload or "{}"),
+    }
+
+
+def visible_to(user_id: int | None):
+    if user_id is None:
+        return true()
+    return or_(ChangeEvent.recipient_id.is_(None), ChangeEvent.recipient_id == user_id)
+
+
+def _settle(horizon: datetime) -> datetime:
+    # هامش صغير لفروق التوقيت بين تخصيص الـ id وختم created_at في الإدراجات المتزامنة
+    return horizon - timedelta(milliseconds=settings.events_settle_ms)
+
+
+def settled_horizon(db: Session) -> datetime:
+    # الأحداث قبل هذا الحد نهائية: لن يظهر لاحقًا حدث بـ id أصغر منها (على SQLite الكاتب واحد دائمًا)
+    return _settle(db.scalar(PG_HORIZON_SQL) if _is_postgres(db) else datetime.utcnow())
+
+
+async def settled_horizon_async(db: AsyncSession) -> datetime:
+    return _settle(await db.scalar(PG_HORIZON_SQL) if _is_postgres(db) else datetime.utcnow())
+
+
+def _changes_query(after_id: int, user_id: int | None, limit: int, settled: datetime) -> Select:
+    # الحد يُحسب بجملة سابقة، فلقطة هذه القراءة ترى كل ما ثُبّت قبله
+    return (
+        select(ChangeEvent)
+        .where(ChangeEvent.id > after_id, ChangeEvent.created_at <= settled, visible_to(user_id))
+        .order_by(ChangeEvent.id)
+        .limit(limit)
+    )
+
+
+def fetch_changes(db: Session, after_id: int, user_id: int | None, limit: int) -> list[ChangeEvent]:
+    return list(db.scalars(_changes_query(after_id, user_id, limit, settled_horizon(db))))
+
+
+async def fetch_changes_async(db: AsyncSession, after_id: int, user_id: int | None, limit: int) -> list[ChangeEvent]:
+    settled = await settled_horizon_async(db)
+    return list(await db.scalars(_changes_query(after_id, user_id, limit, settled)))
+
+
+def compact_changes(rows: list[ChangeEvent]) -> dict[str, tuple[dict[int, dict], set[int]]]:
+    # آخر حالة لكل كيان فقط؛ الكيان الذي أُنشئ وحُذف داخل نفس النافذة لا يظهر إطلاقًا
+    result: dict[str, tuple[dict[int, dict], set[int]]] = {}
+    created_here: set[tuple[str, int]] = set()
+    for row in rows:
+        upserted, deleted = result.setdefault(row.entity_type, ({}, set()))
+        key = (row.entity_type, row.entity_id)
+        if row.kind.endswith(".created") and row.entity_id not in upserted and row.entity_id not in deleted:
+            created_here.add(key)
+        if row.kind.endswith(".deleted"):
+            upserted.pop(row.entity_id, None)
+            if key not in created_here:
+                deleted.add(row.entity_id)
+        else:
+            deleted.discard(row.entity_id)
+            upserted[row.entity_id] = json.loads(row.payload or "{}")
+    return result
+
+
+def oldest_change_id(db: Session) -> int | None:
+    return db.query(func.min(ChangeEvent.id)).scalar()
+
+
+def last_change_id(db: Session) -> int:
+    return db.scalar(select(func.coalesce(func.max(ChangeEvent.id), 0)))
+
+
+def _settled_max(settled: datetime) -> Select:
+    return select(func.coalesce(func.max(ChangeEvent.id), 0)).where(ChangeEvent.created_at <= settled)
+
+
+def settled_change_id(db: Session) -> int:
+    # مؤشر بداية آمن (لقطة /changes، بث جديد): أي حدث لم يُثبت بعد سيكون id له أكبر منه
+    return db.scalar(_settled_max(settled_horizon(db)))
+
+
+async def settled_change_id_async(db: AsyncSession) -> int:
+    return await db.scalar(_settled_max(await settled_horizon_async(db)))
+
+
+def purge_old_changes(db: Session) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=settings.events_retention_days)
+    # يبقى آخر حدث دائمًا حتى يميّز /changes بين "لا تغييرات" و"المؤشر أقدم من السجل المحفوظ"
+    newest = last_change_id(db)
+    deleted = db.execute(
+        delete(ChangeEvent).where(ChangeEvent.created_at < cutoff, ChangeEvent.id < newest)
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+async def _load(after_id: int, user_id: int | None) -> list[tuple[int | None, dict]]:
+    async with async_session_factory()() as db:
+        rows = await fetch_changes_async(db, after_id, user_id, FETCH_LIMIT)
+        return [(row.recipient_id, event_out(row)) for row in rows]
+
+
+async def _current_id() -> int:
+    async with async_session_factory()() as db:
+        return await settled_change_id_async(db)
+
+
+class ChangeBroker:
+    # poller واحد لكل worker يوزع الأحداث الجديدة على كل الاتصالات المفتوحة بدل استعلام لكل عميل
+    def __init__(self, poll_sec: float, queue_size: int):
+        self.poll_sec = poll_sec
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def _run(self) -> None:
+        last_id = await _current_id()
+        while self._subscribers:
+            await asyncio.sleep(self.poll_sec)
+            events = await _load(last_id, None)
+            if not events:
+                continue
+            # كل دفعة تحمل المؤشر الذي بدأت بعده حتى يكتشف المشترك أي فجوة ويكملها من قاعدة البيانات
+            batch = (last_id, events)
+            last_id = events[-1][1]["id"]
+            for queue in list(self._subscribers):
+                try:
+                    queue.put_nowait(batch)
+                except asyncio.QueueFull:
+                    pass
+
+
+change_broker = ChangeBroker(settings.events_poll_sec, settings.events_queue_size)
+
+
+def format_sse(event: dict) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {data}\n\n"
+
+
+async def stream_changes(
+    user_id: int,
+    after_id: int,
+    lifetime_sec: float,
+    is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + lifetime_sec
+    queue = change_broker.subscribe()
+    cursor = after_id
+    try:
+        yield f"retry: {settings.events_retry_ms}\n\n"
+        backlog = await _load(cursor, user_id)
+        while True:
+            for recipient_id, event in backlog:
+                if event["id"] <= cursor:
+                    continue
+                cursor = event["id"]
+                if recipient_id in (None, user_id):
+                    yield format_sse(event)
+            if len(backlog) == FETCH_LIMIT:
+                backlog = await _load(cursor, user_id)
+                continue
+
+            remaining = deadline - loop.time()
+            if remaining <= 0 or await is_disconnected():
+                return
+            try:
+                since, events = await asyncio.wait_for(
+                    queue.get(), timeout=min(remaining, settings.events_heartbeat_sec)
+                )
+            except asyncio.TimeoutError:
+                backlog = []
+                yield ": ping\n\n"
+                continue
+            backlog = events if since <= cursor else await _load(cursor, user_id)
+    finally:
+        change_broker.unsubscribe(queue)
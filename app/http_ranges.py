@@ -0,0 +1,180 @@
+from collections.abc import AsyncIterator
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import quote
+import mimetypes
+import uuid
+
+import anyio
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from .config import settings
+
+# أكثر من هذا العدد من النطاقات في طلب واحد يُعامل كطلب للملف كاملًا (حماية من تضخيم multipart)
+MAX_RANGES = 16
+
+
+def http_date(value: datetime) -> str:
+    # التواريخ في قاعدة البيانات مخزنة UTC بدون tzinfo
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def _strong_etag_match(value: str, etag: str) -> bool:
+    # If-Range يستخدم المقارنة القوية: أي وسم W/ لا يطابق أبدًا
+    value = value.strip()
+    return not value.startswith("W/") and not etag.startswith("W/") and value == etag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+
+def parse_range_header(header: str, size: int) -> list[tuple[int, int]]:
+    # يعيد قائمة (start, end) شاملة للطرفين، أو يرفع 416 إن لم يكن أي نطاق قابلًا للتحقيق
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        raise ValueError("unsupported range unit")
+
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        raise ValueError("too many ranges")
+
+    ranges: list[tuple[int, int]] = []
+    for part in parts:
+        start_text, sep, end_text = part.strip().partition("-")
+        if not sep:
+            raise ValueError("malformed range")
+        if not start_text:
+            suffix = int(end_text)
+            # الملف الفارغ لا يحوي أي بايت يمكن تحقيقه فينتهي الطلب بـ 416
+            if suffix <= 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+            continue
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+        if end_text and start > end:
+            raise ValueError("malformed range")
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    # النطاقات المتداخلة أو المتلاصقة تُدمج حتى لا يُرسل نفس البايت أكثر من مرة
+    merged = [min(ranges)]
+    for start, end in sorted(ranges)[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def _iter_file_range(path: Path, start: int, end: int) -> AsyncIterator[bytes]:
+    # قراءة async مثل FileResponse: لا يُحجز خيط من threadpool طوال مدة التنزيل
+    async with await anyio.open_file(path, "rb") as handle:
+        await handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await handle.read(min(settings.upload_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _iter_multipart(
+    path: Path, ranges: list[tuple[int, int]], size: int, media_type: str, boundary: str
+) -> AsyncIterator[bytes]:
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode("latin-1")
+        async for chunk in _iter_file_range(path, start, end):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("latin-1")
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def file_download_response(
+    request: Request,
+    path: Path,
+    filename: str,
+    etag: str,
+    last_modified: datetime,
+) -> Response:
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(filename),
+    }
+    size = path.stat().st_size
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and not _strong_etag_match(if_range, etag) and if_range != headers["Last-Modified"]:
+        range_header = None
+    if not range_header:
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    try:
+        ranges = parse_range_header(range_header, size)
+    except ValueError:
+        # Range مشوه أو بنطاقات كثيرة يُتجاهل حسب RFC 9110 ويُرسل الملف كاملًا
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file_range(path, start, end),
+            status_code=206,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(
+        _iter_multipart(path, ranges, size, media_type, boundary),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers,
+    )
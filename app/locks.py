@@ -0,0 +1,238 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import threading
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .events import record_file_change, settled_change_id, settled_horizon
+from .models import ChangeEvent, FileRecord
+
+
+@dataclass
+class Lease:
+    file_id: int
+    owner_id: int
+    expires_at: datetime
+    # آخر انتهاء مكتوب في قاعدة البيانات؛ التجديد لا يكتب إلا حين يقترب هذا الموعد
+    persisted_until: datetime
+
+
+def lock_active(now: datetime | None = None):
+    now = now or datetime.utcnow()
+    return and_(
+        FileRecord.is_locked.is_(True),
+        or_(FileRecord.lock_expires_at.is_(None), FileRecord.lock_expires_at > now),
+    )
+
+
+def active_lock_holder(record: FileRecord, now: datetime | None = None) -> int | None:
+    if not record.is_locked:
+        return None
+    if record.lock_expires_at is not None and record.lock_expires_at <= (now or datetime.utcnow()):
+        return None
+    return record.locked_by
+
+
+class LockManager:
+    # جدول الأقفال في ذاكرة الـ worker: رفض سريع للتعارض وتجديد (heartbeat) بدون قاعدة البيانات.
+    # قاعدة البيانات تبقى المرجع عند الحجز والاستعادة بعد إعادة التشغيل، وlock_events يسقط منه ما تغير في worker آخر
+    def __init__(self):
+        self._leases: dict[int, Lease] = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_id: int, now: datetime | None = None) -> Lease | None:
+        with self._lock:
+            lease = self._leases.get(file_id)
+            if lease and lease.expires_at <= (now or datetime.utcnow()):
+                del self._leases[file_id]
+                return None
+            return lease
+
+    def put(self, lease: Lease) -> None:
+        with self._lock:
+            self._leases[lease.file_id] = lease
+
+    def drop(self, file_id: int) -> None:
+        with self._lock:
+            self._leases.pop(file_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._leases.clear()
+
+    def load(self, db: Session) -> int:
+        now = datetime.utcnow()
+        rows = db.query(FileRecord.id, FileRecord.locked_by, FileRecord.lock_expires_at).filter(
+            lock_active(now), FileRecord.lock_expires_at.is_not(None)
+        )
+        with self._lock:
+            self._leases = {
+                file_id: Lease(file_id, owner_id, expires_at, expires_at) for file_id, owner_id, expires_at in rows
+            }
+            return len(self._leases)
+
+
+class LockEventWatcher:
+    # يتابع أحداث القفل/الفك/الحذف في change_events ويسقط من الذاكرة أقفال تلك الملفات فقط،
+    # بدل تفريغ الجدول كله وتحديث صف مشترك واحد مع كل فك قفل
+    KINDS = ("file.locked", "file.unlocked", "file.deleted")
+
+    def __init__(self, manager: LockManager, poll_sec: float):
+        self._manager = manager
+        self.poll_sec = poll_sec
+        self._seen: int | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def check(self, db: Session) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_sec:
+            return
+        with self._lock:
+            if now - self._checked_at < self.poll_sec:
+                return
+            self._checked_at = now
+            # نفس حد الاستقرار الذي يستخدمه بث الأحداث قبل اعتبار id نهائيًا
+            settled = settled_horizon(db)
+            if self._seen is None:
+                self._seen = settled_change_id(db)
+                return
+            rows = (
+                db.query(ChangeEvent.id, ChangeEvent.entity_id)
+                .filter(
+                    ChangeEvent.id > self._seen,
+                    ChangeEvent.created_at <= settled,
+                    ChangeEvent.entity_type == "file",
+                    ChangeEvent.kind.in_(self.KINDS),
+                )
+                .order_by(ChangeEvent.id)
+            )
+            for event_id, file_id in rows:
+                self._manager.drop(file_id)
+                self._seen = event_id
+
+
+lock_manager = LockManager()
+lock_events = LockEventWatcher(lock_manager, settings.cache_epoch_poll_sec)
+_reaped_at = 0.0
+
+
+def forget_locks(file_ids: list[int]) -> None:
+    # الـ workers الأخرى تسقط نفس الملفات عند قراءة حدث file.unlocked/deleted المسجل في نفس الـ transaction
+    for file_id in file_ids:
+        lock_manager.drop(file_id)
+
+
+def lease_ttl(requested: int | None) -> timedelta:
+    ttl = requested or settings.lock_ttl_sec
+    if not 1 <= ttl <= settings.lock_max_ttl_sec:
+        raise HTTPException(status_code=400, detail=f"ttl_sec must be between 1 and {settings.lock_max_ttl_sec}")
+    return timedelta(seconds=ttl)
+
+
+def _lock_conflict(db: Session, file_id: int) -> HTTPException:
+    if not db.query(FileRecord.id).filter(FileRecord.id == file_id).first():
+        return HTTPException(status_code=404, detail="File not found")
+    return HTTPException(status_code=409, detail="File locked by another user")
+
+
+def acquire_locks(
+    db: Session, file_ids: list[int], user_id: int, ttl: timedelta, force: bool = False
+) -> list[FileRecord]:
+    # الحجز بجملة UPDATE مشروطة واحدة: تنجح فقط للملفات الحرة أو المقفلة لنفس المستخدم أو المنتهية مهلتها
+    now = datetime.utcnow()
+    expires_at = now + ttl
+    condition = FileRecord.id.in_(file_ids)
+    if not force:
+        condition = and_(condition, or_(~lock_active(now), FileRecord.locked_by == user_id))
+    records = (
+        db.execute(
+            update(FileRecord)
+            .where(condition)
+            .values(is_locked=True, locked_by=user_id, lock_expires_at=expires_at)
+            .returning(FileRecord)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        .scalars()
+        .all()
+    )
+    for record in records:
+        lock_manager.put(Lease(record.id, user_id, expires_at, expires_at))
+    return records
+
+
+def acquire_lock(db: Session, file_id: int, user_id: int, ttl: timedelta, force: bool = False) -> FileRecord:
+    lock_events.check(db)
+    held = lock_manager.get(file_id)
+    if held and held.owner_id != user_id and not force:
+        raise HTTPException(status_code=409, detail="File locked by another user")
+    records = acquire_locks(db, [file_id], user_id, ttl, force)
+    if not records:
+        raise _lock_conflict(db, file_id)
+    return records[0]
+
+
+def renew_lock(db: Session, file_id: int, user_id: int, ttl: timedelta) -> datetime:
+    now = datetime.utcnow()
+    expires_at = now + ttl
+    lock_events.check(db)
+    held = lock_manager.get(file_id, now)
+    if held and held.owner_id == user_id and held.persisted_until - now > ttl / 2:
+        held.expires_at = expires_at
+        return expires_at
+
+    renewed = db.execute(
+        update(FileRecord)
+        .where(FileRecord.id == file_id, FileRecord.locked_by == user_id, lock_active(now))
+        .values(lock_expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not renewed:
+        lock_manager.drop(file_id)
+        raise HTTPException(status_code=409, detail="Lock lease expired or held by another user")
+    db.commit()
+    lock_manager.put(Lease(file_id, user_id, expires_at, expires_at))
+    return expires_at
+
+
+def release_lock(db: Session, record: FileRecord) -> None:
+    record.is_locked = False
+    record.locked_by = None
+    record.lock_expires_at = None
+    forget_locks([record.id])
+
+
+def reclaim_expired_locks(db: Session, force: bool = False) -> int:
+    # الأقفال المنتهية لا تمنع الحفظ أصلًا؛ هذا التنظيف يصحح حالة الصفوف ويبث حدث فك القفل للعملاء
+    global _reaped_at
+    if not force and time.monotonic() - _reaped_at < settings.lock_reap_interval_sec:
+        return 0
+    _reaped_at = time.monotonic()
+    now = datetime.utcnow()
+    rows = (
+        db.query(FileRecord)
+        .filter(FileRecord.is_locked.is_(True), FileRecord.lock_expires_at <= now)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for record in rows:
+        holder = record.locked_by
+        release_lock(db, record)
+        record_file_change(db, holder, "unlocked", record, reason="expired")
+    db.commit()
+    return len(rows)
+
+
+def backfill_lock_leases(db: Session) -> int:
+    # أقفال ما قبل نظام المهلة كانت دائمة؛ تُعطى مهلة واحدة كاملة بدل إسقاطها فورًا
+    updated = db.execute(
+        update(FileRecord)
+        .where(FileRecord.is_locked.is_(True), FileRecord.lock_expires_at.is_(None))
+        .values(lock_expires_at=datetime.utcnow() + timedelta(seconds=settings.lock_ttl_sec))
+    ).rowcount
+    db.commit()
+    return updated
@@ -0,0 +1,257 @@
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+import gzip
+import json
+import logging
+import os
+
+from sqlalchemy import Column, Connection, Index, MetaData, Table, delete, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import engine
+from .models import PARTITIONED_LOGS, AuditLog
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ROOT = Path(settings.log_archive_root)
+PARTITION_PREFIX = "logs_p"
+LOGS = AuditLog.__table__
+
+
+def _month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def _partition_month(name: str) -> datetime | None:
+    try:
+        return datetime.strptime(name.removeprefix(PARTITION_PREFIX), "%Y%m")
+    except ValueError:
+        return None
+
+
+def _partition_table(name: str) -> Table:
+    # نسخة من أعمدة logs بدون القيود، لقراءة/إنشاء جداول الأشهر المنفصلة
+    table = Table(
+        name,
+        MetaData(),
+        *(Column(c.name, c.type, primary_key=c.primary_key) for c in LOGS.columns),
+    )
+    Index(f"ix_{name}_timestamp_id", table.c.timestamp, table.c.id)
+    return table
+
+
+def _list_partitions(conn: Connection) -> list[str]:
+    if PARTITIONED_LOGS:
+        rows = conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'logs'"
+            )
+        )
+    else:
+        rows = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'logs_p%'"))
+    return sorted(name for (name,) in rows if _partition_month(name))
+
+
+def log_tables(db: Session) -> list[Table]:
+    # مصادر السجلات من الأحدث للأقدم. على Postgres الجدول الأب يغطي كل الأقسام تلقائيًا
+    if PARTITIONED_LOGS:
+        return [LOGS]
+    names = _list_partitions(db.connection())
+    return [LOGS] + [_partition_table(name) for name in reversed(names)]
+
+
+def _is_partitioned(conn: Connection) -> bool:
+    return bool(
+        conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'logs'"
+            )
+        ).first()
+    )
+
+
+def _ensure_pg_partitions(conn: Connection, current: datetime, months_ahead: int) -> list[str]:
+    created = []
+    existing = set(_list_partitions(conn))
+    has_default = bool(conn.execute(text("SELECT to_regclass('logs_default')")).scalar())
+    months = {_add_months(current, offset) for offset in range(months_ahead + 1)}
+    if has_default:
+        # أشهر سقطت في القسم الافتراضي (مثلاً توقفت الصيانة) تحصل على قسمها أيضًا
+        months.update(
+            month.replace(tzinfo=None)
+            for (month,) in conn.execute(text('SELECT DISTINCT date_trunc(\'month\', timestamp) FROM "logs_default"'))
+        )
+    for month in sorted(months):
+        name = _partition_name(month)
+        if name in existing:
+            continue
+        bounds = {"lo": month, "hi": _add_months(month, 1)}
+        create = text(
+            f'CREATE TABLE "{name}" PARTITION OF logs '
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{bounds['hi']:%Y-%m-%d}')"
+        )
+        in_range = '"logs_default" WHERE timestamp >= :lo AND timestamp < :hi'
+        if has_default and conn.execute(text(f"SELECT 1 FROM {in_range} LIMIT 1"), bounds).first():
+            # Postgres يرفض إنشاء القسم إن كان logs_default يحوي صفوفًا من مداه: نفصله، ننشئ القسم، ننقل الصفوف ثم نعيد ربطه
+            conn.execute(text('ALTER TABLE logs DETACH PARTITION "logs_default"'))
+            conn.execute(create)
+            conn.execute(text(f'INSERT INTO "{name}" SELECT * FROM {in_range}'), bounds)
+            conn.execute(text(f"DELETE FROM {in_range}"), bounds)
+            conn.execute(text('ALTER TABLE logs ATTACH PARTITION "logs_default" DEFAULT'))
+        else:
+            conn.execute(create)
+        created.append(name)
+    conn.execute(text('CREATE TABLE IF NOT EXISTS "logs_default" PARTITION OF logs DEFAULT'))
+    return created
+
+
+def _ensure_sqlite_autoincrement(conn: Connection) -> None:
+    # جداول logs القديمة أُنشئت بدون AUTOINCREMENT فيعيد SQLite استخدام المعرفات بعد النقل؛ نعيد بناءها مرة واحدة
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'logs'")).scalar() or ""
+    if "AUTOINCREMENT" in sql.upper():
+        return
+    conn.execute(text('ALTER TABLE logs RENAME TO "logs_legacy"'))
+    for index in LOGS.indexes:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+    LOGS.create(conn)
+    conn.execute(text('INSERT INTO logs SELECT * FROM "logs_legacy"'))
+    conn.execute(text('DROP TABLE "logs_legacy"'))
+
+
+def _keep_sqlite_id_floor(conn: Connection) -> None:
+    # أعلى معرف عبر logs وكل الأشهر المنقولة يصبح أرضية sqlite_sequence حتى لا تتكرر المعرفات بين الجداول
+    high = conn.execute(select(func.max(LOGS.c.id))).scalar() or 0
+    for name in _list_partitions(conn):
+        high = max(high, conn.execute(select(func.max(_partition_table(name).c.id))).scalar() or 0)
+    updated = conn.execute(
+        text("UPDATE sqlite_sequence SET seq = :high WHERE name = 'logs' AND seq < :high"), {"high": high}
+    ).rowcount
+    if not updated and not conn.execute(text("SELECT 1 FROM sqlite_sequence WHERE name = 'logs'")).first():
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('logs', :high)"), {"high": high})
+
+
+def _rollover_sqlite(conn: Connection, hot_start: datetime) -> list[str]:
+    # SQLite لا يدعم التقسيم: ننقل الأشهر المغلقة من logs إلى جداول logs_pYYYYMM
+    oldest = conn.execute(select(func.min(LOGS.c.timestamp)).where(LOGS.c.timestamp < hot_start)).scalar()
+    rolled = []
+    month = _month_start(oldest) if oldest else hot_start
+    while month < hot_start:
+        upper = _add_months(month, 1)
+        in_month = (LOGS.c.timestamp >= month) & (LOGS.c.timestamp < upper)
+        table = _partition_table(_partition_name(month))
+        table.create(conn, checkfirst=True)
+        moved = conn.execute(
+            insert(table).from_select([c.name for c in LOGS.columns], select(LOGS).where(in_month))
+        ).rowcount
+        conn.execute(delete(LOGS).where(in_month))
+        if moved:
+            rolled.append(table.name)
+        month = upper
+    return rolled
+
+
+def _archive_path(month: datetime) -> Path:
+    return ARCHIVE_ROOT / f"logs-{month:%Y%m}.ndjson.gz"
+
+
+def _row_dict(row) -> dict:
+    data = dict(row._mapping)
+    data["timestamp"] = data["timestamp"].isoformat()
+    return data
+
+
+def _archive_partition(conn: Connection, name: str) -> Path:
+    table = _partition_table(name)
+    path = _archive_path(_partition_month(name))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # نكتب إلى ملف مؤقت ثم نستبدله، فإعادة التشغيل بعد فشل الحذف لا تكرر الصفوف.
+    # الصفوف المؤرشفة سابقًا من خارج هذا الجدول (معرّفاتها أقدم) تبقى في الأرشيف
+    first_id = conn.execute(select(func.min(table.c.id))).scalar()
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as out:
+        if path.exists():
+            for row in iter_archive(f"{_partition_month(name):%Y%m}"):
+                if first_id is None or row["id"] < first_id:
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        rows = conn.execution_options(yield_per=1000).execute(
+            select(table).order_by(table.c.timestamp, table.c.id)
+        )
+        for row in rows:
+            out.write(json.dumps(_row_dict(row), ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    if PARTITIONED_LOGS:
+        conn.execute(text(f'ALTER TABLE logs DETACH PARTITION "{name}"'))
+    conn.execute(text(f'DROP TABLE "{name}"'))
+    return path
+
+
+def run_log_maintenance(
+    now: datetime | None = None,
+    retention_months: int | None = None,
+    hot_months: int | None = None,
+) -> dict:
+    current = _month_start(now or datetime.utcnow())
+    retention_months = settings.log_retention_months if retention_months is None else retention_months
+    hot_months = settings.log_hot_months if hot_months is None else hot_months
+    cutoff = _add_months(current, -retention_months)
+    summary: dict = {"created": [], "rolled": [], "archived": []}
+
+    with engine.begin() as conn:
+        if PARTITIONED_LOGS:
+            if not _is_partitioned(conn):
+                logger.warning("logs table is not partitioned; recreate it to enable partition maintenance")
+                return summary
+            summary["created"] = _ensure_pg_partitions(conn, current, settings.log_partition_months_ahead)
+        else:
+            _ensure_sqlite_autoincrement(conn)
+            _keep_sqlite_id_floor(conn)
+            summary["rolled"] = _rollover_sqlite(conn, _add_months(current, -(max(hot_months, 1) - 1)))
+
+        for name in _list_partitions(conn):
+            if _partition_month(name) < cutoff:
+                summary["archived"].append(str(_archive_partition(conn, name)))
+    return summary
+
+
+def list_archives() -> list[dict]:
+    if not ARCHIVE_ROOT.exists():
+        return []
+    return [
+        {"month": path.name[5:11], "file": path.name, "size_bytes": path.stat().st_size}
+        for path in sorted(ARCHIVE_ROOT.glob("logs-*.ndjson.gz"))
+    ]
+
+
+def iter_archive(month: str) -> Iterator[dict]:
+    path = _archive_path(datetime.strptime(month, "%Y%m"))
+    with gzip.open(path, "rt", encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def archive_exists(month: str) -> bool:
+    try:
+        return _archive_path(datetime.strptime(month, "%Y%m")).exists()
+    except ValueError:
+        return False
+
+
+if __name__ == "__main__":
+    # للتشغيل الدوري (cron أو systemd timer): python -m app.log_archive
+    print(json.dumps(run_log_maintenance()))
@@ -1,40 +1,91 @@
 from pathlib import Path
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
 
+from .audit import audit_writer
 from .config import settings
-from .database import Base, SessionLocal, engine
+from .database import (
+    WRITE_TOKEN_COOKIE,
+    WRITE_TOKEN_HEADER,
+    Base,
+    SessionLocal,
+    dispose_async_engine,
+    engine,
+    pool_stats,
+    startup_lock,
+    track_writes,
+)
+from .deps import require_roles
+from .events import change_broker, purge_old_changes
+from .locks import backfill_lock_leases, lock_manager, reclaim_expired_locks
+from .log_archive import run_log_maintenance
 from .models import Role, User
-from .routers import auth, files, folders, installations, logs, tasks, users
-from .security import get_password_hash
+from .routers import auth, bulk, events, files, folders, installations, logs, sync, tasks, uploads, users, versions
+from .routers.folders import backfill_folder_paths
+from .routers.uploads import purge_expired_upload_sessions
+from .security import get_password_hash, password_pool
+from .storage import collect_blob_garbage
 
 app = FastAPI(title=settings.app_name, version=settings.app_version)
 
+ROLE_NAMES = ["Admin", "Manager", "Employee", "Read-Only"]
+
+
+def seed_defaults(db: Session) -> None:
+    # INSERT ... ON CONFLICT DO NOTHING: لا يفشل إن سبقه worker آخر بإدخال نفس الصف
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    db.execute(insert(Role).values([{"name": name} for name in ROLE_NAMES]).on_conflict_do_nothing())
+    if not db.query(User.id).filter(User.username == "admin").first():
+        admin_role_id = db.query(Role.id).filter(Role.name == "Admin").scalar()
+        db.execute(
+            insert(User)
+            .values(username="admin", password_hash=get_password_hash("admin123"), role_id=admin_role_id)
+            .on_conflict_do_nothing()
+        )
+    db.commit()
+
+
+def run_startup_tasks() -> None:
+    with startup_lock():
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            seed_defaults(db)
+            backfill_folder_paths(db)
+            purge_expired_upload_sessions(db)
+            collect_blob_garbage(db)
+            purge_old_changes(db)
+            backfill_lock_leases(db)
+            reclaim_expired_locks(db, force=True)
+        finally:
+            db.close()
+        run_log_maintenance()
+
 
 @app.on_event("startup")
 def on_startup() -> None:
-    Base.metadata.create_all(bind=engine)
+    # مع gunicorn تُنفذ التهيئة مرة واحدة في الـ master قبل تشغيل الـ workers (انظر deployment/gunicorn.conf.py)،
+    # فلا يحذف worker أُعيد تشغيله blobs بينما بقية الـ workers تستقبل رفعًا
+    if settings.startup_maintenance:
+        run_startup_tasks()
     db = SessionLocal()
     try:
-        for role_name in ["Admin", "Manager", "Employee", "Read-Only"]:
-            if not db.query(Role).filter(Role.name == role_name).first():
-                db.add(Role(name=role_name))
-        db.commit()
-
-        admin = db.query(User).filter(User.username == "admin").first()
-        if not admin:
-            admin_role = db.query(Role).filter(Role.name == "Admin").first()
-            db.add(
-                User(
-                    username="admin",
-                    password_hash=get_password_hash("admin123"),
-                    role_id=admin_role.id,
-                )
-            )
-            db.commit()
+        lock_manager.load(db)
     finally:
         db.close()
+    audit_writer.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await change_broker.stop()
+    await dispose_async_engine()
+    audit_writer.stop()
+    password_pool.shutdown()
 
 
 @app.get("/")
@@ -47,6 +98,49 @@ def health() -> dict:
     return {"status": "ok", "version": settings.app_version}
 
 
+@app.get("/health/db", dependencies=[Depends(require_roles("Admin"))])
+def health_db() -> dict:
+    return pool_stats()
+
+
+@app.exception_handler(PoolTimeoutError)
+def pool_exhausted(_: Request, __: PoolTimeoutError) -> JSONResponse:
+    # كل اتصالات الـ pool مشغولة لأكثر من DB_POOL_TIMEOUT_SEC: العميل يعيد المحاولة بدل 500
+    return JSONResponse(status_code=503, content={"detail": "Database busy, retry shortly"}, headers={"Retry-After": "1"})
+
+
+class ReadYourWritesMiddleware:
+    # بعد commit لمستخدم يُرسل له طابع موقّع (ترويسة وكوكي)؛ يعيده مع طلباته التالية فيقرأ من الـ primary في أي worker
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_writes() as marks:
+
+            async def send_with_token(message) -> None:
+                if message["type"] == "http.response.start" and "token" in marks:
+                    token = marks["token"].encode()
+                    max_age = int(settings.read_your_writes_sec)
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (WRITE_TOKEN_HEADER.lower().encode(), token),
+                        (
+                            b"set-cookie",
+                            WRITE_TOKEN_COOKIE.encode() + b"=" + token
+                            + f"; Max-Age={max_age}; Path=/; HttpOnly; SameSite=Lax".encode(),
+                        ),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_token)
+
+
+app.add_middleware(ReadYourWritesMiddleware)
+
+
 @app.get("/ui")
 def web_ui() -> FileResponse:
     return FileResponse(Path(__file__).parent / "web" / "index.html")
@@ -55,7 +149,17 @@ def web_ui() -> FileResponse:
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(folders.router)
+# قبل files حتى لا يطابق /files/bulk/move المسار /files/{file_id}/move
+app.include_router(bulk.router)
 app.include_router(files.router)
+app.include_router(versions.router)
+app.include_router(uploads.router)
 app.include_router(tasks.router)
 app.include_router(logs.router)
 app.include_router(installations.router)
+app.include_router(events.router)
+app.include_router(sync.router)
+
+
+if __name__ == "__main__":
+    run_startup_tasks()
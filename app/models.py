@@ -1,7 +1,8 @@
 from datetime import datetime
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+from .config import settings
 from .database import Base
 
 
@@ -33,10 +34,26 @@ class Folder(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
-    parent_id: Mapped[int | None] = mapped_column(ForeignKey("folders.id"), nullable=True)
+    parent_id: Mapped[int | None] = mapped_column(ForeignKey("folders.id"), nullable=True, index=True)
+    # المسار المادي من الجذر بصيغة "/1/5/9/" حتى تكون استعلامات الشجرة الفرعية والأسلاف استعلامًا واحدًا
+    path: Mapped[str | None] = mapped_column(String(1024), nullable=True)
+    depth: Mapped[int] = mapped_column(Integer, default=0)
     created_by: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_folders_path", "path", postgresql_ops={"path": "text_pattern_ops"}),
+    )
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    ref_count: Mapped[int] = mapped_column(Integer, default=0, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 
 class FileRecord(Base):
     __tablename__ = "files"
@@ -46,11 +63,50 @@ class FileRecord(Base):
     stored_name: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
     original_name: Mapped[str] = mapped_column(String(255), nullable=False)
     version: Mapped[int] = mapped_column(Integer, default=1)
-    size: Mapped[int] = mapped_column(Integer, default=0)
+    size: Mapped[int] = mapped_column(BigInteger, default=0)
+    sha256: Mapped[str | None] = mapped_column(ForeignKey("blobs.sha256"), nullable=True, index=True)
     created_by: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    updated_by: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     is_locked: Mapped[bool] = mapped_column(Boolean, default=False)
-    locked_by: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True)
+    locked_by: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True, index=True)
+    # القفل عقد مؤقت (lease) يجدده العميل؛ بعد هذا الموعد لا يمنع أحدًا
+    lock_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, index=True)
+
+    # فهارس مطابقة لترتيب قائمة محتويات المجلد (keyset pagination)
+    __table_args__ = (
+        Index("ix_files_folder_name", "folder_id", "original_name", "id"),
+        Index("ix_files_folder_updated", "folder_id", "updated_at", "id"),
+        Index("ix_files_folder_size", "folder_id", "size", "id"),
+    )
+
+
+class FileVersion(Base):
+    __tablename__ = "file_versions"
+
+    # الإصدارات السابقة فقط؛ الإصدار الحالي يبقى في files. كل صف يحجز مرجعًا على الـ blob الخاص به
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    file_id: Mapped[int] = mapped_column(ForeignKey("files.id"), nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    sha256: Mapped[str] = mapped_column(ForeignKey("blobs.sha256"), nullable=False, index=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    saved_by: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (Index("ix_file_versions_file_version", "file_id", "version", unique=True),)
+
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    folder_id: Mapped[int] = mapped_column(ForeignKey("folders.id"), nullable=False)
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
+    total_size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    chunk_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
 
 
 class Permission(Base):
@@ -75,15 +131,29 @@ class Task(Base):
     due_date: Mapped[str | None] = mapped_column(String(40), nullable=True)
 
 
+# على Postgres يُنشأ جدول السجلات مقسمًا شهريًا على timestamp، ولذلك يدخل timestamp في المفتاح الأساسي
+PARTITIONED_LOGS = settings.database_url.split(":", 1)[0].split("+", 1)[0] in ("postgresql", "postgres")
+
+
 class AuditLog(Base):
     __tablename__ = "logs"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     action: Mapped[str] = mapped_column(String(100), nullable=False)
     target_type: Mapped[str] = mapped_column(String(50), nullable=False)
     target_id: Mapped[str] = mapped_column(String(100), nullable=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, primary_key=PARTITIONED_LOGS)
+
+    # كل فهرس ينتهي بـ (timestamp, id) ليطابق ترتيب الصفحات في GET /logs
+    __table_args__ = (
+        Index("ix_logs_timestamp_id", "timestamp", "id"),
+        Index("ix_logs_user_timestamp", "user_id", "timestamp", "id"),
+        Index("ix_logs_action_timestamp", "action", "timestamp", "id"),
+        Index("ix_logs_target_timestamp", "target_type", "target_id", "timestamp", "id"),
+        # على SQLite: AUTOINCREMENT يمنع إعادة استخدام المعرفات بعد نقل الصفوف إلى logs_pYYYYMM
+        {"postgresql_partition_by": "RANGE (timestamp)"} if PARTITIONED_LOGS else {"sqlite_autoincrement": True},
+    )
 
 
 class Installation(Base):
@@ -95,3 +165,26 @@ class Installation(Base):
     license_token: Mapped[str] = mapped_column(String(1024), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class CacheEpoch(Base):
+    __tablename__ = "cache_epochs"
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+
+    # id تسلسلي يُستخدم كمؤشر الاستئناف (Last-Event-ID) لدى العملاء
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    entity_type: Mapped[str] = mapped_column(String(20), nullable=False)
+    entity_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    folder_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    # أحداث خاصة بمستخدم واحد (مثل المهام المسندة له)؛ NULL تعني للجميع
+    recipient_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    payload: Mapped[str] = mapped_column(Text, default="{}")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
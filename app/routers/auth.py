@@ -1,23 +1,38 @@
 from fastapi import APIRouter, Depends, HTTPException
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..config import settings
 from ..database import get_db
 from ..models import User
 from ..schemas import LoginRequest, RefreshRequest, Token
-from ..security import create_token, verify_password
+from ..security import create_token, verify_password_async
 
 router = APIRouter(tags=["auth"])
 
 
+def _find_active_user(db: Session, username: str) -> User | None:
+    return db.query(User).filter(User.username == username, User.is_active.is_(True)).first()
+
+
+def _record_login(db: Session, user: User, device_id: str, new_hash: str | None) -> None:
+    user.device_id = device_id
+    if new_hash:
+        user.password_hash = new_hash
+    db.commit()
+
+
 @router.post("/login", response_model=Token)
-def login(payload: LoginRequest, db: Session = Depends(get_db)) -> Token:
-    user = db.query(User).filter(User.username == payload.username, User.is_active.is_(True)).first()
-    if not user or not verify_password(payload.password, user.password_hash):
+async def login(payload: LoginRequest, db: Session = Depends(get_db)) -> Token:
+    # async: انتظار bcrypt في مجمع العمليات لا يحجز خيطًا من threadpool، والوصول للقاعدة يبقى في threadpool
+    user = await run_in_threadpool(_find_active_user, db, payload.username)
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
-    user.device_id = payload.device_id
-    db.commit()
+    valid, new_hash = await verify_password_async(payload.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    await run_in_threadpool(_record_login, db, user, payload.device_id, new_hash)
     return Token(
         access_token=create_token(user.username, token_type="access"),
         refresh_token=create_token(user.username, token_type="refresh"),
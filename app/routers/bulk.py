@@ -0,0 +1,195 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete, or_, true, update
+from sqlalchemy.orm import Session
+
+from ..audit import record_audit
+from ..config import settings
+from ..database import get_db
+from ..deps import Principal, get_current_user
+from ..events import record_file_change
+from ..locks import acquire_locks, active_lock_holder, forget_locks, lease_ttl, lock_active
+from ..models import FileRecord, Folder
+from ..schemas import BulkFiles, BulkItemResult, BulkLock, BulkMove, BulkResult
+from ..storage import release_blobs
+from ..versions import delete_version_history
+from .files import is_admin, release_content
+
+router = APIRouter(prefix="/files/bulk", tags=["files"])
+
+NOT_FOUND = ("not_found", "File not found")
+LOCKED = ("locked", "File locked by another user")
+
+
+def _load(db: Session, file_ids: list[int]) -> tuple[list[int], dict[int, FileRecord]]:
+    ids = list(dict.fromkeys(file_ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No files given")
+    if len(ids) > settings.bulk_max_items:
+        raise HTTPException(status_code=400, detail=f"At most {settings.bulk_max_items} files per request")
+    return ids, {r.id: r for r in db.query(FileRecord).filter(FileRecord.id.in_(ids))}
+
+
+def _editable(
+    ids: list[int], records: dict[int, FileRecord], current: Principal
+) -> tuple[list[FileRecord], dict[int, tuple[str, str]]]:
+    # فحص الصلاحيات والأقفال على المجموعة كلها مرة واحدة بدل فحص لكل طلب
+    failures = {i: NOT_FOUND for i in set(ids) - records.keys()}
+    if not is_admin(current):
+        now = datetime.utcnow()
+        blocked = {i for i, r in records.items() if active_lock_holder(r, now) not in (None, current.id)}
+        failures |= {i: LOCKED for i in blocked}
+    return [records[i] for i in ids if i not in failures], failures
+
+
+def _not_locked_by_others(current: Principal, now: datetime):
+    # نفس شرط _editable داخل WHERE جملة التعديل: قفل أُخذ بعد القراءة الأولى يمنع التعديل فعلًا
+    if is_admin(current):
+        return true()
+    return or_(~lock_active(now), FileRecord.locked_by == current.id)
+
+
+def _recheck(db: Session, ids: list[int], current: Principal) -> dict[int, tuple[str, str]]:
+    # صفوف لم تطبق عليها الجملة المشروطة: حُذفت أو قُفلت بين القراءة والتعديل
+    if not ids:
+        return {}
+    rows = db.query(FileRecord).filter(FileRecord.id.in_(ids)).populate_existing()
+    return _editable(ids, {r.id: r for r in rows}, current)[1]
+
+
+def _conditional_update(db: Session, ids: list[int], condition, values: dict) -> list[FileRecord]:
+    return (
+        db.execute(
+            update(FileRecord)
+            .where(FileRecord.id.in_(ids), condition)
+            .values(values)
+            .returning(FileRecord)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def _result(ids: list[int], failures: dict[int, tuple[str, str]]) -> BulkResult:
+    results = [
+        BulkItemResult(id=i, status=failures[i][0], detail=failures[i][1]) if i in failures
+        else BulkItemResult(id=i, status="ok")
+        for i in ids
+    ]
+    return BulkResult(succeeded=len(ids) - len(failures), failed=len(failures), results=results)
+
+
+@router.post("/move", response_model=BulkResult)
+def bulk_move(
+    payload: BulkMove,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> BulkResult:
+    if not db.query(Folder.id).filter(Folder.id == payload.target_folder_id).first():
+        raise HTTPException(status_code=404, detail="Target folder not found")
+    ids, records = _load(db, payload.file_ids)
+    editable, failures = _editable(ids, records, current)
+
+    if editable:
+        now = datetime.utcnow()
+        sources = {r.id: r.folder_id for r in editable}
+        moved = _conditional_update(
+            db,
+            list(sources),
+            _not_locked_by_others(current, now),
+            {FileRecord.folder_id: payload.target_folder_id, FileRecord.updated_at: now},
+        )
+        lost = [i for i in sources if i not in {r.id for r in moved}]
+        failures |= {i: LOCKED for i in lost} | _recheck(db, lost, current)
+        for record in moved:
+            record_audit(db, current.id, "move", "file", str(record.id))
+            record_file_change(db, current.id, "moved", record, from_folder_id=sources[record.id])
+        db.commit()
+    return _result(ids, failures)
+
+
+@router.post("/delete", response_model=BulkResult)
+def bulk_delete(
+    payload: BulkFiles,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> BulkResult:
+    ids, records = _load(db, payload.file_ids)
+    editable, failures = _editable(ids, records, current)
+
+    if editable:
+        now = datetime.utcnow()
+        # file_versions تشير إلى files فلا يمكن الحذف المشروط أولًا؛ نحجز الصفوف بتحديث مشروط ثم نحذف ما عاد منه فقط
+        claimed = _conditional_update(
+            db, [r.id for r in editable], _not_locked_by_others(current, now), {FileRecord.updated_at: now}
+        )
+        lost = [r.id for r in editable if r.id not in {c.id for c in claimed}]
+        failures |= {i: LOCKED for i in lost} | _recheck(db, lost, current)
+        if claimed:
+            deleted = [r.id for r in claimed]
+            for record in claimed:
+                record_audit(db, current.id, "delete", "file", str(record.id))
+                record_file_change(db, current.id, "deleted", record)
+                if not record.sha256:
+                    release_content(db, None, record.stored_name)
+            delete_version_history(db, deleted)
+            release_blobs(db, [r.sha256 for r in claimed])
+            db.execute(
+                delete(FileRecord).where(FileRecord.id.in_(deleted)).execution_options(synchronize_session=False)
+            )
+            if locked := [r.id for r in claimed if r.is_locked]:
+                forget_locks(locked)
+        db.commit()
+    return _result(ids, failures)
+
+
+@router.post("/lock", response_model=BulkResult)
+def bulk_lock(
+    payload: BulkLock,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> BulkResult:
+    ttl = lease_ttl(payload.ttl_sec)
+    ids, records = _load(db, payload.file_ids)
+    editable, failures = _editable(ids, records, current)
+
+    if editable:
+        locked = acquire_locks(db, [r.id for r in editable], current.id, ttl, force=is_admin(current))
+        # ملفات قفلها مستخدم آخر بين القراءة والتحديث
+        locked_ids = {r.id for r in locked}
+        failures |= {r.id: LOCKED for r in editable if r.id not in locked_ids}
+        for record in locked:
+            record_audit(db, current.id, "lock", "file", str(record.id))
+            record_file_change(db, current.id, "locked", record)
+        db.commit()
+    return _result(ids, failures)
+
+
+@router.post("/unlock", response_model=BulkResult)
+def bulk_unlock(
+    payload: BulkFiles,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> BulkResult:
+    ids, records = _load(db, payload.file_ids)
+    editable, failures = _editable(ids, records, current)
+
+    if editable:
+        now = datetime.utcnow()
+        # فقط الصفوف المقفلة فعلًا وقت التحديث تُفك وتُسجل في السجل والأحداث
+        unlocked = _conditional_update(
+            db,
+            [r.id for r in editable],
+            FileRecord.is_locked.is_(True) & _not_locked_by_others(current, now),
+            {FileRecord.is_locked: False, FileRecord.locked_by: None, FileRecord.lock_expires_at: None},
+        )
+        unlocked_ids = {r.id for r in unlocked}
+        failures |= _recheck(db, [r.id for r in editable if r.id not in unlocked_ids], current)
+        forget_locks(list(unlocked_ids))
+        for record in unlocked:
+            record_audit(db, current.id, "unlock", "file", str(record.id))
+            record_file_change(db, current.id, "unlocked", record)
+        db.commit()
+    return _result(ids, failures)
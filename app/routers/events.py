@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import get_async_db
+from ..deps import Principal, get_current_user_async
+from ..events import FETCH_LIMIT, event_out, fetch_changes_async, settled_change_id_async, stream_changes
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+@router.get("")
+async def list_events(
+    after: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=FETCH_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+    current: Principal = Depends(get_current_user_async),
+) -> dict:
+    rows = await fetch_changes_async(db, after, current.id, limit)
+    return {
+        "events": [event_out(row) for row in rows],
+        "last_event_id": rows[-1].id if rows else after,
+    }
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    after: int | None = Query(default=None, ge=0),
+    timeout: float = Query(default=settings.events_stream_max_sec, gt=0, le=settings.events_stream_max_sec),
+    last_event_id: str | None = Header(default=None),
+    db: AsyncSession = Depends(get_async_db),
+    current: Principal = Depends(get_current_user_async),
+) -> StreamingResponse:
+    # عند إعادة الاتصال يرسل EventSource آخر id استلمه؛ بدون مؤشر يبدأ البث من اللحظة الحالية
+    if last_event_id:
+        try:
+            after = int(last_event_id)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID") from exc
+    if after is None:
+        after = await settled_change_id_async(db)
+
+    return StreamingResponse(
+        stream_changes(current.id, after, timeout, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
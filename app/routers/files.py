@@ -1,139 +1,338 @@
 from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO
+import json
 import uuid
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..audit import record_audit, record_audit_now
+from ..config import settings
 from ..database import get_db
-from ..deps import get_current_user
-from ..models import AuditLog, FileRecord, Folder, User
-
-STORAGE_ROOT = Path("data/storage")
-STORAGE_ROOT.mkdir(parents=True, exist_ok=True)
+from ..delta import MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, DeltaReader, compute_signatures
+from ..deps import Principal, get_async_read_db, get_current_user, get_current_user_async, get_read_db
+from ..events import record_file_change
+from ..http_ranges import content_disposition, file_download_response, http_date, is_not_modified
+from ..locks import (
+    acquire_lock,
+    active_lock_holder,
+    forget_locks,
+    lease_ttl,
+    lock_active,
+    reclaim_expired_locks,
+    release_lock,
+    renew_lock,
+)
+from ..models import Blob, FileRecord, Folder
+from ..schemas import ContentReference, LockOut, UploadByReference, ZipRequest
+from ..storage import blob_exists, has_blob, ingest_blob, materialize_blob, reference_blob, release_blob
+from ..versions import apply_version_retention, archive_version, delete_version_history, snapshot_version
+from ..zip_stream import iter_zip, safe_member_name, unique_member_names
 
 router = APIRouter(tags=["files"])
 
 
-def _is_admin(user: User) -> bool:
-    return bool(user.role and user.role.name == "Admin")
+def is_admin(user: Principal) -> bool:
+    return user.role_name == "Admin"
 
 
 def _log(db: Session, user_id: int, action: str, target_type: str, target_id: str) -> None:
-    db.add(AuditLog(user_id=user_id, action=action, target_type=target_type, target_id=target_id))
+    record_audit(db, user_id, action, target_type, target_id)
 
 
-def _assert_can_edit(record: FileRecord, current: User) -> None:
-    if _is_admin(current):
+def assert_can_edit(record: FileRecord, current: Principal) -> None:
+    if is_admin(current):
         return
-    if record.is_locked and record.locked_by != current.id:
+    if active_lock_holder(record) not in (None, current.id):
         raise HTTPException(status_code=409, detail="File locked by another user")
 
 
-def _write_content_in_place(target_path: str, payload: bytes) -> None:
-    path = Path(target_path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_bytes(payload)
+def content_path(record: FileRecord) -> Path:
+    # السجلات القديمة (قبل مخزن الـ blobs) تحفظ مسار الملف مباشرة في stored_name
+    if record.sha256 and blob_exists(record.sha256):
+        return materialize_blob(record.sha256)
+    return Path(record.stored_name)
 
 
-@router.post("/upload")
-def upload_file(
-    folder_id: int,
-    incoming_file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
-) -> dict:
-    folder = db.query(Folder).filter(Folder.id == folder_id).first()
-    if not folder:
-        raise HTTPException(status_code=404, detail="Folder not found")
+def file_etag(record: FileRecord) -> str:
+    return f'"v{record.version}-{(record.sha256 or "legacy")[:16]}"'
+
+
+def release_content(db: Session, sha256: str | None, stored_name: str) -> None:
+    if sha256:
+        release_blob(db, sha256)
+        return
+    legacy = Path(stored_name)
+    if len(legacy.parts) > 1 and legacy.exists():
+        legacy.unlink()
+
+
+def expected_versions(if_match: str | None, expected_version: int | None) -> set[int] | None:
+    # يقبل ETag الذي أعاده التنزيل ("v3-...") أو رقم الإصدار مباشرة؛ "*" أو غيابه يعني بدون شرط.
+    # If-Match يقارن مقارنة قوية: وسم W/ لا يطابق أي إصدار، فإن لم يبق غيره يعود 412
+    if expected_version is not None:
+        return {expected_version}
+    if not if_match or if_match.strip() == "*":
+        return None
+    versions = set()
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            continue
+        version = tag.strip('"').removeprefix("v").split("-", 1)[0]
+        if not version.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid If-Match header")
+        versions.add(int(version))
+    return versions
+
+
+def check_precondition(record: FileRecord, expected: set[int] | None) -> None:
+    if expected is not None and record.version not in expected:
+        raise HTTPException(
+            status_code=412,
+            detail="File was modified by someone else",
+            headers={"ETag": file_etag(record)},
+        )
+
+
+def _file_result(record: FileRecord, saved_in_place: bool) -> dict:
+    return {
+        "id": record.id,
+        "name": record.original_name,
+        "size": record.size,
+        "sha256": record.sha256,
+        "version": record.version,
+        "etag": file_etag(record),
+        "saved_in_place": saved_in_place,
+    }
+
 
-    content = incoming_file.file.read()
-    existing = (
+def find_existing_file(db: Session, folder_id: int, filename: str) -> FileRecord | None:
+    return (
         db.query(FileRecord)
-        .filter(FileRecord.folder_id == folder_id, FileRecord.original_name == incoming_file.filename)
+        .filter(FileRecord.folder_id == folder_id, FileRecord.original_name == filename)
         .first()
     )
+
+
+def save_new_version(
+    db: Session,
+    record: FileRecord,
+    blob: Blob,
+    current: Principal,
+    expected: set[int] | None = None,
+    action: str = "save_in_place",
+) -> dict:
+    # UPDATE مشروط على رقم الإصدار: حفظان متزامنان لا يمكن أن يبنيا على نفس الإصدار
+    for _ in range(3):
+        check_precondition(record, expected)
+        previous = snapshot_version(record)
+        saved = db.execute(
+            update(FileRecord)
+            .where(FileRecord.id == record.id, FileRecord.version == record.version)
+            .values(
+                version=record.version + 1,
+                sha256=blob.sha256,
+                size=blob.size,
+                updated_by=current.id,
+                updated_at=datetime.utcnow(),
+            )
+        ).rowcount
+        if saved:
+            break
+        # سبقنا حفظ آخر: مع شرط مسبق يعود 412، وبدونه نعيد المحاولة فوق الإصدار الأحدث
+        db.refresh(record)
+    else:
+        raise HTTPException(status_code=409, detail="File is being saved concurrently, retry")
+
+    archive_version(db, previous, record.stored_name)
+    apply_version_retention(db, record.id)
+    _log(db, current.id, action, "file", str(record.id))
+    record_file_change(db, current.id, "saved", record)
+    db.commit()
+    return _file_result(record, saved_in_place=True)
+
+
+def commit_upload(
+    db: Session,
+    folder_id: int,
+    filename: str,
+    content: BinaryIO | Blob,
+    current: Principal,
+    expected_sha256: str | None = None,
+) -> dict:
+    # content إما تيار بايتات يُخزَّن الآن، أو blob موجود مسبقًا (الرفع بالمرجع)
+    existing = find_existing_file(db, folder_id, filename)
     if existing:
-        _assert_can_edit(existing, current)
-        _write_content_in_place(existing.stored_name, content)
-        existing.version += 1
-        existing.size = len(content)
-        existing.updated_at = datetime.utcnow()
-        _log(db, current.id, "save_in_place", "file", str(existing.id))
-        db.commit()
-        return {
-            "id": existing.id,
-            "name": existing.original_name,
-            "size": existing.size,
-            "version": existing.version,
-            "saved_in_place": True,
-        }
-
-    ext = Path(incoming_file.filename).suffix
-    stored_name = f"{uuid.uuid4()}{ext}"
-    year_dir = STORAGE_ROOT / str(datetime.utcnow().year)
-    year_dir.mkdir(parents=True, exist_ok=True)
-    target = year_dir / stored_name
-
-    _write_content_in_place(str(target), content)
+        assert_can_edit(existing, current)
+    blob = content if isinstance(content, Blob) else ingest_blob(db, content, expected_sha256=expected_sha256)
+    if existing:
+        return save_new_version(db, existing, blob, current)
 
     record = FileRecord(
         folder_id=folder_id,
-        stored_name=str(target),
-        original_name=incoming_file.filename,
+        stored_name=f"{uuid.uuid4()}{Path(filename).suffix}",
+        original_name=filename,
         version=1,
-        size=len(content),
+        size=blob.size,
+        sha256=blob.sha256,
         created_by=current.id,
     )
     db.add(record)
     db.flush()
     _log(db, current.id, "upload", "file", str(record.id))
+    record_file_change(db, current.id, "created", record)
     db.commit()
-    return {
-        "id": record.id,
-        "name": incoming_file.filename,
-        "size": len(content),
-        "version": record.version,
-        "saved_in_place": False,
-    }
+    return _file_result(record, saved_in_place=False)
+
+
+@router.post("/upload")
+def upload_file(
+    folder_id: int,
+    incoming_file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    folder = db.query(Folder).filter(Folder.id == folder_id).first()
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    return commit_upload(db, folder_id, incoming_file.filename, incoming_file.file, current)
 
 
 @router.put("/files/{file_id}/save")
 def save_file_in_place(
     file_id: int,
     incoming_file: UploadFile = File(...),
+    expected_version: int | None = None,
+    if_match: str | None = Header(default=None),
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> dict:
     record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
     if not record:
         raise HTTPException(status_code=404, detail="File not found")
-    _assert_can_edit(record, current)
-
-    content = incoming_file.file.read()
-    _write_content_in_place(record.stored_name, content)
-    record.size = len(content)
-    record.version += 1
-    record.updated_at = datetime.utcnow()
-    _log(db, current.id, "save_in_place", "file", str(file_id))
-    db.commit()
+    assert_can_edit(record, current)
+    expected = expected_versions(if_match, expected_version)
+    check_precondition(record, expected)
+
+    return save_new_version(db, record, ingest_blob(db, incoming_file.file), current, expected)
+
+
+def _referenced_blob(db: Session, payload: ContentReference) -> Blob:
+    blob = reference_blob(db, payload.sha256.lower(), payload.size)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Content not found, upload the bytes instead")
+    return blob
+
+
+@router.post("/files/precheck")
+def precheck_content(
+    payload: ContentReference,
+    db: Session = Depends(get_db),
+    _: Principal = Depends(get_current_user),
+) -> dict:
+    digest = payload.sha256.lower()
+    return {"sha256": digest, "size": payload.size, "exists": has_blob(db, digest, payload.size)}
+
+
+@router.post("/upload/by-reference")
+def upload_by_reference(
+    payload: UploadByReference,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    folder = db.query(Folder).filter(Folder.id == payload.folder_id).first()
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    return commit_upload(db, payload.folder_id, payload.filename, _referenced_blob(db, payload), current)
+
+
+@router.put("/files/{file_id}/save/by-reference")
+def save_by_reference(
+    file_id: int,
+    payload: ContentReference,
+    expected_version: int | None = None,
+    if_match: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    assert_can_edit(record, current)
+    expected = expected_versions(if_match, expected_version)
+    check_precondition(record, expected)
+
+    return save_new_version(db, record, _referenced_blob(db, payload), current, expected)
+
+
+@router.get("/files/{file_id}/signatures")
+def get_block_signatures(
+    file_id: int,
+    block_size: int | None = None,
+    db: Session = Depends(get_db),
+    _: Principal = Depends(get_current_user),
+) -> dict:
+    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    block_size = block_size or settings.delta_block_size
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise HTTPException(status_code=400, detail="Invalid block size")
 
     return {
-        "id": record.id,
-        "name": record.original_name,
-        "size": record.size,
+        "file_id": record.id,
         "version": record.version,
-        "saved_in_place": True,
+        "size": record.size,
+        "sha256": record.sha256,
+        "block_size": block_size,
+        "blocks": compute_signatures(content_path(record), block_size),
     }
 
 
+@router.put("/files/{file_id}/save/delta")
+def save_delta(
+    file_id: int,
+    base_version: int,
+    instructions: str = Form(...),
+    literals: UploadFile = File(...),
+    sha256: str | None = None,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    assert_can_edit(record, current)
+    if record.version != base_version:
+        raise HTTPException(status_code=412, detail="File changed since signatures were taken")
+
+    try:
+        ops = json.loads(instructions)
+        if not isinstance(ops, list):
+            raise ValueError("instructions must be a list")
+        reader = DeltaReader(content_path(record), ops, literals.file, settings.upload_chunk_size)
+        blob = ingest_blob(db, reader, expected_sha256=sha256)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid delta: {exc}") from exc
+    return save_new_version(db, record, blob, current, expected={base_version})
+
+
 @router.post("/files/{file_id}/move")
 def move_file(
     file_id: int,
     target_folder_id: int,
+    expected_version: int | None = None,
+    if_match: str | None = Header(default=None),
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> dict:
     record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
     if not record:
@@ -143,12 +342,23 @@ def move_file(
         raise HTTPException(status_code=404, detail="Target folder not found")
 
     # الأدمن يمتلك صلاحية مطلقة للتحريك
-    if not _is_admin(current):
-        _assert_can_edit(record, current)
-
-    record.folder_id = target_folder_id
-    record.updated_at = datetime.utcnow()
+    if not is_admin(current):
+        assert_can_edit(record, current)
+
+    expected = expected_versions(if_match, expected_version)
+    check_precondition(record, expected)
+
+    source_folder_id = record.folder_id
+    condition = FileRecord.id == file_id
+    if expected is not None:
+        condition = condition & FileRecord.version.in_(expected)
+    moved = db.execute(
+        update(FileRecord).where(condition).values(folder_id=target_folder_id, updated_at=datetime.utcnow())
+    ).rowcount
+    if not moved:
+        raise HTTPException(status_code=412, detail="File was modified by someone else")
     _log(db, current.id, "move", "file", str(file_id))
+    record_file_change(db, current.id, "moved", record, from_folder_id=source_folder_id)
     db.commit()
     return {"message": "moved", "file_id": file_id, "target_folder_id": target_folder_id}
 
@@ -157,18 +367,20 @@ def move_file(
 def delete_file(
     file_id: int,
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> dict:
     record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
     if not record:
         raise HTTPException(status_code=404, detail="File not found")
 
-    if not _is_admin(current):
-        _assert_can_edit(record, current)
+    if not is_admin(current):
+        assert_can_edit(record, current)
 
-    path = Path(record.stored_name)
-    if path.exists():
-        path.unlink()
+    record_file_change(db, current.id, "deleted", record)
+    delete_version_history(db, [record.id])
+    release_content(db, record.sha256, record.stored_name)
+    if record.is_locked:
+        forget_locks([record.id])
     db.delete(record)
     _log(db, current.id, "delete", "file", str(file_id))
     db.commit()
@@ -176,52 +388,116 @@ def delete_file(
 
 
 @router.get("/download/{file_id}")
-def download_file(
+async def download_file(
     file_id: int,
-    db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
-) -> FileResponse:
-    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    current: Principal = Depends(get_current_user_async),
+) -> Response:
+    record = await db.get(FileRecord, file_id)
     if not record:
         raise HTTPException(status_code=404, detail="File not found")
-    _log(db, current.id, "download", "file", str(file_id))
-    db.commit()
-    return FileResponse(path=record.stored_name, filename=record.original_name)
+
+    etag = file_etag(record)
+    if is_not_modified(request, etag, record.updated_at):
+        return Response(
+            status_code=304,
+            headers={"ETag": etag, "Last-Modified": http_date(record.updated_at)},
+        )
+
+    # الطابور قد ينتظر عند امتلائه وفك ضغط blob قديم عمل على القرص؛ كلاهما خارج حلقة الأحداث
+    await run_in_threadpool(record_audit_now, current.id, "download", "file", str(file_id))
+    path = await run_in_threadpool(content_path, record)
+    return file_download_response(request, path, record.original_name, etag, record.updated_at)
+
+
+def zip_response(records: list[FileRecord], names: list[str], filename: str) -> StreamingResponse:
+    # المسارات تُحسم قبل بدء البث لأن جلسة قاعدة البيانات تُغلق قبل إرسال الرد
+    entries = []
+    for record, name in zip(records, unique_member_names(names)):
+        path = content_path(record)
+        if path.exists():
+            entries.append((name, path, record.updated_at))
+    return StreamingResponse(
+        iter_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(filename)},
+    )
+
+
+@router.post("/download/zip")
+def download_zip(
+    payload: ZipRequest,
+    db: Session = Depends(get_read_db),
+    current: Principal = Depends(get_current_user),
+) -> StreamingResponse:
+    ids = list(dict.fromkeys(payload.file_ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No files requested")
+    records = {r.id: r for r in db.query(FileRecord).filter(FileRecord.id.in_(ids))}
+    missing = [i for i in ids if i not in records]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found: {missing[:20]}")
+
+    ordered = [records[i] for i in ids]
+    # سجل تدقيق واحد للأرشيف كله بدل سجل لكل ملف
+    record_audit_now(current.id, "download_zip", "files", f"{len(ids)} files")
+    return zip_response(ordered, [safe_member_name(r.original_name) for r in ordered], payload.filename)
 
 
 @router.post("/lock/{file_id}")
 def lock_file(
     file_id: int,
+    ttl_sec: int | None = None,
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> dict:
-    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
-    if not record:
-        raise HTTPException(status_code=404, detail="File not found")
-    if record.is_locked and record.locked_by != current.id and not _is_admin(current):
-        raise HTTPException(status_code=409, detail="File locked by another user")
-
-    record.is_locked = True
-    record.locked_by = current.id
+    # الأدمن يستطيع انتزاع القفل من مستخدم آخر
+    record = acquire_lock(db, file_id, current.id, lease_ttl(ttl_sec), force=is_admin(current))
     _log(db, current.id, "lock", "file", str(file_id))
+    record_file_change(db, current.id, "locked", record)
     db.commit()
-    return {"message": "locked"}
+    reclaim_expired_locks(db)
+    return {"message": "locked", "file_id": file_id, "expires_at": record.lock_expires_at}
+
+
+@router.post("/lock/{file_id}/renew")
+def renew_file_lock(
+    file_id: int,
+    ttl_sec: int | None = None,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    expires_at = renew_lock(db, file_id, current.id, lease_ttl(ttl_sec))
+    return {"message": "renewed", "file_id": file_id, "expires_at": expires_at}
+
+
+@router.get("/locks/mine", response_model=list[LockOut])
+def my_locks(db: Session = Depends(get_db), current: Principal = Depends(get_current_user)) -> list[LockOut]:
+    reclaim_expired_locks(db)
+    rows = (
+        db.query(FileRecord.id, FileRecord.original_name, FileRecord.folder_id, FileRecord.lock_expires_at)
+        .filter(FileRecord.locked_by == current.id, lock_active())
+        .order_by(FileRecord.lock_expires_at)
+        .all()
+    )
+    return [LockOut(file_id=r[0], name=r[1], folder_id=r[2], expires_at=r[3]) for r in rows]
 
 
 @router.post("/unlock/{file_id}")
 def unlock_file(
     file_id: int,
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> dict:
     record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
     if not record:
         raise HTTPException(status_code=404, detail="File not found")
-    if record.locked_by not in (None, current.id) and not _is_admin(current):
+    if active_lock_holder(record) not in (None, current.id) and not is_admin(current):
         raise HTTPException(status_code=403, detail="Cannot unlock file locked by another user")
 
-    record.is_locked = False
-    record.locked_by = None
+    release_lock(db, record)
     _log(db, current.id, "unlock", "file", str(file_id))
+    record_file_change(db, current.id, "unlocked", record)
     db.commit()
     return {"message": "unlocked"}
@@ -1,16 +1,101 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, literal, tuple_
 from sqlalchemy.orm import Session
 
+from ..audit import record_audit_now
 from ..database import get_db
-from ..deps import get_current_user
-from ..models import Folder, User
-from ..schemas import FolderCreate, FolderOut
+from ..deps import Principal, get_current_user, get_read_db
+from ..events import record_folder_change
+from ..locks import active_lock_holder, lock_active
+from ..models import FileRecord, Folder
+from ..pagination import decode_cursor, encode_cursor
+from ..schemas import FileOut, FilePage, FolderCreate, FolderNode, FolderOut, FolderStats
+from ..zip_stream import safe_member_name
+from .files import zip_response
 
 router = APIRouter(prefix="/folders", tags=["folders"])
 
+FILE_SORT_COLUMNS = {
+    "name": (FileRecord.original_name, str),
+    "updated_at": (FileRecord.updated_at, datetime),
+    "size": (FileRecord.size, int),
+}
+
+
+def _child_path(parent: Folder | None, folder_id: int) -> str:
+    return f"{parent.path if parent else '/'}{folder_id}/"
+
+
+def _get_folder(db: Session, folder_id: int) -> Folder:
+    row = db.query(Folder).filter(Folder.id == folder_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    return row
+
+
+def _nodes(db: Session, rows: list[Folder]) -> list[FolderNode]:
+    ids = [r.id for r in rows]
+    with_children = set()
+    if ids:
+        with_children = {
+            parent_id
+            for (parent_id,) in db.query(Folder.parent_id).filter(Folder.parent_id.in_(ids)).distinct()
+        }
+    return [
+        FolderNode(
+            id=r.id,
+            name=r.name,
+            parent_id=r.parent_id,
+            depth=r.depth,
+            path=r.path,
+            has_children=r.id in with_children,
+        )
+        for r in rows
+    ]
+
+
+def backfill_folder_paths(db: Session) -> int:
+    # المجلدات المنشأة قبل إضافة المسار المادي: نحسب مساراتها مرة واحدة من parent_id
+    if not db.query(Folder.id).filter(Folder.path.is_(None)).first():
+        return 0
+    rows = db.query(Folder).all()
+    by_parent: dict[int | None, list[Folder]] = {}
+    for r in rows:
+        by_parent.setdefault(r.parent_id, []).append(r)
+    stack = [(r, None) for r in by_parent.get(None, [])]
+    updated = 0
+    while stack:
+        r, parent = stack.pop()
+        r.path = _child_path(parent, r.id)
+        r.depth = parent.depth + 1 if parent else 0
+        updated += 1
+        stack.extend((child, r) for child in by_parent.get(r.id, []))
+    db.commit()
+    return updated
+
+
+def _file_out(r: FileRecord) -> FileOut:
+    return FileOut(
+        id=r.id,
+        folder_id=r.folder_id,
+        name=r.original_name,
+        size=r.size,
+        sha256=r.sha256,
+        version=r.version,
+        created_by=r.created_by,
+        updated_at=r.updated_at,
+        is_locked=active_lock_holder(r) is not None,
+        locked_by=active_lock_holder(r),
+        lock_expires_at=r.lock_expires_at if r.is_locked else None,
+    )
+
 
 @router.get("", response_model=list[FolderOut])
-def get_folders(db: Session = Depends(get_db), _: User = Depends(get_current_user)) -> list[FolderOut]:
+def get_folders(db: Session = Depends(get_read_db), _: Principal = Depends(get_current_user)) -> list[FolderOut]:
     rows = db.query(Folder).all()
     return [FolderOut(id=r.id, name=r.name, parent_id=r.parent_id) for r in rows]
 
@@ -19,8 +104,9 @@ def get_folders(db: Session = Depends(get_db), _: User = Depends(get_current_use
 def create_folder(
     payload: FolderCreate,
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> FolderOut:
+    parent = None
     if payload.parent_id:
         parent = db.query(Folder).filter(Folder.id == payload.parent_id).first()
         if not parent:
@@ -28,6 +114,10 @@ def create_folder(
 
     row = Folder(name=payload.name, parent_id=payload.parent_id, created_by=current.id)
     db.add(row)
+    db.flush()
+    row.path = _child_path(parent, row.id)
+    row.depth = parent.depth + 1 if parent else 0
+    record_folder_change(db, current.id, "created", row)
     db.commit()
     db.refresh(row)
     return FolderOut(id=row.id, name=row.name, parent_id=row.parent_id)
@@ -37,11 +127,190 @@ def create_folder(
 def delete_folder(
     folder_id: int,
     db: Session = Depends(get_db),
-    _: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> dict:
     row = db.query(Folder).filter(Folder.id == folder_id).first()
     if not row:
         raise HTTPException(status_code=404, detail="Folder not found")
+    has_subfolders = db.query(Folder.id).filter(Folder.parent_id == folder_id).first()
+    has_files = db.query(FileRecord.id).filter(FileRecord.folder_id == folder_id).first()
+    if has_subfolders or has_files:
+        raise HTTPException(status_code=409, detail="Folder is not empty")
+    record_folder_change(db, current.id, "deleted", row)
     db.delete(row)
     db.commit()
     return {"message": "deleted"}
+
+
+@router.post("/{folder_id}/move", response_model=FolderOut)
+def move_folder(
+    folder_id: int,
+    target_parent_id: int | None = None,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> FolderOut:
+    row = _get_folder(db, folder_id)
+    target = _get_folder(db, target_parent_id) if target_parent_id else None
+    if target and target.path.startswith(row.path):
+        raise HTTPException(status_code=409, detail="Cannot move a folder into its own subtree")
+
+    old_prefix = row.path
+    new_prefix = _child_path(target, row.id)
+    depth_delta = (target.depth + 1 if target else 0) - row.depth
+    # تحديث مسارات الشجرة الفرعية كلها بجملة UPDATE واحدة
+    db.query(Folder).filter(Folder.path.startswith(old_prefix, autoescape=True)).update(
+        {
+            Folder.path: literal(new_prefix) + func.substr(Folder.path, len(old_prefix) + 1),
+            Folder.depth: Folder.depth + depth_delta,
+        },
+        synchronize_session=False,
+    )
+    source_parent_id = row.parent_id
+    row.parent_id = target.id if target else None
+    row.path = new_prefix
+    # حدث واحد للمجلد المنقول؛ مسارات الأبناء تُشتق من مساره الجديد
+    record_folder_change(db, current.id, "moved", row, from_parent_id=source_parent_id)
+    db.commit()
+    db.refresh(row)
+    return FolderOut(id=row.id, name=row.name, parent_id=row.parent_id)
+
+
+@router.get("/tree", response_model=list[FolderNode])
+def get_folder_tree(
+    parent_id: int | None = None,
+    depth: int = Query(default=1, ge=1, le=32),
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(get_current_user),
+) -> list[FolderNode]:
+    # توسيع كسول: مستوى واحد افتراضيًا تحت المجلد المطلوب (أو الجذور)
+    query = db.query(Folder)
+    if parent_id is None:
+        query = query.filter(Folder.depth < depth)
+    else:
+        parent = _get_folder(db, parent_id)
+        query = query.filter(
+            Folder.path.startswith(parent.path, autoescape=True),
+            Folder.depth > parent.depth,
+            Folder.depth <= parent.depth + depth,
+        )
+    return _nodes(db, query.order_by(Folder.depth, Folder.name, Folder.id).all())
+
+
+@router.get("/{folder_id}/ancestors", response_model=list[FolderNode])
+def get_folder_ancestors(
+    folder_id: int,
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(get_current_user),
+) -> list[FolderNode]:
+    row = _get_folder(db, folder_id)
+    ids = [int(part) for part in row.path.strip("/").split("/")[:-1]]
+    if not ids:
+        return []
+    return _nodes(db, db.query(Folder).filter(Folder.id.in_(ids)).order_by(Folder.depth).all())
+
+
+@router.get("/{folder_id}/subtree", response_model=list[FolderNode])
+def get_folder_subtree(
+    folder_id: int,
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(get_current_user),
+) -> list[FolderNode]:
+    row = _get_folder(db, folder_id)
+    rows = (
+        db.query(Folder)
+        .filter(Folder.path.startswith(row.path, autoescape=True))
+        .order_by(Folder.path)
+        .all()
+    )
+    return _nodes(db, rows)
+
+
+@router.get("/{folder_id}/stats", response_model=FolderStats)
+def get_folder_stats(
+    folder_id: int,
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(get_current_user),
+) -> FolderStats:
+    row = _get_folder(db, folder_id)
+    in_subtree = Folder.path.startswith(row.path, autoescape=True)
+    folder_count = db.query(func.count(Folder.id)).filter(in_subtree).scalar()
+    file_count, total_bytes = (
+        db.query(func.count(FileRecord.id), func.coalesce(func.sum(FileRecord.size), 0))
+        .join(Folder, Folder.id == FileRecord.folder_id)
+        .filter(in_subtree)
+        .one()
+    )
+    return FolderStats(
+        folder_id=row.id,
+        folder_count=folder_count,
+        file_count=file_count,
+        total_bytes=total_bytes,
+    )
+
+
+@router.get("/{folder_id}/files", response_model=FilePage)
+def list_folder_files(
+    folder_id: int,
+    sort: Literal["name", "updated_at", "size"] = "name",
+    order: Literal["asc", "desc"] = "asc",
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = None,
+    locked: bool | None = None,
+    created_by: int | None = None,
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(get_current_user),
+) -> FilePage:
+    if not db.query(Folder.id).filter(Folder.id == folder_id).first():
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    column, value_type = FILE_SORT_COLUMNS[sort]
+    query = db.query(FileRecord).filter(FileRecord.folder_id == folder_id)
+    if locked is not None:
+        query = query.filter(lock_active() if locked else ~lock_active())
+    if created_by is not None:
+        query = query.filter(FileRecord.created_by == created_by)
+
+    # keyset: نكمل بعد آخر (قيمة الترتيب، id) بدل OFFSET حتى تبقى كل صفحة بنفس التكلفة
+    key = tuple_(column, FileRecord.id)
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, value_type, int)
+        query = query.filter(key > (last_value, last_id) if order == "asc" else key < (last_value, last_id))
+    if order == "asc":
+        query = query.order_by(column.asc(), FileRecord.id.asc())
+    else:
+        query = query.order_by(column.desc(), FileRecord.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+    return FilePage(items=[_file_out(r) for r in rows], next_cursor=next_cursor)
+
+
+@router.get("/{folder_id}/download")
+def download_folder_zip(
+    folder_id: int,
+    db: Session = Depends(get_read_db),
+    current: Principal = Depends(get_current_user),
+) -> StreamingResponse:
+    root = _get_folder(db, folder_id)
+    folders = {
+        r.id: r for r in db.query(Folder).filter(Folder.path.startswith(root.path, autoescape=True))
+    }
+
+    def relative_parts(folder: Folder) -> list[str]:
+        # المسار المادي "/1/5/9/" يعطي سلسلة الأسلاف مباشرة؛ نبدأ من المجلد المطلوب
+        ids = [int(part) for part in folder.path.strip("/").split("/")[root.depth :]]
+        return [safe_member_name(folders[i].name) for i in ids]
+
+    records = (
+        db.query(FileRecord)
+        .filter(FileRecord.folder_id.in_(list(folders)))
+        .order_by(FileRecord.folder_id, FileRecord.original_name)
+        .all()
+    )
+    names = [safe_member_name(*relative_parts(folders[r.folder_id]), r.original_name) for r in records]
+    record_audit_now(current.id, "download_zip", "folder", str(folder_id))
+    return zip_response(records, names, f"{root.name}.zip")
@@ -1,18 +1,216 @@
-from fastapi import APIRouter, Depends
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from typing import Literal
+import csv
+import io
+import json
+import zlib
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select, Table, select, tuple_
 from sqlalchemy.orm import Session
 
-from ..database import get_db
-from ..deps import require_roles
-from ..models import AuditLog, User
+from ..audit import record_audit_now
+from ..database import read_session
+from ..deps import Principal, get_read_db, require_roles
+from ..log_archive import archive_exists, iter_archive, list_archives, log_tables
+from ..pagination import decode_cursor, encode_cursor
 from ..schemas import LogOut
 
 router = APIRouter(prefix="/logs", tags=["logs"])
 
+EXPORT_COLUMNS = ["id", "timestamp", "user_id", "action", "target_type", "target_id"]
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+
+def _naive_utc(value: datetime | None) -> datetime | None:
+    # الطوابع المخزنة بلا منطقة زمنية (UTC)، فنوحّد since/until قبل المقارنة
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _apply_filters(
+    stmt: Select,
+    table: Table,
+    user_id: int | None,
+    action: str | None,
+    target_type: str | None,
+    target_id: str | None,
+    since: datetime | None,
+    until: datetime | None,
+) -> Select:
+    c = table.c
+    if user_id is not None:
+        stmt = stmt.where(c.user_id == user_id)
+    if action:
+        stmt = stmt.where(c.action == action)
+    if target_type:
+        stmt = stmt.where(c.target_type == target_type)
+    if target_id:
+        stmt = stmt.where(c.target_id == target_id)
+    if since:
+        stmt = stmt.where(c.timestamp >= since)
+    if until:
+        stmt = stmt.where(c.timestamp < until)
+    return stmt
+
+
+def _matches(row: dict, filters: tuple) -> bool:
+    user_id, action, target_type, target_id, since, until = filters
+    timestamp = datetime.fromisoformat(row["timestamp"])
+    return (
+        (user_id is None or row["user_id"] == user_id)
+        and (not action or row["action"] == action)
+        and (not target_type or row["target_type"] == target_type)
+        and (not target_id or row["target_id"] == target_id)
+        and (not since or timestamp >= since)
+        and (not until or timestamp < until)
+    )
+
 
 @router.get("", response_model=list[LogOut])
 def get_logs(
-    db: Session = Depends(get_db),
-    _: User = Depends(require_roles("Admin", "Manager")),
+    response: Response,
+    limit: int = Query(default=500, ge=1, le=5000),
+    cursor: str | None = None,
+    user_id: int | None = None,
+    action: str | None = None,
+    target_type: str | None = None,
+    target_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(require_roles("Admin", "Manager")),
 ) -> list[LogOut]:
-    rows = db.query(AuditLog).order_by(AuditLog.timestamp.desc()).limit(500).all()
-    return [LogOut(**r.__dict__) for r in rows]
+    filters = (user_id, action, target_type, target_id, _naive_utc(since), _naive_utc(until))
+    last = decode_cursor(cursor, datetime, int) if cursor else None
+
+    # الجداول مرتبة من الأحدث للأقدم ونطاقاتها الزمنية لا تتداخل، فنكمل الصفحة من الجدول التالي
+    rows: list = []
+    for table in log_tables(db):
+        stmt = _apply_filters(select(table), table, *filters)
+        if last:
+            stmt = stmt.where(tuple_(table.c.timestamp, table.c.id) < tuple(last))
+        stmt = stmt.order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit + 1 - len(rows))
+        rows += db.execute(stmt).all()
+        if len(rows) > limit:
+            break
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        # المؤشر في الـ header حتى يبقى شكل الاستجابة (قائمة) كما هو للعملاء الحاليين
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [LogOut(**r._mapping) for r in rows]
+
+
+def _format_rows(fmt: str, rows: Iterator[dict]) -> Iterator[str]:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+    for row in rows:
+        if fmt == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([row[c] for c in EXPORT_COLUMNS])
+            yield buffer.getvalue()
+        else:
+            yield json.dumps({c: row[c] for c in EXPORT_COLUMNS}, ensure_ascii=False) + "\n"
+
+
+def _export_rows(filters: tuple, user_id: int) -> Iterator[dict]:
+    # جلسة خاصة بالتصدير: جلسة الـ dependency تُغلق قبل أن يبدأ إرسال الـ stream
+    db = read_session(user_id)
+    try:
+        for table in reversed(log_tables(db)):
+            stmt = _apply_filters(select(table), table, *filters).order_by(table.c.timestamp, table.c.id)
+            # yield_per يقرأ عبر server-side cursor فتبقى الذاكرة ثابتة مهما كان عدد الصفوف
+            for row in db.execute(stmt.execution_options(yield_per=1000)):
+                data = dict(row._mapping)
+                data["timestamp"] = data["timestamp"].isoformat()
+                yield data
+    finally:
+        db.close()
+
+
+def _encode_stream(lines: Iterator[str], compress: bool) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending: list[bytes] = []
+    pending_size = 0
+    first = True
+    for line in lines:
+        data = line.encode("utf-8")
+        pending.append(data)
+        pending_size += len(data)
+        # أول دفعة تُرسل فورًا حتى يبدأ التنزيل قبل قراءة كل الصفوف
+        if first or pending_size >= EXPORT_FLUSH_BYTES:
+            block = b"".join(pending)
+            pending, pending_size = [], 0
+            if compressor:
+                block = compressor.compress(block)
+                if first:
+                    block += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+            if block:
+                yield block
+    block = b"".join(pending)
+    if compressor:
+        yield compressor.compress(block) + compressor.flush()
+    elif block:
+        yield block
+
+
+@router.get("/export")
+def export_logs(
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+    user_id: int | None = None,
+    action: str | None = None,
+    target_type: str | None = None,
+    target_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    current: Principal = Depends(require_roles("Admin", "Manager")),
+) -> StreamingResponse:
+    record_audit_now(current.id, "logs_export", "logs", format)
+    filters = (user_id, action, target_type, target_id, _naive_utc(since), _naive_utc(until))
+    filename = f"audit-logs-{datetime.utcnow():%Y%m%d%H%M%S}.{'csv' if format == 'csv' else 'ndjson'}"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        _encode_stream(_format_rows(format, _export_rows(filters, current.id)), compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/archives")
+def get_log_archives(_: Principal = Depends(require_roles("Admin", "Manager"))) -> list[dict]:
+    return list_archives()
+
+
+@router.get("/archives/{month}")
+def read_log_archive(
+    month: str,
+    format: Literal["csv", "ndjson"] = "ndjson",
+    user_id: int | None = None,
+    action: str | None = None,
+    target_type: str | None = None,
+    target_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    _: Principal = Depends(require_roles("Admin", "Manager")),
+) -> StreamingResponse:
+    if not archive_exists(month):
+        raise HTTPException(status_code=404, detail="Archive not found")
+    filters = (user_id, action, target_type, target_id, _naive_utc(since), _naive_utc(until))
+    rows = (row for row in iter_archive(month) if _matches(row, filters))
+    return StreamingResponse(
+        _encode_stream(_format_rows(format, rows), compress=False),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+    )
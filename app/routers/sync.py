@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..deps import Principal, get_current_user
+from ..events import (
+    compact_changes,
+    file_payload,
+    folder_payload,
+    last_change_id,
+    oldest_change_id,
+    settled_change_id,
+    settled_horizon,
+)
+from ..models import ChangeEvent, FileRecord, Folder
+from ..schemas import ChangeSet
+
+router = APIRouter(tags=["sync"])
+
+SYNC_ENTITIES = ("folder", "file")
+
+
+def _snapshot(db: Session) -> ChangeSet:
+    # المؤشر يؤخذ قبل القراءة ومن الأحداث المثبتة فقط: تغيير في transaction لم تُثبت بعد له id أكبر
+    # فيعود في المزامنة التالية، وأي تغيير أثناء بناء اللقطة يتكرر كـ upsert آمن
+    cursor = settled_change_id(db)
+    return ChangeSet(
+        cursor=cursor,
+        has_more=False,
+        snapshot=True,
+        folders=[folder_payload(r) for r in db.query(Folder).order_by(Folder.id)],
+        files=[file_payload(r) for r in db.query(FileRecord).order_by(FileRecord.id)],
+        deleted_folders=[],
+        deleted_files=[],
+    )
+
+
+@router.get("/changes", response_model=ChangeSet)
+def get_changes(
+    since: int = Query(default=0, ge=0),
+    limit: int = Query(default=1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+    _: Principal = Depends(get_current_user),
+) -> ChangeSet:
+    if since == 0:
+        return _snapshot(db)
+
+    oldest = oldest_change_id(db)
+    if oldest is None or since < oldest - 1 or since > last_change_id(db):
+        raise HTTPException(status_code=410, detail="Sync cursor expired, restart with since=0")
+
+    settled = settled_horizon(db)
+    rows = (
+        db.query(ChangeEvent)
+        .filter(
+            ChangeEvent.id > since,
+            ChangeEvent.created_at <= settled,
+            ChangeEvent.entity_type.in_(SYNC_ENTITIES),
+        )
+        .order_by(ChangeEvent.id)
+        .limit(limit)
+        .all()
+    )
+    compacted = compact_changes(rows)
+    folders, deleted_folders = compacted.get("folder", ({}, set()))
+    files, deleted_files = compacted.get("file", ({}, set()))
+    return ChangeSet(
+        cursor=rows[-1].id if rows else since,
+        has_more=len(rows) == limit,
+        snapshot=False,
+        folders=list(folders.values()),
+        files=list(files.values()),
+        deleted_folders=sorted(deleted_folders),
+        deleted_files=sorted(deleted_files),
+    )
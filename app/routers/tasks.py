@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
+from ..audit import record_audit
 from ..database import get_db
-from ..deps import get_current_user
-from ..models import AuditLog, Task, User
+from ..deps import Principal, get_current_user, get_read_db
+from ..events import record_task_change
+from ..models import Task
 from ..schemas import TaskCreate, TaskOut, TaskUpdate
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
@@ -13,7 +15,7 @@ router = APIRouter(prefix="/tasks", tags=["tasks"])
 def create_task(
     payload: TaskCreate,
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> TaskOut:
     task = Task(
         title=payload.title,
@@ -23,7 +25,8 @@ def create_task(
     )
     db.add(task)
     db.flush()
-    db.add(AuditLog(user_id=current.id, action="task_create", target_type="task", target_id=str(task.id)))
+    record_audit(db, current.id, "task_create", "task", str(task.id))
+    record_task_change(db, current.id, "created", task)
     db.commit()
     db.refresh(task)
     return TaskOut(**task.__dict__)
@@ -34,19 +37,20 @@ def update_task(
     task_id: int,
     payload: TaskUpdate,
     db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_user),
 ) -> TaskOut:
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     task.status = payload.status
-    db.add(AuditLog(user_id=current.id, action="task_update", target_type="task", target_id=str(task.id)))
+    record_audit(db, current.id, "task_update", "task", str(task.id))
+    record_task_change(db, current.id, "updated", task)
     db.commit()
     db.refresh(task)
     return TaskOut(**task.__dict__)
 
 
 @router.get("/my", response_model=list[TaskOut])
-def my_tasks(db: Session = Depends(get_db), current: User = Depends(get_current_user)) -> list[TaskOut]:
+def my_tasks(db: Session = Depends(get_read_db), current: Principal = Depends(get_current_user)) -> list[TaskOut]:
     tasks = db.query(Task).filter(Task.assigned_to == current.id).all()
     return [TaskOut(**t.__dict__) for t in tasks]
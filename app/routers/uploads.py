@@ -0,0 +1,219 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import shutil
+import uuid
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database import get_db
+from ..deps import Principal, get_current_user
+from ..models import Folder, UploadSession
+from ..schemas import UploadSessionCreate, UploadSessionOut
+from ..storage import STORAGE_ROOT, ConcatReader, write_stream_atomic
+from .files import assert_can_edit, commit_upload, find_existing_file
+
+SESSIONS_ROOT = STORAGE_ROOT / ".sessions"
+
+router = APIRouter(prefix="/uploads", tags=["uploads"])
+
+
+def _session_dir(session_id: str) -> Path:
+    return SESSIONS_ROOT / session_id
+
+
+def _chunk_path(session_id: str, index: int) -> Path:
+    return _session_dir(session_id) / f"{index:08d}.chunk"
+
+
+def _total_chunks(row: UploadSession) -> int:
+    return max(1, -(-row.total_size // row.chunk_size))
+
+
+def _expected_chunk_size(row: UploadSession, index: int) -> int:
+    return min(row.chunk_size, row.total_size - index * row.chunk_size)
+
+
+def _received_chunks(row: UploadSession) -> list[int]:
+    directory = _session_dir(row.id)
+    if not directory.exists():
+        return []
+    return sorted(int(p.stem) for p in directory.glob("*.chunk"))
+
+
+def _chunk_ranges(received: list[int], total: int) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+    # حجم الرد يتبع عدد الفجوات وليس عدد الأجزاء الكلي
+    have: list[tuple[int, int]] = []
+    for index in received:
+        if have and have[-1][1] == index - 1:
+            have[-1] = (have[-1][0], index)
+        else:
+            have.append((index, index))
+    missing, cursor = [], 0
+    for start, end in have:
+        if start > cursor:
+            missing.append((cursor, start - 1))
+        cursor = end + 1
+    if cursor < total:
+        missing.append((cursor, total - 1))
+    return have, missing
+
+
+def _to_out(row: UploadSession) -> UploadSessionOut:
+    received = _received_chunks(row)
+    received_ranges, missing_ranges = _chunk_ranges(received, _total_chunks(row))
+    return UploadSessionOut(
+        id=row.id,
+        folder_id=row.folder_id,
+        filename=row.filename,
+        total_size=row.total_size,
+        chunk_size=row.chunk_size,
+        total_chunks=_total_chunks(row),
+        received_count=len(received),
+        received_ranges=received_ranges,
+        missing_ranges=missing_ranges,
+        expires_at=row.expires_at,
+    )
+
+
+def _get_own_session(db: Session, session_id: str, current: Principal) -> UploadSession:
+    row = db.query(UploadSession).filter(UploadSession.id == session_id).first()
+    if not row or row.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if row.user_id != current.id:
+        raise HTTPException(status_code=403, detail="Upload session belongs to another user")
+    return row
+
+
+def _discard_session(db: Session, row: UploadSession) -> None:
+    shutil.rmtree(_session_dir(row.id), ignore_errors=True)
+    db.delete(row)
+
+
+def purge_expired_upload_sessions(db: Session) -> int:
+    expired = db.query(UploadSession).filter(UploadSession.expires_at < datetime.utcnow()).all()
+    for row in expired:
+        _discard_session(db, row)
+    db.commit()
+    return len(expired)
+
+
+@router.post("", response_model=UploadSessionOut)
+def create_upload_session(
+    payload: UploadSessionCreate,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> UploadSessionOut:
+    purge_expired_upload_sessions(db)
+
+    folder = db.query(Folder).filter(Folder.id == payload.folder_id).first()
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    if not 0 <= payload.total_size <= settings.upload_session_max_total_size:
+        raise HTTPException(status_code=400, detail=f"total_size must be at most {settings.upload_session_max_total_size}")
+    chunk_size = payload.chunk_size or settings.upload_session_chunk_size
+    if not settings.upload_session_min_chunk_size <= chunk_size <= settings.upload_session_max_chunk_size:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"chunk_size must be between {settings.upload_session_min_chunk_size}"
+                f" and {settings.upload_session_max_chunk_size}"
+            ),
+        )
+    if -(-payload.total_size // chunk_size) > settings.upload_session_max_chunks:
+        raise HTTPException(status_code=400, detail="Too many chunks, use a larger chunk_size")
+
+    existing = find_existing_file(db, payload.folder_id, payload.filename)
+    if existing:
+        assert_can_edit(existing, current)
+
+    row = UploadSession(
+        id=str(uuid.uuid4()),
+        user_id=current.id,
+        folder_id=payload.folder_id,
+        filename=payload.filename,
+        total_size=payload.total_size,
+        chunk_size=chunk_size,
+        expires_at=datetime.utcnow() + timedelta(hours=settings.upload_session_ttl_hours),
+    )
+    db.add(row)
+    db.commit()
+    _session_dir(row.id).mkdir(parents=True, exist_ok=True)
+    return _to_out(row)
+
+
+@router.get("/{session_id}", response_model=UploadSessionOut)
+def get_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> UploadSessionOut:
+    return _to_out(_get_own_session(db, session_id, current))
+
+
+@router.put("/{session_id}/chunks/{index}")
+def put_chunk(
+    session_id: str,
+    index: int,
+    chunk: UploadFile = File(...),
+    sha256: str | None = None,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    row = _get_own_session(db, session_id, current)
+    if index < 0 or index >= _total_chunks(row):
+        raise HTTPException(status_code=400, detail="Chunk index out of range")
+
+    # كل جزء يُكتب في ملفه الخاص بشكل ذري، لذا يمكن رفع الأجزاء بالتوازي وبأي ترتيب
+    chunk.file.seek(0)
+    target = _chunk_path(row.id, index)
+    size, digest = write_stream_atomic(chunk.file, target)
+    if size != _expected_chunk_size(row, index) or (sha256 and sha256.lower() != digest):
+        target.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Chunk size or checksum mismatch")
+
+    row.expires_at = datetime.utcnow() + timedelta(hours=settings.upload_session_ttl_hours)
+    db.commit()
+    return {"index": index, "offset": index * row.chunk_size, "size": size, "sha256": digest}
+
+
+@router.post("/{session_id}/commit")
+def commit_upload_session(
+    session_id: str,
+    sha256: str | None = None,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    row = _get_own_session(db, session_id, current)
+    received = _received_chunks(row)
+    if len(received) != _total_chunks(row) and row.total_size > 0:
+        raise HTTPException(status_code=409, detail="Upload session has missing chunks")
+
+    folder = db.query(Folder).filter(Folder.id == row.folder_id).first()
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    paths = [_chunk_path(row.id, i) for i in received]
+    # التحقق من sha256 يتم أثناء التخزين نفسه فتُقرأ الأجزاء مرة واحدة
+    try:
+        with ConcatReader(paths) as source:
+            result = commit_upload(db, row.folder_id, row.filename, source, current, expected_sha256=sha256)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Checksum mismatch") from exc
+
+    _discard_session(db, row)
+    db.commit()
+    return result
+
+
+@router.delete("/{session_id}")
+def abort_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    row = _get_own_session(db, session_id, current)
+    _discard_session(db, row)
+    db.commit()
+    return {"message": "aborted"}
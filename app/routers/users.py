@@ -1,59 +1,86 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..database import get_db
-from ..deps import require_roles
+from ..deps import Principal, get_read_db, invalidate_principals, require_roles
 from ..models import Role, User
 from ..schemas import UserCreate, UserOut
-from ..security import get_password_hash
+from ..security import hash_password_async
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.get("", response_model=list[UserOut])
 def list_users(
-    db: Session = Depends(get_db),
-    _: User = Depends(require_roles("Admin", "Manager")),
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(require_roles("Admin", "Manager")),
 ) -> list[UserOut]:
     users = db.query(User).join(Role).all()
     return [UserOut(id=u.id, username=u.username, role=u.role.name) for u in users]
 
 
-@router.post("", response_model=UserOut)
-def create_user(
-    payload: UserCreate,
-    db: Session = Depends(get_db),
-    _: User = Depends(require_roles("Admin")),
-) -> UserOut:
-    exists = db.query(User).filter(User.username == payload.username).first()
+def _check_new_user(db: Session, payload: UserCreate) -> int:
+    exists = db.query(User.id).filter(User.username == payload.username).first()
     if exists:
         raise HTTPException(status_code=409, detail="Username already exists")
 
-    role = db.query(Role).filter(Role.name == payload.role).first()
-    if not role:
+    role_id = db.query(Role.id).filter(Role.name == payload.role).scalar()
+    if role_id is None:
         raise HTTPException(status_code=404, detail="Role not found")
+    # نعيد الاتصال للـ pool أثناء التجزئة
+    db.rollback()
+    return role_id
+
 
+def _insert_user(db: Session, payload: UserCreate, role_id: int, password_hash: str) -> UserOut:
     user = User(
         username=payload.username,
-        password_hash=get_password_hash(payload.password),
-        role_id=role.id,
+        password_hash=password_hash,
+        role_id=role_id,
     )
     db.add(user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        # طلبان بنفس الاسم تجاوزا الفحص معًا؛ القيد الفريد يحسم
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Username already exists") from exc
     db.refresh(user)
-    return UserOut(id=user.id, username=user.username, role=role.name)
+    return UserOut(id=user.id, username=user.username, role=payload.role)
+
+
+@router.post("", response_model=UserOut)
+async def create_user(
+    payload: UserCreate,
+    db: Session = Depends(get_db),
+    _: Principal = Depends(require_roles("Admin")),
+) -> UserOut:
+    # الفحص قبل bcrypt: الاسم المكرر يعود 409 دون أن يشغل مجمع التجزئة
+    role_id = await run_in_threadpool(_check_new_user, db, payload)
+    password_hash = await hash_password_async(payload.password)
+    return await run_in_threadpool(_insert_user, db, payload, role_id, password_hash)
 
 
 @router.patch("/{user_id}")
 def update_user_status(
     user_id: int,
-    is_active: bool,
+    is_active: bool | None = None,
+    role: str | None = None,
     db: Session = Depends(get_db),
-    _: User = Depends(require_roles("Admin")),
+    _: Principal = Depends(require_roles("Admin")),
 ) -> dict:
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user.is_active = is_active
+    if is_active is not None:
+        user.is_active = is_active
+    if role is not None:
+        role_row = db.query(Role).filter(Role.name == role).first()
+        if not role_row:
+            raise HTTPException(status_code=404, detail="Role not found")
+        user.role_id = role_row.id
+    invalidate_principals(db)
     db.commit()
     return {"message": "updated"}
@@ -0,0 +1,120 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..audit import record_audit_now
+from ..config import settings
+from ..database import get_db
+from ..deps import Principal, get_async_read_db, get_current_user, get_current_user_async, get_read_db
+from ..http_ranges import content_disposition, file_download_response
+from ..models import FileRecord, FileVersion
+from ..schemas import FileVersionOut
+from ..storage import blob_path, open_blob, reference_blob
+from .files import assert_can_edit, expected_versions, save_new_version
+
+router = APIRouter(prefix="/files/{file_id}/versions", tags=["versions"])
+
+
+def _get_file(db: Session, file_id: int) -> FileRecord:
+    record = db.query(FileRecord).filter(FileRecord.id == file_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    return record
+
+
+def _get_version(db: Session, file_id: int, version: int) -> FileVersion:
+    row = db.query(FileVersion).filter(FileVersion.file_id == file_id, FileVersion.version == version).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return row
+
+
+def _iter_blob(sha256: str):
+    with open_blob(sha256) as source:
+        while chunk := source.read(settings.upload_chunk_size):
+            yield chunk
+
+
+@router.get("", response_model=list[FileVersionOut])
+def list_versions(
+    file_id: int,
+    db: Session = Depends(get_read_db),
+    _: Principal = Depends(get_current_user),
+) -> list[FileVersionOut]:
+    record = _get_file(db, file_id)
+    history = (
+        db.query(FileVersion)
+        .filter(FileVersion.file_id == file_id)
+        .order_by(FileVersion.version.desc())
+        .all()
+    )
+    current = FileVersionOut(
+        version=record.version,
+        size=record.size,
+        sha256=record.sha256,
+        saved_by=record.updated_by or record.created_by,
+        created_at=record.updated_at,
+        is_current=True,
+    )
+    return [current] + [
+        FileVersionOut(
+            version=r.version,
+            size=r.size,
+            sha256=r.sha256,
+            saved_by=r.saved_by,
+            created_at=r.created_at,
+            is_current=False,
+        )
+        for r in history
+    ]
+
+
+@router.get("/{version}/download")
+async def download_version(
+    file_id: int,
+    version: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    current: Principal = Depends(get_current_user_async),
+) -> Response:
+    record = await db.get(FileRecord, file_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="File not found")
+    row = await db.scalar(select(FileVersion).where(FileVersion.file_id == file_id, FileVersion.version == version))
+    if not row:
+        raise HTTPException(status_code=404, detail="Version not found")
+    await run_in_threadpool(record_audit_now, current.id, "download_version", "file", f"{file_id}@{version}")
+
+    etag = f'"v{row.version}-{row.sha256[:16]}"'
+    path = blob_path(row.sha256)
+    if path.exists():
+        return file_download_response(request, path, record.original_name, etag, row.created_at)
+    # الإصدارات القديمة المضغوطة تُبث بعد فك الضغط بدون دعم Range
+    return StreamingResponse(
+        _iter_blob(row.sha256),
+        media_type="application/octet-stream",
+        headers={"ETag": etag, "Content-Disposition": content_disposition(record.original_name)},
+    )
+
+
+@router.post("/{version}/restore")
+def restore_version(
+    file_id: int,
+    version: int,
+    expected_version: int | None = None,
+    if_match: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_user),
+) -> dict:
+    # الاستعادة تنشئ إصدارًا جديدًا بمحتوى الإصدار القديم، فلا يضيع الإصدار الحالي
+    expected = expected_versions(if_match, expected_version)
+    record = _get_file(db, file_id)
+    assert_can_edit(record, current)
+    row = _get_version(db, file_id, version)
+    blob = reference_blob(db, row.sha256, row.size)
+    if not blob:
+        raise HTTPException(status_code=410, detail="Version content is no longer available")
+    return save_new_version(db, record, blob, current, expected, action="restore_version")
@@ -41,6 +41,146 @@ class FolderOut(BaseModel):
     parent_id: int | None
 
 
+class FolderNode(BaseModel):
+    id: int
+    name: str
+    parent_id: int | None
+    depth: int
+    path: str
+    has_children: bool
+
+
+class FolderStats(BaseModel):
+    folder_id: int
+    folder_count: int
+    file_count: int
+    total_bytes: int
+
+
+class FileOut(BaseModel):
+    id: int
+    folder_id: int
+    name: str
+    size: int
+    sha256: str | None
+    version: int
+    created_by: int
+    updated_at: datetime
+    is_locked: bool
+    locked_by: int | None
+    lock_expires_at: datetime | None = None
+
+
+class FilePage(BaseModel):
+    items: list[FileOut]
+    next_cursor: str | None
+
+
+class SyncFolder(BaseModel):
+    id: int
+    name: str
+    parent_id: int | None
+    path: str | None
+
+
+class SyncFile(BaseModel):
+    id: int
+    folder_id: int
+    name: str
+    version: int
+    size: int
+    sha256: str | None
+    is_locked: bool
+    locked_by: int | None
+    lock_expires_at: datetime | None = None
+
+
+class ChangeSet(BaseModel):
+    cursor: int
+    has_more: bool
+    snapshot: bool
+    folders: list[SyncFolder]
+    files: list[SyncFile]
+    deleted_folders: list[int]
+    deleted_files: list[int]
+
+
+class FileVersionOut(BaseModel):
+    version: int
+    size: int
+    sha256: str | None
+    saved_by: int | None
+    created_at: datetime
+    is_current: bool
+
+
+class ZipRequest(BaseModel):
+    file_ids: list[int]
+    filename: str = "files.zip"
+
+
+class BulkFiles(BaseModel):
+    file_ids: list[int]
+
+
+class BulkMove(BulkFiles):
+    target_folder_id: int
+
+
+class BulkLock(BulkFiles):
+    ttl_sec: int | None = None
+
+
+class BulkItemResult(BaseModel):
+    id: int
+    status: str
+    detail: str | None = None
+
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: list[BulkItemResult]
+
+
+class LockOut(BaseModel):
+    file_id: int
+    name: str
+    folder_id: int
+    expires_at: datetime | None
+
+
+class ContentReference(BaseModel):
+    sha256: str
+    size: int
+
+
+class UploadByReference(ContentReference):
+    folder_id: int
+    filename: str
+
+
+class UploadSessionCreate(BaseModel):
+    folder_id: int
+    filename: str
+    total_size: int
+    chunk_size: int | None = None
+
+
+class UploadSessionOut(BaseModel):
+    id: str
+    folder_id: int
+    filename: str
+    total_size: int
+    chunk_size: int
+    total_chunks: int
+    received_count: int
+    # نطاقات [start, end] شاملة للطرفين بدل قائمة بكل رقم جزء
+    received_ranges: list[tuple[int, int]]
+    missing_ranges: list[tuple[int, int]]
+    expires_at: datetime
+
+
 class TaskCreate(BaseModel):
     title: str
     description: str = ""
@@ -1,10 +1,23 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
+import asyncio
+import multiprocessing
+import threading
+
+from fastapi import HTTPException
 from jose import jwt
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 
 from .config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min_rounds = rounds: أي hash بتكلفة أقل من الإعداد الحالي يُعاد حسابه عند تسجيل الدخول التالي
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -15,6 +28,64 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordPool:
+    # bcrypt يستهلك المعالج بالكامل؛ تشغيله في عمليات منفصلة يبقي threadpool الخادم حرًا لباقي الطلبات.
+    # عدد العمليات المعلقة محدود، وما زاد عنه يُرفض بـ 503 بدل أن يتراكم في الطابور
+    def __init__(self, workers: int, max_pending: int):
+        self._workers = workers
+        self._max_pending = max_pending
+        self._pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._pending >= self._max_pending:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many logins in progress, retry shortly",
+                    headers={"Retry-After": str(settings.password_retry_after_sec)},
+                )
+            self._pending += 1
+            if self._workers > 0 and self._executor is None:
+                # spawn بدل fork: الخادم فيه خيوط (audit writer, epoch watcher) لا تُنسخ بأمان مع fork
+                self._executor = ProcessPoolExecutor(self._workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        self._acquire()
+        try:
+            if self._executor is None:
+                return await run_in_threadpool(fn, *args)
+            return await asyncio.wrap_future(self._executor.submit(fn, *args))
+        finally:
+            self._release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordPool(settings.password_workers, settings.password_max_pending)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await password_pool.run(verify_and_update_password, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(get_password_hash, password)
+
+
 def create_token(subject: str, token_type: str = "access") -> str:
     now = datetime.now(timezone.utc)
     exp = now + (
@@ -0,0 +1,301 @@
+from collections import Counter
+from hashlib import sha256
+from pathlib import Path
+from typing import BinaryIO
+import gzip
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Blob
+
+STORAGE_ROOT = Path(settings.storage_root)
+STORAGE_ROOT.mkdir(parents=True, exist_ok=True)
+BLOBS_ROOT = STORAGE_ROOT / "blobs"
+# الملفات المؤقتة الأقدم من هذا تعود لرفع أو ضغط انقطع
+STALE_TEMP_SECONDS = 24 * 3600
+
+
+def _fsync_dir(directory: Path) -> None:
+    # على ويندوز لا يمكن فتح المجلد كملف، والـ rename هناك ذري بما يكفي
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_stream_to_temp(source: BinaryIO, directory: Path) -> tuple[Path, int, str]:
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(settings.upload_chunk_size):
+                out.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return Path(tmp_name), size, digest.hexdigest()
+
+
+def write_stream_atomic(source: BinaryIO, target_path: str | Path) -> tuple[int, str]:
+    # الكتابة على ملف مؤقت بجانب الهدف ثم rename ذري، فلا يرى القارئ ملفًا نصف مكتوب
+    path = Path(target_path)
+    tmp_path, size, digest = _write_stream_to_temp(source, path.parent)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+    return size, digest
+
+
+def hash_stream(source: BinaryIO) -> tuple[int, str]:
+    digest = sha256()
+    size = 0
+    while chunk := source.read(settings.upload_chunk_size):
+        digest.update(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+
+class ConcatReader:
+    # يقرأ عدة ملفات متتالية كأنها ملف واحد (لتجميع أجزاء الرفع دون نسخها في الذاكرة)
+    def __init__(self, paths: list[Path]):
+        self._all_paths = list(paths)
+        self._paths = list(paths)
+        self._current: BinaryIO | None = None
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("ConcatReader only supports rewinding to the start")
+        self.close()
+        self._paths = list(self._all_paths)
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        while True:
+            if self._current is None:
+                if not self._paths:
+                    return b""
+                self._current = open(self._paths.pop(0), "rb")
+            data = self._current.read(size)
+            if data:
+                return data
+            self._current.close()
+            self._current = None
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+    def __enter__(self) -> "ConcatReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def blob_path(digest: str) -> Path:
+    # توزيع على مستويين (ab/cd/abcd...) حتى لا يتضخم مجلد واحد بملايين الملفات
+    return BLOBS_ROOT / digest[:2] / digest[2:4] / digest
+
+
+def packed_blob_path(digest: str) -> Path:
+    return blob_path(digest).with_name(f"{digest}.gz")
+
+
+def blob_exists(digest: str) -> bool:
+    return blob_path(digest).exists() or packed_blob_path(digest).exists()
+
+
+def materialize_blob(digest: str) -> Path:
+    # نسخ التاريخ القديمة قد تكون مضغوطة؛ تُفك عند أول استخدام كمحتوى حالي (استعادة أو رفع مطابق)
+    path = blob_path(digest)
+    packed = packed_blob_path(digest)
+    if not path.exists() and packed.exists():
+        with gzip.open(packed, "rb") as source:
+            write_stream_atomic(source, path)
+    return path
+
+
+def open_blob(digest: str) -> BinaryIO:
+    path = blob_path(digest)
+    if path.exists():
+        return open(path, "rb")
+    return gzip.open(packed_blob_path(digest), "rb")
+
+
+def compress_blob(digest: str) -> bool:
+    path = blob_path(digest)
+    packed = packed_blob_path(digest)
+    if not path.exists():
+        return False
+    fd, tmp_name = tempfile.mkstemp(prefix=".pack-", suffix=".part", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as out, open(path, "rb") as src:
+            shutil.copyfileobj(src, out, settings.upload_chunk_size)
+        # المحتوى المضغوط أصلًا (zip, jpg, ...) لا يستحق؛ نبقي النسخة الأصلية
+        if Path(tmp_name).stat().st_size >= path.stat().st_size:
+            Path(tmp_name).unlink()
+            return False
+        os.replace(tmp_name, packed)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+    path.unlink()
+    return True
+
+
+def _acquire_blob(db: Session, digest: str, size: int) -> Blob:
+    # upsert يحجز صف الـ blob حتى نهاية الـ transaction؛ GC يحذف تحت نفس القفل، فبعد هذا السطر
+    # لا يختفي الملف، وإن كان قد حُذف قبله يكتشفه المستدعي (_stored) ويعيد كتابته
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(Blob).values(sha256=digest, size=size, ref_count=1)
+    db.execute(stmt.on_conflict_do_update(index_elements=[Blob.sha256], set_={"ref_count": Blob.ref_count + 1}))
+    blob = db.get(Blob, digest)
+    db.refresh(blob)
+    return blob
+
+
+def _stored(digest: str) -> bool:
+    if not blob_exists(digest):
+        return False
+    materialize_blob(digest)
+    return True
+
+
+def _place_blob(tmp_path: Path, digest: str) -> None:
+    target = blob_path(digest)
+    if target.exists():
+        tmp_path.unlink()
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, target)
+    _fsync_dir(target.parent)
+
+
+def ingest_blob(db: Session, source: BinaryIO, expected_sha256: str | None = None) -> Blob:
+    # إذا كان المحتوى موجودًا مسبقًا نكتفي بزيادة العداد دون أي كتابة على القرص.
+    # مع digest متوقع غير موجود في المخزن لا داعي للتمرير الأول: الكتابة تحسب الـ hash وتتحقق منه
+    expected_new = bool(expected_sha256) and not blob_exists(expected_sha256.lower())
+    blob = None
+    if source.seekable() and not expected_new:
+        source.seek(0)
+        size, digest = hash_stream(source)
+        if expected_sha256 and digest != expected_sha256.lower():
+            raise ValueError("content checksum mismatch")
+        if blob_exists(digest):
+            blob = _acquire_blob(db, digest, size)
+            if _stored(digest):
+                return blob
+        source.seek(0)
+
+    tmp_path, size, digest = _write_stream_to_temp(source, BLOBS_ROOT / ".tmp")
+    try:
+        if expected_sha256 and digest != expected_sha256.lower():
+            raise ValueError("content checksum mismatch")
+        if blob is None:
+            blob = _acquire_blob(db, digest, size)
+        _place_blob(tmp_path, digest)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return blob
+
+
+def has_blob(db: Session, digest: str, size: int) -> bool:
+    blob = db.get(Blob, digest)
+    return bool(blob and blob.size == size and blob_exists(digest))
+
+
+def reference_blob(db: Session, digest: str, size: int) -> Blob | None:
+    # بعد حجز الصف نتحقق من الملف مجددًا: GC متزامن ربما حذفه؛ المستدعي يرفض الطلب فيُلغى الحجز مع الـ rollback
+    if not has_blob(db, digest, size):
+        return None
+    blob = _acquire_blob(db, digest, size)
+    return blob if _stored(digest) else None
+
+
+def release_blob(db: Session, digest: str | None) -> None:
+    if digest:
+        db.execute(update(Blob).where(Blob.sha256 == digest).values(ref_count=Blob.ref_count - 1))
+
+
+def release_blobs(db: Session, digests: list[str]) -> None:
+    # تحرير دفعة مراجع بجملة UPDATE واحدة (executemany) مع تجميع التكرارات لكل blob
+    counts = Counter(d for d in digests if d)
+    if counts:
+        blobs = Blob.__table__
+        db.execute(
+            update(blobs)
+            .where(blobs.c.sha256 == bindparam("b_sha256"))
+            .values(ref_count=blobs.c.ref_count - bindparam("b_count")),
+            [{"b_sha256": digest, "b_count": count} for digest, count in counts.items()],
+        )
+
+
+def collect_blob_garbage(db: Session) -> int:
+    # الحذف المشروط يحجز صفوف الـ blobs حتى الـ commit، و_acquire_blob يمر بنفس الصف قبل أن يقرر وجود الملف.
+    # لذلك تُحذف الملفات قبل الـ commit: أي رفع ينتظر الصف يجده بلا ملف فيكتبه من جديد
+    blobs = Blob.__table__
+    digests = db.scalars(delete(blobs).where(blobs.c.ref_count <= 0).returning(blobs.c.sha256)).all()
+    for digest in digests:
+        blob_path(digest).unlink(missing_ok=True)
+        packed_blob_path(digest).unlink(missing_ok=True)
+    db.commit()
+    return len(digests)
+
+
+def sweep_orphan_blobs(db: Session) -> int:
+    # رفع يكتب الملف ثم يفشل (412 أو rollback) يترك ملفًا بلا صف، وGC أعلاه لا يرى إلا الصفوف.
+    # نحجز الـ digest بصف مؤقت (ref_count=0) قبل حذف الملف: رفع جارٍ بنفس المحتوى يحمل قفل الصف
+    # فننتظره، وإن نجح يفشل الحجز ونترك الملف
+    blobs = Blob.__table__
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    cutoff = time.time() - STALE_TEMP_SECONDS
+    removed = 0
+    if not BLOBS_ROOT.exists():
+        return 0
+    for path in BLOBS_ROOT.glob("*/*/*"):
+        if path.name.endswith(".part"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+            continue
+        digest = path.name.removesuffix(".gz")
+        if db.scalar(select(blobs.c.sha256).where(blobs.c.sha256 == digest)):
+            continue
+        stmt = insert(blobs).values(sha256=digest, size=0, ref_count=0).on_conflict_do_nothing()
+        if db.execute(stmt.returning(blobs.c.sha256)).first() is None:
+            db.rollback()
+            continue
+        blob_path(digest).unlink(missing_ok=True)
+        packed_blob_path(digest).unlink(missing_ok=True)
+        db.execute(delete(blobs).where(blobs.c.sha256 == digest))
+        db.commit()
+        removed += 1
+    for path in (BLOBS_ROOT / ".tmp").glob("*"):
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+    return removed
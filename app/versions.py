@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import json
+
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .models import FileRecord, FileVersion
+from .storage import collect_blob_garbage, compress_blob, ingest_blob, release_blob, release_blobs, sweep_orphan_blobs
+
+
+def snapshot_version(record: FileRecord) -> FileVersion:
+    return FileVersion(
+        file_id=record.id,
+        version=record.version,
+        sha256=record.sha256,
+        size=record.size,
+        saved_by=record.updated_by or record.created_by,
+        created_at=record.updated_at,
+    )
+
+
+def archive_version(db: Session, snapshot: FileVersion, stored_name: str) -> None:
+    # مرجع الـ blob الذي كان حاليًا ينتقل إلى سجل التاريخ بدل تحريره
+    if not snapshot.sha256:
+        legacy = Path(stored_name)
+        if len(legacy.parts) <= 1 or not legacy.exists():
+            return
+        with open(legacy, "rb") as source:
+            snapshot.sha256 = ingest_blob(db, source).sha256
+        legacy.unlink()
+    db.add(snapshot)
+
+
+def _versions_to_drop(rows: list[FileVersion], now: datetime) -> list[FileVersion]:
+    # آخر N إصدارات تبقى دائمًا، ثم أحدث إصدار لكل يوم، ثم لكل أسبوع، وما بعد ذلك يُحذف
+    daily_since = now - timedelta(days=settings.version_keep_daily_days)
+    weekly_since = now - timedelta(weeks=settings.version_keep_weekly_weeks)
+    seen_buckets = set()
+    dropped = []
+    for index, row in enumerate(sorted(rows, key=lambda r: r.version, reverse=True)):
+        if index < settings.version_keep_last:
+            continue
+        if row.created_at >= daily_since:
+            bucket = ("day", row.created_at.date())
+        elif row.created_at >= weekly_since:
+            bucket = ("week", tuple(row.created_at.isocalendar())[:2])
+        else:
+            bucket = None
+        if bucket is None or bucket in seen_buckets:
+            dropped.append(row)
+        else:
+            seen_buckets.add(bucket)
+    return dropped
+
+
+def apply_version_retention(db: Session, file_id: int, now: datetime | None = None) -> int:
+    db.flush()
+    rows = db.query(FileVersion).filter(FileVersion.file_id == file_id).all()
+    dropped = _versions_to_drop(rows, now or datetime.utcnow())
+    for row in dropped:
+        release_blob(db, row.sha256)
+        db.delete(row)
+    return len(dropped)
+
+
+def delete_version_history(db: Session, file_ids: list[int]) -> None:
+    history = FileVersion.file_id.in_(file_ids)
+    release_blobs(db, [digest for (digest,) in db.query(FileVersion.sha256).filter(history)])
+    db.query(FileVersion).filter(history).delete(synchronize_session=False)
+
+
+def compress_old_versions(db: Session, older_than_days: int | None = None) -> int:
+    # يضغط blobs لا يشير إليها إلا التاريخ؛ أي استخدام لها كمحتوى حالي يفك ضغطها تلقائيًا
+    days = settings.version_compress_after_days if older_than_days is None else older_than_days
+    if days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    digests = (
+        db.query(FileVersion.sha256)
+        .filter(
+            FileVersion.created_at < cutoff,
+            ~exists().where(FileRecord.sha256 == FileVersion.sha256),
+        )
+        .distinct()
+        .all()
+    )
+    return sum(compress_blob(digest) for (digest,) in digests)
+
+
+def run_version_maintenance() -> dict:
+    db = SessionLocal()
+    try:
+        # الـ blobs التي حررها الحذف وتقليم الإصدارات تُجمع هنا دوريًا وليس فقط عند إعادة تشغيل السيرفر
+        return {
+            "compressed": compress_old_versions(db),
+            "collected_blobs": collect_blob_garbage(db),
+            "orphan_blobs": sweep_orphan_blobs(db),
+        }
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # للتشغيل الدوري مع صيانة السجلات: python -m app.versions
+    print(json.dumps(run_version_maintenance()))
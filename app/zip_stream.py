@@ -0,0 +1,71 @@
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+import io
+import zipfile
+
+from .config import settings
+
+# صيغ مضغوطة أصلًا: تُخزن كما هي لأن إعادة ضغطها تستهلك المعالج بلا فائدة
+STORED_EXTENSIONS = {
+    ".7z", ".aac", ".avi", ".bz2", ".docx", ".gif", ".gz", ".heic", ".jpeg", ".jpg", ".m4a", ".mkv",
+    ".mov", ".mp3", ".mp4", ".odp", ".ods", ".odt", ".ogg", ".png", ".pptx", ".rar", ".tgz", ".webm",
+    ".webp", ".xlsx", ".xz", ".zip", ".zst",
+}
+
+
+class _ZipSink(io.RawIOBase):
+    # ملف غير قابل للـ seek: zipfile يكتب حينها data descriptors بعد كل ملف ولا يرجع للخلف
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def safe_member_name(*parts: str) -> str:
+    cleaned = [p.replace("\\", "_").replace("/", "_").strip() for p in parts]
+    cleaned = [p for p in cleaned if p and p not in (".", "..")]
+    return str(PurePosixPath(*cleaned)) if cleaned else "unnamed"
+
+
+def unique_member_names(names: list[str]) -> list[str]:
+    seen: set[str] = set()
+    result = []
+    for name in names:
+        candidate, counter = name, 1
+        while candidate in seen:
+            counter += 1
+            path = PurePosixPath(name)
+            candidate = str(path.with_name(f"{path.stem} ({counter}){path.suffix}"))
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def iter_zip(entries: list[tuple[str, Path, datetime]]) -> Iterator[bytes]:
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for name, path, modified in entries:
+            info = zipfile.ZipInfo(name, date_time=max(modified, datetime(1980, 1, 1)).timetuple()[:6])
+            info.compress_type = (
+                zipfile.ZIP_STORED if Path(name).suffix.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            )
+            info.file_size = path.stat().st_size
+            with open(path, "rb") as source, archive.open(info, mode="w") as member:
+                while chunk := source.read(settings.upload_chunk_size):
+                    member.write(chunk)
+                    if data := sink.drain():
+                        yield data
+            if data := sink.drain():
+                yield data
+    yield sink.drain()
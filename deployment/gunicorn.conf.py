@@ -0,0 +1,82 @@
+# gunicorn -c deployment/gunicorn.conf.py app.main:app
+import os
+import subprocess
+import sys
+
+
+# أقل pool متزامن مفيد لكل worker: الرفع والحفظ يحجزان اتصالًا طوال الكتابة على القرص،
+# وخيط كتابة السجلات والتحقق من المستخدمين يسحبان من نفس الـ pool
+MIN_SYNC_POOL = 6
+
+
+def _uses_sqlite() -> bool:
+    return os.getenv("DATABASE_URL", "sqlite").startswith("sqlite")
+
+
+def _uses_pgbouncer() -> bool:
+    return os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+
+def _budget() -> int:
+    return int(os.getenv("DB_MAX_CONNECTIONS", "90"))
+
+
+def async_connections() -> int:
+    # engine الـ async يُنشأ عند أول تنزيل أو بث أحداث، وله pool صغير خاص (DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW)
+    return int(os.getenv("DB_ASYNC_POOL_SIZE", "2")) + int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "2"))
+
+
+def recommended_workers(cores: int | None = None) -> int:
+    # كل worker من uvicorn async وله threadpool خاص، وbcrypt يعمل في عمليات منفصلة؛ worker لكل نواة يكفي.
+    # SQLite لا يحتمل الكتابة من عدة عمليات، فيبقى worker واحد. بدون PgBouncer لا يزيد العدد عما يسمح
+    # به DB_MAX_CONNECTIONS مع pool مفيد لكل worker
+    if _uses_sqlite():
+        return 1
+    cores = max(1, cores or os.cpu_count() or 1)
+    if _uses_pgbouncer():
+        return cores
+    return max(1, min(cores, _budget() // (MIN_SYNC_POOL + async_connections())))
+
+
+def pool_budget(workers: int) -> tuple[int, int] | None:
+    # حصة كل worker من DB_MAX_CONNECTIONS (أقل من max_connections في Postgres، 100 افتراضيًا) ناقص pool الـ async
+    # هي سقف الـ pool المتزامن؛ يُصغَّر DB_POOL_SIZE/DB_MAX_OVERFLOW بنفس النسبة إن تجاوزاه.
+    # كل replica تستقبل نفس الـ pools من كل worker، فيلزم أن يسمح max_connections فيها بنفس الميزانية
+    if _uses_sqlite() or _uses_pgbouncer():
+        return None
+    size = int(os.getenv("DB_POOL_SIZE", "10"))
+    overflow = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    share = _budget() // workers - async_connections()
+    if share < MIN_SYNC_POOL:
+        raise RuntimeError(
+            f"DB_MAX_CONNECTIONS={_budget()} leaves fewer than {MIN_SYNC_POOL} connections per worker for "
+            f"{workers} workers; lower WEB_CONCURRENCY or set DB_PGBOUNCER=true"
+        )
+    if size + overflow <= share:
+        return size, overflow
+    scaled = max(MIN_SYNC_POOL // 2, share * size // (size + overflow))
+    return scaled, share - scaled
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY") or recommended_workers())
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = 30
+keepalive = 5
+
+# الـ workers ترث البيئة من الـ master، فيقرأ كل منها حصته من الاتصالات عند تحميل app.config
+_pool = pool_budget(workers)
+if _pool:
+    os.environ["DB_POOL_SIZE"], os.environ["DB_MAX_OVERFLOW"] = (str(value) for value in _pool)
+
+
+def on_starting(server):
+    if _pool:
+        server.log.info(
+            "%s workers, per-worker DB pool: sync %s+%s, async %s (DB_MAX_CONNECTIONS=%s)",
+            workers, _pool[0], _pool[1], async_connections(), _budget(),
+        )
+    # التهيئة (create_all، البذور، تنظيف الـ blobs) مرة واحدة في عملية منفصلة قبل أي worker،
+    # حتى لا تُحمَّل اتصالات قاعدة البيانات في الـ master ثم تُورث للـ workers عبر fork
+    subprocess.run([sys.executable, "-m", "app.main"], check=True)
+    os.environ["STARTUP_MAINTENANCE"] = "false"
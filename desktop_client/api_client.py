@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import Iterator
 from dataclasses import dataclass
 import json
 from typing import Any
@@ -30,11 +31,16 @@ class ApiClient:
         self.base_url = base_url.rstrip("/")
         self.access_token: str | None = None
         self.refresh_token: str | None = None
+        # طابع آخر كتابة من الخادم؛ يُعاد معه حتى تُقرأ تعديلاتنا من الـ primary وليس من replica متأخرة
+        self.write_token: str | None = None
+        self._event_stream: requests.Response | None = None
 
     def _headers(self) -> dict[str, str]:
         headers = {"Accept": "application/json"}
         if self.access_token:
             headers["Authorization"] = f"Bearer {self.access_token}"
+        if self.write_token:
+            headers["X-Write-Token"] = self.write_token
         return headers
 
     def _request(self, method: str, endpoint: str, **kwargs: Any) -> Any:
@@ -56,6 +62,9 @@ class ApiClient:
         except requests.exceptions.RequestException as exc:
             raise ApiError(message="خطأ غير متوقع أثناء الاتصال", endpoint=endpoint, details=str(exc)) from exc
 
+        if response.headers.get("X-Write-Token"):
+            self.write_token = response.headers["X-Write-Token"]
+
         if response.status_code >= 400:
             details = None
             try:
@@ -85,6 +94,15 @@ class ApiClient:
         self.refresh_token = data.get("refresh_token")
         return data
 
+    def refresh(self) -> dict[str, Any]:
+        # توكن الوصول قصير العمر؛ refresh_token يجدده بدون إعادة إدخال كلمة المرور
+        if not self.refresh_token:
+            raise ApiError(message="انتهت الجلسة، يرجى تسجيل الدخول مجددًا", status_code=401, endpoint="/refresh")
+        data = self._request("POST", "/refresh", json={"refresh_token": self.refresh_token})
+        self.access_token = data.get("access_token")
+        self.refresh_token = data.get("refresh_token") or self.refresh_token
+        return data
+
     def activate_device(self, device_id: str, customer_name: str, master_key: str) -> dict[str, Any]:
         return self._request(
             "POST",
@@ -96,5 +114,63 @@ class ApiClient:
     def get_folders(self) -> list[dict[str, Any]]:
         return self._request("GET", "/folders", headers=self._headers())
 
+    def get_folder_children(self, parent_id: int | None = None) -> list[dict[str, Any]]:
+        params = {"parent_id": parent_id} if parent_id is not None else {}
+        return self._request("GET", "/folders/tree", headers=self._headers(), params=params)
+
+    def list_folder_files(
+        self,
+        folder_id: int,
+        cursor: str | None = None,
+        sort: str = "name",
+        order: str = "asc",
+        limit: int = 200,
+    ) -> dict[str, Any]:
+        params: dict[str, Any] = {"sort": sort, "order": order, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        return self._request("GET", f"/folders/{folder_id}/files", headers=self._headers(), params=params)
+
     def my_tasks(self) -> list[dict[str, Any]]:
         return self._request("GET", "/tasks/my", headers=self._headers())
+
+    def list_events(self, after: int = 0, limit: int = 100) -> dict[str, Any]:
+        return self._request("GET", "/events", headers=self._headers(), params={"after": after, "limit": limit})
+
+    def iter_events(self, last_event_id: int | None = None) -> Iterator[dict[str, Any]]:
+        # يقرأ بث SSE ويعيد كل حدث كـ dict؛ ينتهي عندما يغلق الخادم البث فيعيد المستدعي الاتصال بآخر id
+        headers = self._headers() | {"Accept": "text/event-stream"}
+        if last_event_id is not None:
+            headers["Last-Event-ID"] = str(last_event_id)
+        try:
+            response = requests.get(f"{self.base_url}/events/stream", headers=headers, stream=True, timeout=(12, 60))
+        except requests.exceptions.RequestException as exc:
+            raise ApiError(message="تعذر فتح بث التحديثات", endpoint="/events/stream", details=str(exc)) from exc
+        if response.status_code >= 400:
+            raise ApiError(
+                message="فشل الطلب من الخادم",
+                status_code=response.status_code,
+                endpoint="/events/stream",
+                details=response.text[:300],
+            )
+        self._event_stream = response
+        with response:
+            data_lines: list[str] = []
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].strip())
+                    continue
+                if data_lines:
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+
+    def close_event_stream(self) -> None:
+        # يُستدعى من خيط الواجهة: إغلاق الاتصال يفك القراءة المعلقة في خيط البث فورًا
+        stream, self._event_stream = self._event_stream, None
+        if stream is not None:
+            stream.close()
+
+    def get_changes(self, since: int = 0, limit: int = 1000) -> dict[str, Any]:
+        # since=0 يعيد لقطة كاملة؛ بعدها يكفي تمرير cursor المستلم لجلب الفروقات فقط (410 يعني إعادة المزامنة)
+        return self._request("GET", "/changes", headers=self._headers(), params={"since": since, "limit": limit})
@@ -1,8 +1,9 @@
 import logging
 import sys
+import time
 from pathlib import Path
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import QThread, QTimer, Qt, pyqtSignal
 from PyQt6.QtGui import QFont, QFontDatabase
 from PyQt6.QtWidgets import (
     QApplication,
@@ -136,6 +137,61 @@ class LoginWindow(QWidget):
             self.login_btn.setEnabled(True)
 
 
+class ChangeFeedWorker(QThread):
+    # يستمع لبث التحديثات من الخادم ويعيد الاتصال تلقائيًا من آخر حدث مستلم
+    changed = pyqtSignal(dict)
+    # 401 ولم ينجح تجديد التوكن: لا فائدة من إعادة الاتصال حتى يسجل المستخدم دخوله مجددًا
+    session_expired = pyqtSignal()
+
+    def __init__(self, api: ApiClient):
+        super().__init__()
+        self.api = api
+        self.last_event_id: int | None = None
+
+    def stop(self, timeout_ms: int = 5000) -> bool:
+        self.requestInterruption()
+        self.api.close_event_stream()
+        return self.wait(timeout_ms)
+
+    def _pause(self, seconds: float) -> None:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self.isInterruptionRequested():
+            self.msleep(100)
+
+    def run(self):
+        refreshed = False
+        while not self.isInterruptionRequested():
+            try:
+                for event in self.api.iter_events(self.last_event_id):
+                    refreshed = False
+                    self.last_event_id = event["id"]
+                    self.changed.emit(event)
+                    if self.isInterruptionRequested():
+                        return
+            except ApiError as exc:
+                if self.isInterruptionRequested():
+                    return
+                if exc.status_code == 401:
+                    if refreshed:
+                        self.session_expired.emit()
+                        return
+                    try:
+                        self.api.refresh()
+                        refreshed = True
+                        continue
+                    except ApiError:
+                        logging.exception("Token refresh failed")
+                        self.session_expired.emit()
+                        return
+                logging.exception("Change feed disconnected")
+                self._pause(3)
+            except Exception:
+                if self.isInterruptionRequested():
+                    return
+                logging.exception("Change feed disconnected")
+                self._pause(3)
+
+
 class DashboardWindow(QMainWindow):
     def __init__(self, api: ApiClient):
         super().__init__()
@@ -153,6 +209,38 @@ class DashboardWindow(QMainWindow):
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+        # تجميع الأحداث المتتالية في تحديث واحد بدل إعادة التحميل مع كل حدث
+        self._folders_refresh = self._debounced(self.load_folders)
+        self._tasks_refresh = self._debounced(self.load_tasks)
+        self.change_feed = ChangeFeedWorker(api)
+        self.change_feed.changed.connect(self.on_change)
+        self.change_feed.session_expired.connect(self.on_session_expired)
+
+    def _debounced(self, callback) -> QTimer:
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.setInterval(300)
+        timer.timeout.connect(callback)
+        return timer
+
+    def start_change_feed(self):
+        if not self.change_feed.isRunning():
+            self.change_feed.start()
+
+    def on_change(self, event: dict):
+        if event.get("entity_type") == "task":
+            self._tasks_refresh.start()
+        elif event.get("entity_type") == "folder":
+            self._folders_refresh.start()
+
+    def on_session_expired(self):
+        QMessageBox.warning(self, "انتهت الجلسة", "انتهت صلاحية الجلسة، أعد تشغيل التطبيق وسجل الدخول مجددًا")
+
+    def closeEvent(self, event):
+        if not self.change_feed.stop():
+            logging.warning("Change feed thread did not stop in time")
+        super().closeEvent(event)
+
     def _build_folders_tab(self) -> QWidget:
         widget = QWidget()
         layout = QVBoxLayout()
@@ -234,6 +322,7 @@ def run():
         dashboard.show()
         dashboard.load_folders()
         dashboard.load_tasks()
+        dashboard.start_change_feed()
 
     def open_login():
         login = LoginWindow(api, device_id, show_dashboard)
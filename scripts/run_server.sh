@@ -8,4 +8,5 @@ if [ -f .env ]; then
   set +a
 fi
 
-exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+# عدد الـ workers من WEB_CONCURRENCY أو نواة لكل worker (انظر deployment/gunicorn.conf.py)
+exec gunicorn -c deployment/gunicorn.conf.py app.main:app
@@ -0,0 +1,49 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="daghbas-tests-")
+atexit.register(shutil.rmtree, _TMP_DIR, ignore_errors=True)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_TMP_DIR}/test.db")
+os.environ.setdefault("STORAGE_ROOT", f"{_TMP_DIR}/storage")
+os.environ.setdefault("LOG_ARCHIVE_ROOT", f"{_TMP_DIR}/archive")
+os.environ.setdefault("EVENTS_SETTLE_MS", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "5")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    res = client.post("/login", json={"username": "admin", "password": "admin123"})
+    assert res.status_code == 200
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+@pytest.fixture
+def folder_id(client, admin_headers):
+    res = client.post("/folders", json={"name": "tests"}, headers=admin_headers)
+    assert res.status_code == 200
+    return res.json()["id"]
+
+
+@pytest.fixture(scope="session")
+def employee_headers(client, admin_headers):
+    client.post(
+        "/users",
+        json={"username": "employee", "password": "employee-123", "role": "Employee"},
+        headers=admin_headers,
+    )
+    res = client.post("/login", json={"username": "employee", "password": "employee-123"})
+    assert res.status_code == 200
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
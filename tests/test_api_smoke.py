@@ -1,6 +1,9 @@
 from fastapi.testclient import TestClient
 
-from app.main import app
+from app import database
+from app.config import settings
+from app.main import ROLE_NAMES, app, seed_defaults
+from app.models import Role, User
 
 
 def test_root_works():
@@ -28,3 +31,48 @@ def test_web_ui_works():
     assert "Dark" in html
     assert "English" in html
     assert "لوحة تحكم الأدمن" in html
+
+
+def test_db_pool_stats_are_admin_only(client, admin_headers, employee_headers):
+    assert client.get("/health/db", headers=employee_headers).status_code == 403
+    stats = client.get("/health/db", headers=admin_headers).json()
+    assert stats["sync"]["pool"]
+
+
+def test_reads_use_replica_except_right_after_own_write(client, admin_headers, monkeypatch):
+    replica = database.Replica(settings.database_url)
+    monkeypatch.setattr(database, "replicas", [replica])
+    admin_id = next(u["id"] for u in client.get("/users", headers=admin_headers).json() if u["username"] == "admin")
+
+    def bound_engine(user_id, token=None):
+        db = database.read_session(user_id, token)
+        try:
+            return db.get_bind()
+        finally:
+            db.close()
+
+    assert bound_engine(admin_id) is replica.engine
+    res = client.post("/folders", json={"name": "replica-sticky"}, headers=admin_headers)
+    token = res.headers["x-write-token"]
+    assert res.cookies.get(database.WRITE_TOKEN_COOKIE) == token
+    # الطابع يأتي مع الطلب وليس من ذاكرة العملية، فأي worker يوجّه القراءة للـ primary
+    assert bound_engine(admin_id) is replica.engine
+    assert bound_engine(admin_id, token) is database.engine
+    assert bound_engine(admin_id + 1, token) is replica.engine
+    assert bound_engine(admin_id, token[:-1] + ("0" if token[-1] != "0" else "1")) is replica.engine
+    assert not database.wrote_recently(admin_id, database.write_token(admin_id, at=0))
+    assert any(f["name"] == "replica-sticky" for f in client.get("/folders", headers=admin_headers).json())
+
+    replica.lag_sec = settings.replica_max_lag_sec + 1
+    assert bound_engine(None) is database.engine
+
+
+def test_seeding_is_idempotent(client):
+    db = database.SessionLocal()
+    try:
+        seed_defaults(db)
+        seed_defaults(db)
+        assert sorted(name for (name,) in db.query(Role.name)) == sorted(ROLE_NAMES)
+        assert db.query(User).filter(User.username == "admin").count() == 1
+    finally:
+        db.close()
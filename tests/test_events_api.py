@@ -0,0 +1,67 @@
+def test_change_feed_resumes_from_cursor(client, admin_headers, folder_id):
+    start = client.get("/events?after=0&limit=500", headers=admin_headers).json()
+    while len(start["events"]) == 500:
+        start = client.get(f"/events?after={start['last_event_id']}&limit=500", headers=admin_headers).json()
+    cursor = start["last_event_id"]
+
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("feed.txt", b"v1")},
+        headers=admin_headers,
+    )
+    file_id = res.json()["id"]
+    client.post(f"/lock/{file_id}", headers=admin_headers)
+    client.post(f"/unlock/{file_id}", headers=admin_headers)
+
+    page = client.get(f"/events?after={cursor}", headers=admin_headers).json()
+    assert [e["kind"] for e in page["events"]] == ["file.created", "file.locked", "file.unlocked"]
+    assert page["events"][0]["data"]["name"] == "feed.txt"
+    assert page["events"][1]["data"]["is_locked"] is True
+
+    resumed = client.get(f"/events?after={page['events'][1]['id']}", headers=admin_headers).json()
+    assert [e["kind"] for e in resumed["events"]] == ["file.unlocked"]
+
+
+def test_event_stream_replays_after_last_event_id(client, admin_headers, folder_id):
+    first = client.get("/events?after=0&limit=1", headers=admin_headers).json()["events"][0]["id"]
+    headers = admin_headers | {"Last-Event-ID": str(first)}
+    body = client.get("/events/stream?timeout=0.2", headers=headers)
+
+    assert body.headers["content-type"].startswith("text/event-stream")
+    assert body.text.startswith("retry: ")
+    ids = [int(line[4:]) for line in body.text.splitlines() if line.startswith("id: ")]
+    assert ids and min(ids) > first
+    assert ids == sorted(ids)
+
+
+def test_changes_returns_compacted_delta(client, admin_headers, folder_id):
+    snapshot = client.get("/changes", headers=admin_headers).json()
+    assert snapshot["snapshot"] is True
+    assert folder_id in [f["id"] for f in snapshot["folders"]]
+    cursor = snapshot["cursor"]
+
+    target = client.post("/folders", json={"name": "sync-target"}, headers=admin_headers).json()["id"]
+    kept = client.post(
+        f"/upload?folder_id={folder_id}", files={"incoming_file": ("kept.txt", b"a")}, headers=admin_headers
+    ).json()["id"]
+    client.put(f"/files/{kept}/save", files={"incoming_file": ("kept.txt", b"ab")}, headers=admin_headers)
+    client.post(f"/lock/{kept}", headers=admin_headers)
+    client.post(f"/files/{kept}/move?target_folder_id={target}", headers=admin_headers)
+    temp = client.post(
+        f"/upload?folder_id={folder_id}", files={"incoming_file": ("temp.txt", b"t")}, headers=admin_headers
+    ).json()["id"]
+    client.delete(f"/files/{temp}", headers=admin_headers)
+
+    delta = client.get(f"/changes?since={cursor}", headers=admin_headers).json()
+    assert delta["snapshot"] is False and delta["has_more"] is False
+    assert [f["id"] for f in delta["folders"]] == [target]
+    assert [f["id"] for f in delta["files"]] == [kept]
+    synced = delta["files"][0]
+    assert (synced["folder_id"], synced["version"], synced["size"], synced["is_locked"]) == (target, 2, 2, True)
+    assert delta["deleted_files"] == []
+
+    client.delete(f"/files/{kept}", headers=admin_headers)
+    after_delete = client.get(f"/changes?since={delta['cursor']}", headers=admin_headers).json()
+    assert after_delete["files"] == [] and after_delete["deleted_files"] == [kept]
+
+    assert client.get(f"/changes?since={after_delete['cursor'] + 1000}", headers=admin_headers).status_code == 410
@@ -0,0 +1,454 @@
+from datetime import datetime, timedelta
+import hashlib
+import time
+
+from app.locks import Lease, lock_events, lock_manager
+
+
+def test_upload_streams_content_and_records_checksum(client, admin_headers, folder_id):
+    payload = b"x" * (3 * 1024 * 1024 + 17)
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("big.bin", payload)},
+        headers=admin_headers,
+    )
+    assert res.status_code == 200
+    body = res.json()
+    assert body["size"] == len(payload)
+    assert body["sha256"] == hashlib.sha256(payload).hexdigest()
+    assert body["version"] == 1
+
+    res = client.get(f"/download/{body['id']}", headers=admin_headers)
+    assert res.status_code == 200
+    assert res.content == payload
+
+
+def test_save_in_place_bumps_version(client, admin_headers, folder_id):
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("doc.txt", b"first")},
+        headers=admin_headers,
+    )
+    file_id = res.json()["id"]
+
+    res = client.put(
+        f"/files/{file_id}/save",
+        files={"incoming_file": ("doc.txt", b"second version")},
+        headers=admin_headers,
+    )
+    assert res.status_code == 200
+    assert res.json()["version"] == 2
+    assert res.json()["size"] == len(b"second version")
+    assert client.get(f"/download/{file_id}", headers=admin_headers).content == b"second version"
+
+
+def test_save_and_move_honour_if_match(client, admin_headers, folder_id):
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("shared.txt", b"base")},
+        headers=admin_headers,
+    )
+    file_id, etag = res.json()["id"], res.json()["etag"]
+
+    def save(content, headers):
+        return client.put(
+            f"/files/{file_id}/save", files={"incoming_file": ("shared.txt", content)}, headers=admin_headers | headers
+        )
+
+    # If-Match مقارنة قوية: الوسم الضعيف لنفس الإصدار لا يطابق
+    assert save(b"weak", {"If-Match": f"W/{etag}"}).status_code == 412
+    first = save(b"alice", {"If-Match": etag})
+    assert first.status_code == 200 and first.json()["version"] == 2
+    stale = save(b"bob", {"If-Match": etag})
+    assert stale.status_code == 412
+    assert stale.headers["etag"] == first.json()["etag"]
+    assert client.get(f"/download/{file_id}", headers=admin_headers).content == b"alice"
+
+    target = client.post("/folders", json={"name": "if-match-target"}, headers=admin_headers).json()["id"]
+    moved = client.post(f"/files/{file_id}/move?target_folder_id={target}&expected_version=1", headers=admin_headers)
+    assert moved.status_code == 412
+    moved = client.post(f"/files/{file_id}/move?target_folder_id={target}&expected_version=2", headers=admin_headers)
+    assert moved.status_code == 200
+
+
+def test_chunked_upload_session_out_of_order(client, admin_headers, folder_id):
+    chunk = 256 * 1024
+    payload = bytes(range(256)) * (chunk * 5 // 2 // 256)
+    res = client.post(
+        "/uploads",
+        json={"folder_id": folder_id, "filename": "chunked.bin", "total_size": len(payload), "chunk_size": chunk},
+        headers=admin_headers,
+    )
+    assert res.status_code == 200
+    session = res.json()
+    assert session["total_chunks"] == 3
+    assert session["missing_ranges"] == [[0, 2]]
+
+    for index in (2, 0, 1):
+        part = payload[index * chunk : (index + 1) * chunk]
+        res = client.put(
+            f"/uploads/{session['id']}/chunks/{index}",
+            files={"chunk": ("part", part)},
+            headers=admin_headers,
+        )
+        assert res.status_code == 200
+        if index == 0:
+            status = client.get(f"/uploads/{session['id']}", headers=admin_headers).json()
+            assert status["received_ranges"] == [[0, 0], [2, 2]]
+            assert status["missing_ranges"] == [[1, 1]]
+
+    res = client.post(
+        f"/uploads/{session['id']}/commit?sha256={hashlib.sha256(payload).hexdigest()}",
+        headers=admin_headers,
+    )
+    assert res.status_code == 200
+    body = res.json()
+    assert body["size"] == len(payload)
+    assert body["saved_in_place"] is False
+    assert client.get(f"/download/{body['id']}", headers=admin_headers).content == payload
+
+
+def test_upload_session_rejects_unbounded_chunking(client, admin_headers, folder_id):
+    def create(total_size, chunk_size):
+        body = {"folder_id": folder_id, "filename": "huge.bin", "total_size": total_size, "chunk_size": chunk_size}
+        return client.post("/uploads", json=body, headers=admin_headers).status_code
+
+    assert create(30_000_000, 1) == 400
+    assert create(30_000_000, 2**31) == 400
+    assert create(2**60, 64 * 1024 * 1024) == 400
+
+
+def test_identical_content_is_stored_once(client, admin_headers, folder_id):
+    from app.storage import BLOBS_ROOT, blob_path
+
+    payload = b"monthly report " * 1000
+    ids = []
+    for name in ("a.pdf", "b.pdf"):
+        res = client.post(
+            f"/upload?folder_id={folder_id}",
+            files={"incoming_file": (name, payload)},
+            headers=admin_headers,
+        )
+        ids.append(res.json()["id"])
+    digest = hashlib.sha256(payload).hexdigest()
+    assert blob_path(digest).exists()
+    assert len([p for p in BLOBS_ROOT.rglob(digest)]) == 1
+
+    client.delete(f"/files/{ids[0]}", headers=admin_headers)
+    assert client.get(f"/download/{ids[1]}", headers=admin_headers).content == payload
+
+
+def test_upload_rewrites_blob_removed_by_concurrent_gc(client, admin_headers, folder_id, monkeypatch):
+    from app import storage
+
+    payload = b"gc race " * 300
+    client.post(f"/upload?folder_id={folder_id}", files={"incoming_file": ("race-a.bin", payload)}, headers=admin_headers)
+    digest = hashlib.sha256(payload).hexdigest()
+
+    # GC حذف الملف بين فحص وجوده وحجز الصف
+    acquire = storage._acquire_blob
+
+    def racing_acquire(db, sha, size):
+        storage.blob_path(sha).unlink(missing_ok=True)
+        return acquire(db, sha, size)
+
+    monkeypatch.setattr(storage, "_acquire_blob", racing_acquire)
+    res = client.post(f"/upload?folder_id={folder_id}", files={"incoming_file": ("race-b.bin", payload)}, headers=admin_headers)
+    monkeypatch.undo()
+    assert storage.blob_path(digest).exists()
+    assert client.get(f"/download/{res.json()['id']}", headers=admin_headers).content == payload
+
+
+def test_version_maintenance_collects_unreferenced_blobs(client, admin_headers, folder_id):
+    from app.storage import blob_path
+    from app.versions import run_version_maintenance
+
+    payload = b"short lived " * 500
+    res = client.post(f"/upload?folder_id={folder_id}", files={"incoming_file": ("gone.bin", payload)}, headers=admin_headers)
+    digest = hashlib.sha256(payload).hexdigest()
+    run_version_maintenance()
+    assert blob_path(digest).exists()
+
+    client.delete(f"/files/{res.json()['id']}", headers=admin_headers)
+    assert run_version_maintenance()["collected_blobs"] >= 1
+    assert not blob_path(digest).exists()
+
+
+def test_version_maintenance_sweeps_files_left_by_failed_saves(client, admin_headers, folder_id):
+    import io
+
+    from app.database import SessionLocal
+    from app.storage import blob_path, ingest_blob
+    from app.versions import run_version_maintenance
+
+    # حفظ خسر سباق الإصدار (412) بعد كتابة الملف: تراجع صف الـ blob وبقي الملف
+    payload = b"rejected save " * 100
+    db = SessionLocal()
+    try:
+        digest = ingest_blob(db, io.BytesIO(payload)).sha256
+        db.rollback()
+    finally:
+        db.close()
+    assert blob_path(digest).exists()
+
+    kept = b"kept content " * 100
+    res = client.post(f"/upload?folder_id={folder_id}", files={"incoming_file": ("kept.bin", kept)}, headers=admin_headers)
+    assert run_version_maintenance()["orphan_blobs"] >= 1
+    assert not blob_path(digest).exists()
+    assert client.get(f"/download/{res.json()['id']}", headers=admin_headers).content == kept
+
+
+def test_download_supports_ranges_and_conditional_get(client, admin_headers, folder_id):
+    payload = bytes(range(256)) * 4
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("ranged.bin", payload)},
+        headers=admin_headers,
+    )
+    file_id = res.json()["id"]
+
+    full = client.get(f"/download/{file_id}", headers=admin_headers)
+    assert full.headers["accept-ranges"] == "bytes"
+    etag = full.headers["etag"]
+
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": "bytes=10-19"})
+    assert res.status_code == 206
+    assert res.headers["content-range"] == f"bytes 10-19/{len(payload)}"
+    assert res.content == payload[10:20]
+
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": "bytes=-4"})
+    assert res.content == payload[-4:]
+
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": "bytes=0-1,100-101"})
+    assert res.status_code == 206
+    assert res.headers["content-type"].startswith("multipart/byteranges")
+    assert payload[100:102] in res.content
+
+    # النطاقات المتداخلة تُدمج في نطاق واحد، والعدد الكبير يعيد الملف كاملًا
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": "bytes=20-29,0-9,10-19,25-34"})
+    assert res.status_code == 206 and res.headers["content-range"].startswith("bytes 0-34/")
+    assert res.content == payload[:35]
+    many = ",".join(f"{i}-{i}" for i in range(0, 40, 2))
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": f"bytes={many}"})
+    assert res.status_code == 200 and res.content == payload
+
+    res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": "bytes=5000-"})
+    assert res.status_code == 416
+
+    ranged = {**admin_headers, "Range": "bytes=0-3"}
+    assert client.get(f"/download/{file_id}", headers={**ranged, "If-Range": etag}).status_code == 206
+    res = client.get(f"/download/{file_id}", headers={**ranged, "If-Range": f"W/{etag}"})
+    assert res.status_code == 200
+    assert res.content == payload
+
+
+def test_range_on_empty_file_is_not_satisfiable(client, admin_headers, folder_id):
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("empty.bin", b"")},
+        headers=admin_headers,
+    )
+    file_id = res.json()["id"]
+
+    for spec in ("bytes=-5", "bytes=0-", "bytes=0-0"):
+        res = client.get(f"/download/{file_id}", headers={**admin_headers, "Range": spec})
+        assert res.status_code == 416
+        assert res.headers["content-range"] == "bytes */0"
+
+
+def test_upload_by_reference_skips_transfer(client, admin_headers, folder_id):
+    payload = b"shared quarterly numbers"
+    digest = hashlib.sha256(payload).hexdigest()
+    reference = {"sha256": digest, "size": len(payload)}
+
+    assert client.post("/files/precheck", json=reference, headers=admin_headers).json()["exists"] is False
+    res = client.post(
+        "/upload/by-reference",
+        json={**reference, "folder_id": folder_id, "filename": "q.xlsx"},
+        headers=admin_headers,
+    )
+    assert res.status_code == 404
+
+    client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("original.xlsx", payload)},
+        headers=admin_headers,
+    )
+    assert client.post("/files/precheck", json=reference, headers=admin_headers).json()["exists"] is True
+
+    res = client.post(
+        "/upload/by-reference",
+        json={**reference, "folder_id": folder_id, "filename": "q.xlsx"},
+        headers=admin_headers,
+    )
+    assert res.status_code == 200
+    file_id = res.json()["id"]
+    assert client.get(f"/download/{file_id}", headers=admin_headers).content == payload
+
+    res = client.put(f"/files/{file_id}/save/by-reference", json=reference, headers=admin_headers)
+    assert res.json()["version"] == 2
+
+
+def test_delta_save_rebuilds_identical_content(client, admin_headers, folder_id):
+    import json
+    import random
+
+    from app.delta import compute_delta
+
+    rng = random.Random(7)
+    base = bytes(rng.getrandbits(8) for _ in range(40_000))
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("sheet.xlsx", base)},
+        headers=admin_headers,
+    )
+    file_id = res.json()["id"]
+
+    signatures = client.get(f"/files/{file_id}/signatures?block_size=1024", headers=admin_headers).json()
+    assert signatures["version"] == 1
+    assert len(signatures["blocks"]) == 40
+
+    edited = base[:5000] + b"changed cell" + base[5100:30000] + base[31000:] + b"tail"
+    ops, literals = compute_delta(signatures["blocks"], 1024, edited)
+    assert len(literals) < len(edited) // 4
+
+    res = client.put(
+        f"/files/{file_id}/save/delta?base_version=1&sha256={hashlib.sha256(edited).hexdigest()}",
+        data={"instructions": json.dumps(ops)},
+        files={"literals": ("delta", literals)},
+        headers=admin_headers,
+    )
+    assert res.status_code == 200
+    assert res.json()["version"] == 2
+    assert res.json()["sha256"] == hashlib.sha256(edited).hexdigest()
+    assert client.get(f"/download/{file_id}", headers=admin_headers).content == edited
+
+    res = client.put(
+        f"/files/{file_id}/save/delta?base_version=1",
+        data={"instructions": json.dumps(ops)},
+        files={"literals": ("delta", literals)},
+        headers=admin_headers,
+    )
+    assert res.status_code == 412
+
+
+def test_lock_lease_expires_and_can_be_renewed(client, admin_headers, employee_headers, folder_id):
+    res = client.post(
+        f"/upload?folder_id={folder_id}", files={"incoming_file": ("lease.txt", b"v1")}, headers=employee_headers
+    )
+    file_id = res.json()["id"]
+
+    lock = client.post(f"/lock/{file_id}?ttl_sec=1", headers=employee_headers)
+    assert lock.status_code == 200 and lock.json()["expires_at"]
+    assert client.post(f"/lock/{file_id}/renew?ttl_sec=1", headers=employee_headers).status_code == 200
+    assert [row["file_id"] for row in client.get("/locks/mine", headers=employee_headers).json()] == [file_id]
+
+    # مستخدم آخر (غير أدمن) لا يستطيع الحفظ أثناء القفل، ويستطيع بعد انتهاء المهلة بدون فك صريح
+    other = client.post(
+        "/users", json={"username": "lease-other", "password": "pass-123", "role": "Employee"}, headers=admin_headers
+    )
+    assert other.status_code == 200
+    token = client.post("/login", json={"username": "lease-other", "password": "pass-123"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {token}"}
+
+    def save():
+        return client.put(f"/files/{file_id}/save", files={"incoming_file": ("lease.txt", b"v2")}, headers=other_headers)
+
+    assert client.post(f"/lock/{file_id}", headers=other_headers).status_code == 409
+    assert save().status_code == 409
+
+    time.sleep(1.1)
+    assert save().status_code == 200
+    assert client.get("/locks/mine", headers=employee_headers).json() == []
+    assert client.post(f"/lock/{file_id}/renew", headers=employee_headers).status_code == 409
+    assert client.post(f"/lock/{file_id}", headers=other_headers).status_code == 200
+
+
+def test_bulk_operations_report_per_file_results(client, admin_headers, employee_headers, folder_id):
+    ids = [
+        client.post(
+            f"/upload?folder_id={folder_id}", files={"incoming_file": (f"bulk{i}.txt", b"x")}, headers=admin_headers
+        ).json()["id"]
+        for i in range(3)
+    ]
+    target = client.post("/folders", json={"name": "bulk-target"}, headers=admin_headers).json()["id"]
+    assert client.post(f"/lock/{ids[0]}", headers=admin_headers).status_code == 200
+
+    moved = client.post(
+        "/files/bulk/move", json={"file_ids": ids + [999999], "target_folder_id": target}, headers=employee_headers
+    ).json()
+    assert [r["status"] for r in moved["results"]] == ["locked", "ok", "ok", "not_found"]
+    assert (moved["succeeded"], moved["failed"]) == (2, 2)
+    listed = client.get(f"/folders/{target}/files", headers=admin_headers).json()["items"]
+    assert sorted(f["id"] for f in listed) == ids[1:]
+
+    locked = client.post("/files/bulk/lock", json={"file_ids": ids[1:]}, headers=employee_headers).json()
+    assert locked["succeeded"] == 2
+    assert client.post("/files/bulk/delete", json={"file_ids": ids}, headers=admin_headers).json()["succeeded"] == 3
+    assert client.get(f"/download/{ids[0]}", headers=admin_headers).status_code == 404
+    assert client.get(f"/folders/{target}/files", headers=admin_headers).json()["items"] == []
+
+
+def test_bulk_writes_recheck_locks_in_the_statement(client, admin_headers, employee_headers, folder_id, monkeypatch):
+    from app.database import SessionLocal
+    from app.models import ChangeEvent, FileRecord
+    from app.routers import bulk
+
+    ids = [
+        client.post(
+            f"/upload?folder_id={folder_id}", files={"incoming_file": (f"race{i}.txt", b"r")}, headers=admin_headers
+        ).json()["id"]
+        for i in range(2)
+    ]
+    assert client.post(f"/lock/{ids[0]}", headers=admin_headers).status_code == 200
+    target = client.post("/folders", json={"name": "race-target"}, headers=admin_headers).json()["id"]
+
+    # قراءة أولى قديمة لا ترى القفل؛ شرط WHERE في التحديث نفسه يجب أن يمنع النقل والحذف
+    monkeypatch.setattr(bulk, "_editable", lambda ids, records, current: ([records[i] for i in ids], {}))
+    moved = client.post(
+        "/files/bulk/move", json={"file_ids": ids, "target_folder_id": target}, headers=employee_headers
+    ).json()
+    deleted = client.post("/files/bulk/delete", json={"file_ids": [ids[0]]}, headers=employee_headers).json()
+    monkeypatch.undo()
+    assert [r["status"] for r in moved["results"]] == ["locked", "ok"]
+    assert deleted["results"][0]["status"] == "locked"
+    db = SessionLocal()
+    try:
+        assert db.get(FileRecord, ids[0]).folder_id == folder_id
+
+        # فك قفل ملف غير مقفل لا يُنتج حدثًا ولا سجلًا
+        before = db.query(ChangeEvent).filter(ChangeEvent.entity_id == ids[1], ChangeEvent.kind == "file.unlocked").count()
+        res = client.post("/files/bulk/unlock", json={"file_ids": [ids[1]]}, headers=employee_headers).json()
+        assert res["results"][0]["status"] == "ok"
+        after = db.query(ChangeEvent).filter(ChangeEvent.entity_id == ids[1], ChangeEvent.kind == "file.unlocked").count()
+        assert after == before
+    finally:
+        db.close()
+
+
+def test_unlock_clears_lock_tables_of_other_workers(client, admin_headers, employee_headers, folder_id, monkeypatch):
+    res = client.post(
+        f"/upload?folder_id={folder_id}", files={"incoming_file": ("epoch.txt", b"v1")}, headers=employee_headers
+    )
+    file_id = res.json()["id"]
+    assert client.post(f"/lock/{file_id}", headers=employee_headers).status_code == 200
+    assert client.post(f"/unlock/{file_id}", headers=employee_headers).status_code == 200
+
+    # worker آخر ما زال يحفظ القفل في ذاكرته؛ حدث file.unlocked يجعله يسقط هذا الملف قبل رفض الحجز
+    holder = next(u["id"] for u in client.get("/users", headers=admin_headers).json() if u["username"] == "employee")
+    far = datetime.utcnow() + timedelta(hours=1)
+    lock_manager.put(Lease(file_id, holder, far, far))
+    monkeypatch.setattr(lock_events, "_checked_at", 0.0)
+    other = far + timedelta(hours=1)
+    lock_manager.put(Lease(999999, holder, other, other))
+
+    client.post("/users", json={"username": "epoch-other", "password": "pass-123", "role": "Employee"}, headers=admin_headers)
+    token = client.post("/login", json={"username": "epoch-other", "password": "pass-123"}).json()["access_token"]
+    assert client.post(f"/lock/{file_id}", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    # الإبطال لكل ملف على حدة: أقفال الملفات الأخرى تبقى في الذاكرة
+    assert lock_manager.get(999999) is not None
+    lock_manager.drop(999999)
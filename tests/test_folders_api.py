@@ -0,0 +1,90 @@
+import io
+import zipfile
+
+
+def _upload(client, headers, folder_id, name, payload):
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": (name, payload)},
+        headers=headers,
+    )
+    assert res.status_code == 200
+    return res.json()["id"]
+
+
+def test_list_folder_files_pages_with_cursor(client, admin_headers, folder_id):
+    for i in range(7):
+        _upload(client, admin_headers, folder_id, f"file-{i:02d}.txt", b"x" * (i + 1))
+
+    names, cursor = [], None
+    while True:
+        url = f"/folders/{folder_id}/files?limit=3" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url, headers=admin_headers).json()
+        names += [item["name"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert names == [f"file-{i:02d}.txt" for i in range(7)]
+
+    page = client.get(f"/folders/{folder_id}/files?sort=size&order=desc&limit=2", headers=admin_headers).json()
+    assert [item["size"] for item in page["items"]] == [7, 6]
+    page = client.get(
+        f"/folders/{folder_id}/files?sort=size&order=desc&limit=2&cursor={page['next_cursor']}",
+        headers=admin_headers,
+    ).json()
+    assert [item["size"] for item in page["items"]] == [5, 4]
+
+    assert client.get(f"/folders/{folder_id}/files?locked=true", headers=admin_headers).json()["items"] == []
+    assert client.get(f"/folders/{folder_id}/files?cursor=garbage", headers=admin_headers).status_code == 400
+
+
+def test_folder_tree_paths_follow_moves(client, admin_headers):
+    def create(name, parent_id=None):
+        res = client.post("/folders", json={"name": name, "parent_id": parent_id}, headers=admin_headers)
+        return res.json()["id"]
+
+    projects = create("projects")
+    alpha = create("alpha", projects)
+    drawings = create("drawings", alpha)
+    archive = create("archive")
+    _upload(client, admin_headers, drawings, "plan.dwg", b"0123456789")
+
+    children = client.get(f"/folders/tree?parent_id={projects}", headers=admin_headers).json()
+    assert [(n["name"], n["has_children"]) for n in children] == [("alpha", True)]
+
+    stats = client.get(f"/folders/{projects}/stats", headers=admin_headers).json()
+    assert stats == {"folder_id": projects, "folder_count": 3, "file_count": 1, "total_bytes": 10}
+
+    assert client.post(f"/folders/{projects}/move?target_parent_id={drawings}", headers=admin_headers).status_code == 409
+    assert client.post(f"/folders/{alpha}/move?target_parent_id={archive}", headers=admin_headers).status_code == 200
+
+    ancestors = client.get(f"/folders/{drawings}/ancestors", headers=admin_headers).json()
+    assert [n["name"] for n in ancestors] == ["archive", "alpha"]
+    assert ancestors[-1]["depth"] == 1
+    subtree = client.get(f"/folders/{archive}/subtree", headers=admin_headers).json()
+    assert [n["name"] for n in subtree] == ["archive", "alpha", "drawings"]
+    assert client.get(f"/folders/{projects}/stats", headers=admin_headers).json()["file_count"] == 0
+
+    assert client.delete(f"/folders/{archive}", headers=admin_headers).status_code == 409
+
+
+def test_folder_and_selection_download_as_streamed_zip(client, admin_headers):
+    root = client.post("/folders", json={"name": "project"}, headers=admin_headers).json()["id"]
+    sub = client.post("/folders", json={"name": "images", "parent_id": root}, headers=admin_headers).json()["id"]
+    notes = _upload(client, admin_headers, root, "notes.txt", b"hello " * 1000)
+    photo = _upload(client, admin_headers, sub, "photo.jpg", b"\xff\xd8" + b"x" * 500)
+    other = _upload(client, admin_headers, sub, "notes.txt", b"other")
+
+    res = client.get(f"/folders/{root}/download", headers=admin_headers)
+    assert res.status_code == 200 and res.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(res.content)) as archive:
+        assert sorted(archive.namelist()) == ["project/images/notes.txt", "project/images/photo.jpg", "project/notes.txt"]
+        assert archive.read("project/notes.txt") == b"hello " * 1000
+        assert archive.getinfo("project/images/photo.jpg").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("project/notes.txt").compress_type == zipfile.ZIP_DEFLATED
+
+    res = client.post("/download/zip", json={"file_ids": [notes, other, photo]}, headers=admin_headers)
+    with zipfile.ZipFile(io.BytesIO(res.content)) as archive:
+        assert archive.namelist() == ["notes.txt", "notes (2).txt", "photo.jpg"]
+        assert archive.read("notes (2).txt") == b"other"
+    assert client.post("/download/zip", json={"file_ids": [999999]}, headers=admin_headers).status_code == 404
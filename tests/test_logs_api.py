@@ -0,0 +1,148 @@
+from app.audit import audit_writer
+
+
+def test_audit_events_are_written_after_commit(client, admin_headers, folder_id):
+    res = client.post(
+        f"/upload?folder_id={folder_id}",
+        files={"incoming_file": ("audited.txt", b"audit me")},
+        headers=admin_headers,
+    )
+    file_id = str(res.json()["id"])
+    client.get(f"/download/{file_id}", headers=admin_headers)
+    client.delete(f"/files/{file_id}", headers=admin_headers)
+
+    audit_writer.flush()
+    rows = client.get("/logs", headers=admin_headers).json()
+    actions = {r["action"] for r in rows if r["target_id"] == file_id}
+    assert {"upload", "download", "delete"} <= actions
+
+
+def test_logs_keyset_pagination_and_filters(client, admin_headers):
+    for i in range(5):
+        client.post("/tasks", json={"title": f"t{i}", "assigned_to": 1}, headers=admin_headers)
+    audit_writer.flush()
+
+    seen, cursor = [], None
+    while True:
+        url = "/logs?action=task_create&limit=2" + (f"&cursor={cursor}" if cursor else "")
+        res = client.get(url, headers=admin_headers)
+        seen += res.json()
+        cursor = res.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert len(seen) == 5
+    assert {r["action"] for r in seen} == {"task_create"}
+    keys = [(r["timestamp"], r["id"]) for r in seen]
+    assert keys == sorted(keys, reverse=True)
+
+    assert client.get("/logs?since=2999-01-01T00:00:00", headers=admin_headers).json() == []
+
+
+def test_logs_export_streams_csv_and_gzip_ndjson(client, admin_headers):
+    import gzip
+    import json
+
+    client.post("/tasks", json={"title": "export me", "assigned_to": 1}, headers=admin_headers)
+    audit_writer.flush()
+
+    res = client.get("/logs/export?action=task_create", headers=admin_headers)
+    assert res.status_code == 200
+    lines = res.text.strip().splitlines()
+    assert lines[0] == "id,timestamp,user_id,action,target_type,target_id"
+    assert len(lines) > 1 and all(",task_create," in line for line in lines[1:])
+
+    res = client.get("/logs/export?format=ndjson&gzip=true&action=task_create", headers=admin_headers)
+    rows = [json.loads(line) for line in gzip.decompress(res.content).decode().splitlines()]
+    assert rows and {r["action"] for r in rows} == {"task_create"}
+
+
+def test_log_maintenance_rolls_over_and_archives_old_months(client, admin_headers):
+    from datetime import datetime, timedelta
+
+    from app.audit import _write_batch
+    from app.log_archive import run_log_maintenance
+
+    now = datetime.utcnow()
+    recent = now.replace(day=1) - timedelta(days=20)
+    ancient = now.replace(day=1) - timedelta(days=400)
+    _write_batch(
+        [
+            {"user_id": 1, "action": "old_save", "target_type": "file", "target_id": "r1", "timestamp": recent},
+            {"user_id": 1, "action": "old_save", "target_type": "file", "target_id": "a1", "timestamp": ancient},
+        ]
+    )
+
+    summary = run_log_maintenance(retention_months=12, hot_months=1)
+    assert f"logs_p{recent:%Y%m}" in summary["rolled"]
+    assert any(path.endswith(f"logs-{ancient:%Y%m}.ndjson.gz") for path in summary["archived"])
+
+    rows = client.get("/logs?action=old_save", headers=admin_headers).json()
+    assert [r["target_id"] for r in rows] == ["r1"]
+
+    archives = client.get("/logs/archives", headers=admin_headers).json()
+    assert f"{ancient:%Y%m}" in {a["month"] for a in archives}
+    res = client.get(f"/logs/archives/{ancient:%Y%m}?action=old_save", headers=admin_headers)
+    assert '"target_id": "a1"' in res.text
+
+
+def test_log_archive_rerun_replaces_and_accepts_aware_filters(client, admin_headers, monkeypatch):
+    from datetime import datetime, timedelta
+
+    import pytest
+    from sqlalchemy.exc import OperationalError
+
+    from app.audit import _write_batch
+    from app.database import engine
+    from app.log_archive import _archive_partition, run_log_maintenance
+
+    month = datetime.utcnow().replace(day=1) - timedelta(days=70)
+    _write_batch([{"user_id": 1, "action": "rerun_save", "target_type": "file", "target_id": "z", "timestamp": month}])
+    run_log_maintenance(retention_months=12, hot_months=1)
+
+    # الفصل يفشل بعد كتابة الأرشيف ثم يعاد التشغيل
+    name = f"logs_p{month:%Y%m}"
+    monkeypatch.setattr("app.log_archive.PARTITIONED_LOGS", True)
+    with pytest.raises(OperationalError), engine.begin() as conn:
+        _archive_partition(conn, name)
+    monkeypatch.setattr("app.log_archive.PARTITIONED_LOGS", False)
+    with engine.begin() as conn:
+        _archive_partition(conn, name)
+
+    since = (month - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    res = client.get(f"/logs/archives/{month:%Y%m}?action=rerun_save&since={since}", headers=admin_headers)
+    assert res.status_code == 200 and res.text.count('"target_id": "z"') == 1
+    res = client.get(f"/logs?since={since}", headers=admin_headers)
+    assert res.status_code == 200
+
+
+def test_log_ids_are_not_reused_after_rollover(client, admin_headers):
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import func, select
+
+    from app.audit import _write_batch
+    from app.database import engine
+    from app.log_archive import LOGS, run_log_maintenance
+
+    last_month = datetime.utcnow().replace(day=1) - timedelta(days=5)
+    _write_batch([{"user_id": 1, "action": "rolled_id", "target_type": "file", "target_id": "x", "timestamp": last_month}])
+    with engine.connect() as conn:
+        rolled_id = conn.execute(select(func.max(LOGS.c.id))).scalar()
+
+    run_log_maintenance(retention_months=12, hot_months=1)
+    _write_batch([{"user_id": 1, "action": "fresh_id", "target_type": "file", "target_id": "y", "timestamp": datetime.utcnow()}])
+    with engine.connect() as conn:
+        assert conn.execute(select(func.max(LOGS.c.id))).scalar() > rolled_id
+
+
+def test_full_audit_queue_falls_back_after_first_rejection(monkeypatch):
+    from app import audit
+
+    calls, written = [], []
+    monkeypatch.setattr(audit.audit_writer, "submit", lambda row: calls.append(row) or len(calls) < 2)
+    monkeypatch.setattr(audit, "_write_batch", written.append)
+
+    rows = [audit._row(1, "bulk_move", "file", str(i)) for i in range(5000)]
+    audit._submit_or_write(rows)
+    assert len(calls) == 2
+    assert written == [rows[1:]]
@@ -0,0 +1,68 @@
+from passlib.hash import bcrypt
+
+from app.database import SessionLocal
+from app.models import User
+from app.security import password_pool
+
+
+def test_deactivating_user_invalidates_cached_principal(client, admin_headers):
+    res = client.post(
+        "/users",
+        json={"username": "temp-employee", "password": "pass-123", "role": "Employee"},
+        headers=admin_headers,
+    )
+    user_id = res.json()["id"]
+    token = client.post("/login", json={"username": "temp-employee", "password": "pass-123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/tasks/my", headers=headers).status_code == 200
+    assert client.get("/events", headers=headers).status_code == 200
+    assert client.get("/logs", headers=headers).status_code == 403
+
+    client.patch(f"/users/{user_id}?role=Manager", headers=admin_headers)
+    assert client.get("/logs", headers=headers).status_code == 200
+
+    client.patch(f"/users/{user_id}?is_active=false", headers=admin_headers)
+    assert client.get("/tasks/my", headers=headers).status_code == 401
+    assert client.get("/events", headers=headers).status_code == 401
+
+
+def test_login_upgrades_weak_hash_and_sheds_load(client, admin_headers, monkeypatch):
+    client.post(
+        "/users", json={"username": "weak-hash", "password": "pass-123", "role": "Employee"}, headers=admin_headers
+    )
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.username == "weak-hash").update({User.password_hash: bcrypt.using(rounds=4).hash("pass-123")})
+        db.commit()
+    finally:
+        db.close()
+
+    assert client.post("/login", json={"username": "weak-hash", "password": "pass-123"}).status_code == 200
+    db = SessionLocal()
+    try:
+        assert db.query(User.password_hash).filter(User.username == "weak-hash").scalar().startswith("$2b$05$")
+    finally:
+        db.close()
+
+    monkeypatch.setattr(password_pool, "_pending", password_pool._max_pending)
+    busy = client.post("/login", json={"username": "weak-hash", "password": "pass-123"})
+    assert busy.status_code == 503 and busy.headers["Retry-After"]
+
+
+def test_duplicate_username_is_rejected_before_hashing(client, admin_headers, monkeypatch):
+    payload = {"username": "dup-user", "password": "pass-123", "role": "Employee"}
+    assert client.post("/users", json=payload, headers=admin_headers).status_code == 200
+
+    async def no_hash(password):
+        raise AssertionError("hashed a duplicate username")
+
+    monkeypatch.setattr("app.routers.users.hash_password_async", no_hash)
+    res = client.post("/users", json=payload, headers=admin_headers)
+    assert res.status_code == 409
+    monkeypatch.undo()
+
+    # طلب متزامن تجاوز الفحص: القيد الفريد يعيد 409 أيضًا
+    monkeypatch.setattr("app.routers.users._check_new_user", lambda db, payload: 1)
+    res = client.post("/users", json=payload, headers=admin_headers)
+    assert res.status_code == 409
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import update
+
+from app.database import SessionLocal
+from app.models import FileVersion
+from app.storage import blob_path, packed_blob_path
+from app.versions import _versions_to_drop, compress_old_versions
+
+
+def test_versions_can_be_listed_downloaded_and_restored(client, admin_headers, folder_id):
+    res = client.post(
+        f"/upload?folder_id={folder_id}", files={"incoming_file": ("history.txt", b"one")}, headers=admin_headers
+    )
+    file_id = res.json()["id"]
+    second = b"two " * 500
+    for content in (second, b"three"):
+        client.put(f"/files/{file_id}/save", files={"incoming_file": ("history.txt", content)}, headers=admin_headers)
+
+    versions = client.get(f"/files/{file_id}/versions", headers=admin_headers).json()
+    assert [(v["version"], v["is_current"]) for v in versions] == [(3, True), (2, False), (1, False)]
+    assert client.get(f"/files/{file_id}/versions/1/download", headers=admin_headers).content == b"one"
+
+    stale = client.post(f"/files/{file_id}/versions/1/restore", headers=admin_headers | {"If-Match": '"v2-x"'})
+    assert stale.status_code == 412
+    current_etag = client.get(f"/download/{file_id}", headers=admin_headers).headers["etag"]
+    restored = client.post(f"/files/{file_id}/versions/1/restore", headers=admin_headers | {"If-Match": current_etag})
+    assert restored.status_code == 200 and restored.json()["version"] == 4
+    assert client.get(f"/download/{file_id}", headers=admin_headers).content == b"one"
+
+    # إصدار قديم لا يشير إليه أي ملف حالي يُضغط ويبقى قابلًا للتنزيل
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(FileVersion)
+            .where(FileVersion.file_id == file_id, FileVersion.version == 2)
+            .values(created_at=datetime.utcnow() - timedelta(days=90))
+        )
+        db.commit()
+        digest = db.query(FileVersion.sha256).filter_by(file_id=file_id, version=2).scalar()
+        assert compress_old_versions(db, older_than_days=30) >= 1
+    finally:
+        db.close()
+    assert packed_blob_path(digest).exists() and not blob_path(digest).exists()
+    assert client.get(f"/files/{file_id}/versions/2/download", headers=admin_headers).content == second
+
+
+def test_retention_keeps_recent_then_daily_then_weekly():
+    now = datetime(2026, 3, 31, 12, 0)
+    rows = [SimpleNamespace(version=v, created_at=now - timedelta(hours=6 * (40 - v))) for v in range(1, 41)]
+    rows += [
+        SimpleNamespace(version=-3, created_at=now - timedelta(weeks=3)),
+        SimpleNamespace(version=-4, created_at=now - timedelta(weeks=3, hours=1)),
+        SimpleNamespace(version=-20, created_at=now - timedelta(weeks=20)),
+    ]
+
+    dropped = {row.version for row in _versions_to_drop(rows, now)}
+    kept = [row for row in rows if row.version not in dropped]
+    assert {row.version for row in kept} >= set(range(31, 41))
+    daily = [row.created_at.date() for row in kept if 0 < row.version < 31 and row.created_at >= now - timedelta(days=7)]
+    assert daily and len(daily) == len(set(daily))
+    assert -3 not in dropped
+    assert {-4, -20} <= dropped